@@ -1,12 +1,15 @@
 import csv
+import json
 import sys
+import time
 import uuid
 from datetime import datetime as dt
 from pathlib import Path
 from urllib.parse import urljoin
 
+import click
 import sqlalchemy.exc as exc
-from flask import Blueprint, Response, jsonify, request, send_file, g
+from flask import Blueprint, Response, current_app, jsonify, request, send_file, g
 from flask.helpers import send_file
 from geojson import FeatureCollection
 from werkzeug.exceptions import Forbidden, BadRequest
@@ -20,13 +23,22 @@ from ref_geo.models import BibAreasTypes, LAreas, LiMunicipalities
 from geonature.utils.config import config
 from geonature.utils.env import DB, ROOT_DIR, BACKEND_DIR
 from pypnnomenclature.models import TNomenclatures
-from pypnusershub.db.models import Organisme, User
-from sqlalchemy import desc, func, text
-from sqlalchemy.orm import aliased
+from pypnusershub.db.models import User
+from sqlalchemy import desc, func
 from utils_flask_sqla.generic import GenericQuery
 from utils_flask_sqla.response import json_resp_accept_empty_list, json_resp
 
 from .api_error import ZHApiError
+from .cache import (
+    LABELS_DATA,
+    NOTES_DATA,
+    RULES_DATA,
+    get_response_cache,
+    get_version,
+    get_version_date,
+    make_key,
+)
+from .constants import DONE
 from .forms import (
     create_zh,
     post_file_info,
@@ -53,7 +65,7 @@ from .forms import (
 
 # from .forms import *
 from .geometry import set_area, set_geom
-from .hierarchy import Hierarchy, get_all_hierarchy_fields
+from .hierarchy import Hierarchy, get_all_hierarchy_fields, get_hierarchy_ranking
 from .model.cards import Card
 from .model.repositories import ZhRepository
 from .model.zh import ZH
@@ -68,10 +80,27 @@ from .model.zh_schema import (
     THydroArea,
     TReferences,
     TRiverBasin,
+    get_rights_table,
 )
 from .nomenclatures import get_ch, get_nomenc
+from .pagination import get_sort_column, seek_page
 from .pdf import gen_pdf
-from .search import main_search
+from .pdf_exports import get_export, get_export_status, submit_export
+from .pdf_exports import run_workers as run_pdf_workers
+from .rescoring import enqueue_rescoring, get_rescoring_jobs, publish_notes_summary, run_workers
+from .scoring import get_unpublished_job, rescore_zh, score_hierarchies
+from .scoring_kernel import get_dependent_rules
+from .search import (
+    LIST_MODES,
+    filter_scope,
+    get_facets,
+    get_light_feature,
+    get_light_query,
+    get_list_query,
+    get_total,
+    main_search,
+)
+from .simulation import simulate_rules
 from .upload import upload_process
 from .utils import (
     check_ref_geo_schema,
@@ -89,26 +118,29 @@ blueprint = Blueprint("pr_zh", __name__, "./static", template_folder="templates"
 @blueprint.route("", methods=["GET", "POST"])
 @permissions.check_cruved_scope("R", get_scope=True, module_code="ZONES_HUMIDES")
 def get_zh(scope):
-    # try:
-    coauthor = aliased(User, name="coauthor")
-    coorganism = aliased(Organisme, name="coorganism")
-    q = (
-        DB.session.query(TZH)
-        .join(TNomenclatures, TZH.sdage)
-        .join(User, TZH.authors)
-        .join(coauthor, TZH.coauthors)
-        .join(Organisme, User.organisme)
-        .join(coorganism, coauthor.organisme)
-    )
+    q = get_list_query()
 
     parameters = request.args
     limit = parameters.get("limit", 100, int)
     page = parameters.get("offset", 0, int)
     orderby = parameters.get("orderby", "update_date", str)
     order = parameters.get("order", "desc", str)
-
-    if request.is_json:
-        q = main_search(q, request.json)
+    # keyset pagination if cursor is given (empty for the first page)
+    cursor = parameters.get("cursor", None, str)
+    count = parameters.get("count", "exact", str)
+    mode = parameters.get("mode", "full", str)
+    # light mode: map list columns to select, all the available ones by default
+    available_columns = [column["prop"] for column in blueprint.config["available_maplist_column"]]
+    columns = parameters.get("columns", None, str)
+    columns = available_columns if columns is None else columns.split(",")
+    if mode not in LIST_MODES:
+        raise BadRequest(f"mode must be one of {', '.join(LIST_MODES)}")
+
+    # the zh the user cannot read are never fetched nor counted
+    q = filter_scope(q, g.current_user, scope)
+    search = request.json if request.is_json else None
+    if search:
+        q = main_search(q, search)
 
     return get_all_zh(
         info_role=g.current_user,
@@ -117,48 +149,66 @@ def get_zh(scope):
         page=page,
         orderby=orderby,
         order=order,
+        cursor=cursor,
+        count=count,
+        search=search,
+        scope=scope,
+        mode=mode,
+        columns=[column for column in columns if column in available_columns],
     )
 
 
-def get_all_zh(info_role, query, limit, page, orderby=None, order="asc"):
+def get_all_zh(
+    info_role,
+    query,
+    limit,
+    page,
+    orderby=None,
+    order="asc",
+    cursor=None,
+    count="exact",
+    search=None,
+    scope=None,
+    mode="full",
+    columns=(),
+):
     # try:
     # Pour obtenir le nombre de résultat de la requete sans le LIMIT
-    nb_results_without_limit = query.count()
+    nb_results_without_limit = get_total(query, count, search, scope, info_role)
     user = info_role
     user_cruved = get_user_cruved()
 
-    if orderby in TZH.__table__.columns:
-        col = getattr(TZH, orderby, None)
+    if mode == "light":
+        query = get_light_query(query, columns)
+
+    next_cursor = None
+    if cursor is not None:
+        data, next_cursor = seek_page(query, orderby, order, cursor, limit)
+    else:
+        col = get_sort_column(orderby)
         if col is not None:
             if order == "desc":
                 col = col.desc()
             query = query.order_by(col)
 
-    if orderby in ["sdage", "author", "update_author", "organism", "update_organism"]:
-        if orderby == "sdage":
-            desc_query = TNomenclatures.label_default
-        elif orderby == "author":
-            desc_query = User.nom_role
-        elif orderby == "update_author":
-            desc_query = text("coauthor.nom_role")
-        elif orderby == "organism":
-            desc_query = Organisme.nom_organisme
-        elif orderby == "update_organism":
-            desc_query = text("coorganism.nom_organisme")
-        if order == "desc":
-            desc_query = desc(desc_query)
-        query = query.order_by(desc_query)
-
-    # Order by id because there can be ambiguity in order_by(col) depending
-    # on the column so add on order_by id makes it clearer
-    data = query.order_by(TZH.id_zh).limit(limit).offset(page * limit).all()
+        # Order by id because there can be ambiguity in order_by(col) depending
+        # on the column so add on order_by id makes it clearer
+        data = query.order_by(TZH.id_zh).limit(limit).offset(page * limit).all()
     is_ref_geo = check_ref_geo_schema()
 
+    # the rights only depend on the zh author and its organism
+    rights = get_rights_table(user_cruved)
     featureCollection = []
     for n in data:
-        releve_cruved = n.get_releve_cruved(user, user_cruved)
-        feature = n.get_geofeature(relationships=())
-        feature["properties"]["rights"] = releve_cruved
+        if mode == "light":
+            feature = get_light_feature(n, columns)
+            author_organism = n.author_id_organisme
+        else:
+            feature = n.get_geofeature(relationships=())
+            author_organism = n.authors.id_organisme
+        feature["properties"]["rights"] = rights[
+            (user.id_role == n.create_author, user.id_organisme == author_organism)
+        ]
         featureCollection.append(feature)
 
     return jsonify(
@@ -167,12 +217,36 @@ def get_all_zh(info_role, query, limit, page, orderby=None, order="asc"):
             "total_filtered": len(data),
             "page": page,
             "limit": limit,
+            "next_cursor": next_cursor,
             "items": FeatureCollection(featureCollection),
             "check_ref_geo": is_ref_geo,
         }
     )
 
 
+@blueprint.route("/facets", methods=["POST"])
+@permissions.check_cruved_scope("R", get_scope=True, module_code="ZONES_HUMIDES")
+@json_resp
+def get_zh_facets(scope):
+    """Number of zh for each value of the search filters"""
+    try:
+        q = filter_scope(get_list_query(), g.current_user, scope)
+        search = request.json if request.is_json else None
+        if search:
+            q = main_search(q, search)
+        return get_facets(q), 200
+    except Exception as e:
+        if e.__class__.__name__ == "ZHApiError":
+            raise ZHApiError(message=str(e.message), details=str(e.details))
+        exc_type, value, tb = sys.exc_info()
+        raise ZHApiError(
+            message="get_zh_facets_error",
+            details=str(exc_type) + ": " + str(e.with_traceback(tb)),
+        )
+    finally:
+        DB.session.close()
+
+
 # Route pour afficher liste des zones humides
 @blueprint.route("/check_ref_geo", methods=["GET"])
 @permissions.check_cruved_scope("R", module_code="ZONES_HUMIDES")
@@ -195,44 +269,79 @@ def check_ref_geo():
 
 @blueprint.route("/<int:id_zh>", methods=["GET"])
 @permissions.check_cruved_scope("R", module_code="ZONES_HUMIDES")
-@json_resp
 def get_zh_by_id(id_zh):
     """Get zh form data by id"""
     # try:
     zh = ZH(id_zh)
     user_cruved = get_user_cruved()
     if zh.zh.user_is_allowed_to(g.current_user, user_cruved["R"]):
-        return zh.__repr__()
+        return get_cached_response(zh, "zh", zh.__repr__)
     else:
         raise Forbidden(f"User is not allowed to read ZH {zh.zh.main_name} - {zh.zh.code}")
 
 
 @blueprint.route("/<int:id_zh>/complete_card", methods=["GET"])
 @permissions.check_cruved_scope("R", module_code="ZONES_HUMIDES")
-@json_resp
 def get_complete_info(id_zh):
     """Get zh complete info"""
     zh = ZH(id_zh)
     user_cruved = get_user_cruved()
     if zh.zh.user_is_allowed_to(g.current_user, user_cruved["R"]):
         # get other referentials needed for the module from the config file
-        return get_complete_card(id_zh)
+        # the card also changes with the rules, the hierarchy notes (written
+        # by the rescoring queue) and the labels
+        return get_cached_response(
+            zh,
+            "complete_card",
+            lambda: get_complete_card(id_zh, zh),
+            get_version(RULES_DATA),
+            get_version(NOTES_DATA),
+            get_version(LABELS_DATA),
+        )
     raise Forbidden("You are not allowed to see this zh")
 
 
-def get_complete_card(id_zh: int) -> Card:
+def get_cached_response(zh: ZH, payload_type: str, load, *key_parts) -> Response:
+    """
+    Json response of a payload of a zh, serialized once per update of the zh
+    (t_zh.update_date) and active ref_geo config, and sent with an ETag:
+    the payload is not even computed when the client already has it (304).
+    The payloads also embed data not versioned by the module (synthese
+    taxa, ref_geo areas, users), they expire after response_cache_ttl
+    seconds. The rights of the user must be checked before
+    """
+    ref_geo_config = [ref for ref in blueprint.config["ref_geo_referentiels"] if ref["active"]]
+    key = make_key(payload_type, zh.zh.id_zh, ref_geo_config, *key_parts)
+    version = str(zh.zh.update_date)
+    ttl = blueprint.config["response_cache_ttl"]
+    if ttl > 0:
+        version += f"/{int(time.time() // ttl)}"
+    etag = make_key(key, version)
+    if etag in request.if_none_match:
+        response = Response(status=304)
+    else:
+        body = get_response_cache(blueprint.config).get_or_load(
+            key, version, lambda: json.dumps(load(), ensure_ascii=False, default=str)
+        )
+        response = Response(body, mimetype="application/json")
+    response.set_etag(etag)
+    response.cache_control.private = True
+    response.cache_control.no_cache = True
+    return response
+
+
+def get_complete_card(id_zh: int, zh: ZH = None) -> Card:
     ref_geo_config = [ref for ref in blueprint.config["ref_geo_referentiels"] if ref["active"]]
-    return Card(id_zh, "full", ref_geo_config).__repr__()
+    return Card(id_zh, "full", ref_geo_config, zh=zh).__repr__()
 
 
 @blueprint.route("/eval/<int:id_zh>", methods=["GET"])
 @permissions.check_cruved_scope("R", module_code="ZONES_HUMIDES")
-@json_resp
 def get_zh_eval(id_zh):
     """Get zh form data by id"""
     try:
-        zh_eval = ZH(id_zh).get_eval()
-        return zh_eval
+        zh = ZH(id_zh)
+        return get_cached_response(zh, "eval", zh.get_eval)
     except Exception as e:
         exc_type, value, tb = sys.exc_info()
         if e.__class__.__name__ == "NoResultFound":
@@ -637,12 +746,15 @@ def get_tab_data(id_tab):
             )
             intersection = geom["is_intersected"]
 
+        # the river basins of the zh may change: all its notes are computed again
+        rescore_zh(zh)
         DB.session.commit()
         return jsonify({"id_zh": zh, "is_intersected": intersection})
 
     if id_tab == 1:
         update_tzh(form_data)
         update_refs(form_data)
+        rescore_zh(form_data["id_zh"], get_dependent_rules(form_data))
         DB.session.commit()
         return jsonify({"id_zh": form_data["id_zh"]})
 
@@ -650,6 +762,7 @@ def get_tab_data(id_tab):
         update_tzh(form_data)
         update_delim(form_data["id_zh"], form_data["critere_delim"])
         update_fct_delim(form_data["id_zh"], form_data["critere_delim_fs"])
+        rescore_zh(form_data["id_zh"], get_dependent_rules(form_data))
         DB.session.commit()
         return jsonify({"id_zh": form_data["id_zh"]})
 
@@ -660,6 +773,7 @@ def get_tab_data(id_tab):
         update_activities(
             form_data["id_zh"], form_data["activities"]
         )  # , form_data['id_cor_impact_types'])
+        rescore_zh(form_data["id_zh"], get_dependent_rules(form_data))
         DB.session.commit()
         return jsonify({"id_zh": form_data["id_zh"]})
 
@@ -667,6 +781,7 @@ def get_tab_data(id_tab):
         update_outflow(form_data["id_zh"], form_data["outflows"])
         update_inflow(form_data["id_zh"], form_data["inflows"])
         update_tzh(form_data)
+        rescore_zh(form_data["id_zh"], get_dependent_rules(form_data))
         DB.session.commit()
         return jsonify({"id_zh": form_data["id_zh"]})
 
@@ -679,6 +794,7 @@ def get_tab_data(id_tab):
         update_functions(form_data["id_zh"], form_data["val_soc_eco"], "VAL_SOC_ECO")
         update_tzh(form_data)
         update_hab_heritages(form_data["id_zh"], form_data["hab_heritages"])
+        rescore_zh(form_data["id_zh"], get_dependent_rules(form_data))
         DB.session.commit()
         return jsonify({"id_zh": form_data["id_zh"]})
 
@@ -689,12 +805,14 @@ def get_tab_data(id_tab):
         update_protections(form_data["id_zh"], form_data["protections"])
         update_zh_tab6(form_data)
         update_urban_docs(form_data["id_zh"], form_data["urban_docs"])
+        rescore_zh(form_data["id_zh"], get_dependent_rules(form_data))
         DB.session.commit()
         return jsonify({"id_zh": form_data["id_zh"]})
 
     if id_tab == 7:
         update_tzh(form_data)
         update_actions(form_data["id_zh"], form_data["actions"])
+        rescore_zh(form_data["id_zh"], get_dependent_rules(form_data))
         DB.session.commit()
         return jsonify({"id_zh": form_data["id_zh"]})
 
@@ -895,34 +1013,92 @@ def userRights(id_zh):
 
 
 @blueprint.route("/export_pdf/<int:id_zh>", methods=["GET"])
+@permissions.check_cruved_scope("R", module_code="ZONES_HUMIDES")
 def download(id_zh: int):
     """
-    Downloads the report in pdf format
+    Downloads the report in pdf format if it was exported after the last
+    update of the zh, otherwise submits its export like
+    POST /export_pdf/<id_zh>/jobs: the pdf is not rendered by the API
     """
-    zh = ZH(id_zh=id_zh).zh
-    author_role = zh.authors
-    author = f"{author_role.prenom_role} {author_role.nom_role.upper()}"
-    last_date = zh.update_date
+    zh = ZH(id_zh=id_zh)
+    last_date = zh.zh.update_date
     media = get_last_pdf_export(id_zh=id_zh, last_date=last_date)
     if media is None:
-        dataset = get_complete_card(id_zh)
-        dataset["config"] = blueprint.config
-        filename = f'{id_zh}_fiche_{dt.now().strftime("%Y-%m-%d")}.pdf'
-        stored_filename = f"zh_{uuid.uuid4()}.pdf"
-        media_path = Path(BACKEND_DIR, config["MEDIA_FOLDER"], "pdf", stored_filename)
-        pdf_file = gen_pdf(id_zh=id_zh, dataset=dataset, filename=media_path)
-        post_file_info(
-            id_zh=id_zh,
-            title=filename,
-            author=author,
-            description="Fiche de synthèse de la zone humide",
-            extension=".pdf",
-            media_path=str(media_path),
-        )
+        return submit_user_export(zh)
+    return send_file(get_file_path(media.id_media), as_attachment=True)
 
-        return send_file(pdf_file, as_attachment=True)
-    else:
-        return send_file(get_file_path(media.id_media), as_attachment=True)
+
+def create_pdf_export(id_zh: int, zh: ZH = None) -> int:
+    """
+    Renders the card of a zh in pdf and stores it as a media of the zh
+
+    Returns the id_media of the pdf
+    """
+    if zh is None:
+        zh = ZH(id_zh=id_zh)
+    author_role = zh.zh.authors
+    author = f"{author_role.prenom_role} {author_role.nom_role.upper()}"
+    dataset = get_complete_card(id_zh, zh)
+    dataset["config"] = blueprint.config
+    filename = f'{id_zh}_fiche_{dt.now().strftime("%Y-%m-%d")}.pdf'
+    stored_filename = f"zh_{uuid.uuid4()}.pdf"
+    media_path = Path(BACKEND_DIR, config["MEDIA_FOLDER"], "pdf", stored_filename)
+    gen_pdf(id_zh=id_zh, dataset=dataset, filename=media_path)
+    return post_file_info(
+        id_zh=id_zh,
+        title=filename,
+        author=author,
+        description="Fiche de synthèse de la zone humide",
+        extension=".pdf",
+        media_path=str(media_path),
+    )
+
+
+@blueprint.route("/export_pdf/<int:id_zh>/jobs", methods=["POST"])
+@permissions.check_cruved_scope("R", module_code="ZONES_HUMIDES")
+def post_pdf_export(id_zh: int):
+    """
+    Submits the export of the card of a zh in pdf, rendered by the
+    pdf_export_worker command. Poll /export_pdf/jobs/<id_export> then
+    download /export_pdf/jobs/<id_export>/download
+    """
+    return submit_user_export(ZH(id_zh))
+
+
+def submit_user_export(zh: ZH):
+    user_cruved = get_user_cruved()
+    if not zh.zh.user_is_allowed_to(g.current_user, user_cruved["R"]):
+        raise Forbidden("You are not allowed to see this zh")
+    export = submit_export(zh.zh.id_zh, g.current_user.id_role)
+    return jsonify(get_export_status(export)), 202
+
+
+def get_user_export(id_export: int):
+    # the exports are shared by the users who can read the zh
+    export = get_export(id_export)
+    user_cruved = get_user_cruved()
+    if not ZH(export.id_zh).zh.user_is_allowed_to(g.current_user, user_cruved["R"]):
+        raise Forbidden("You are not allowed to see this pdf export")
+    return export
+
+
+@blueprint.route("/export_pdf/jobs/<int:id_export>", methods=["GET"])
+@permissions.check_cruved_scope("R", module_code="ZONES_HUMIDES")
+def get_pdf_export(id_export: int):
+    return jsonify(get_export_status(get_user_export(id_export)))
+
+
+@blueprint.route("/export_pdf/jobs/<int:id_export>/download", methods=["GET"])
+@permissions.check_cruved_scope("R", module_code="ZONES_HUMIDES")
+def download_pdf_export(id_export: int):
+    export = get_user_export(id_export)
+    if export.status != DONE or export.id_media is None:
+        raise ZHApiError(
+            message="pdf_export_not_done",
+            details=f"pdf export {id_export} is {export.status}",
+            status_code=409,
+        )
+    return send_file(get_file_path(export.id_media), as_attachment=True)
 
 
 @blueprint.route("/departments", methods=["GET"])
@@ -999,8 +1175,162 @@ def get_hierarchy(id_zh):
     return hierarchy.as_dict()
 
 
+@blueprint.route("/hierarchy/ranking", methods=["GET"])
+@permissions.check_cruved_scope("R", get_scope=True, module_code="ZONES_HUMIDES")
+@json_resp
+def get_ranking(scope):
+    """Zh ranked by a note of their hierarchy, paginated"""
+    try:
+        parameters = request.args
+        return (
+            get_hierarchy_ranking(
+                user=g.current_user,
+                scope=scope,
+                id_rb=parameters.get("id_rb", None, int),
+                orderby=parameters.get("orderby", "final_note", str),
+                limit=parameters.get("limit", 50, int),
+                page=parameters.get("offset", 0, int),
+            ),
+            200,
+        )
+    except BadRequest:
+        raise
+    except Exception as e:
+        if e.__class__.__name__ == "ZHApiError":
+            raise ZHApiError(message=str(e.message), details=str(e.details))
+        exc_type, value, tb = sys.exc_info()
+        raise ZHApiError(
+            message="get_ranking_error",
+            details=str(exc_type) + ": " + str(e.with_traceback(tb)),
+        )
+
+
+@blueprint.route("/hierarchy/simulation/<int:id_rb>", methods=["POST"])
+@permissions.check_cruved_scope("R", get_scope=True, module_code="ZONES_HUMIDES")
+@json_resp
+def get_simulation(id_rb, scope):
+    """Notes and ranks of the zh of a river basin with a candidate rule set, not saved"""
+    try:
+        rule_set = request.json if request.is_json else None
+        return simulate_rules(id_rb, rule_set, user=g.current_user, scope=scope), 200
+    except Exception as e:
+        if e.__class__.__name__ == "ZHApiError":
+            raise ZHApiError(
+                message=str(e.message), details=str(e.details), status_code=e.status_code
+            )
+        exc_type, value, tb = sys.exc_info()
+        raise ZHApiError(
+            message="get_simulation_error",
+            details=str(exc_type) + ": " + str(e.with_traceback(tb)),
+        )
+
+
 @blueprint.route("/hierarchy/fields/<int:id_rb>", methods=["GET"])
 @permissions.check_cruved_scope("R", module_code="ZONES_HUMIDES")
-@json_resp
 def get_hierarchy_fields(id_rb):
-    return get_all_hierarchy_fields(id_rb=id_rb)
+    # the fields only change with the rules: revalidated with the rules version
+    response = jsonify(get_all_hierarchy_fields(id_rb=id_rb))
+    response.set_etag(make_key("hierarchy_fields", id_rb, get_version(RULES_DATA)))
+    response.last_modified = get_version_date(RULES_DATA)
+    response.cache_control.private = True
+    response.cache_control.no_cache = True
+    return response.make_conditional(request)
+
+
+@blueprint.cli.command("refresh_notes_summary")
+@click.option("--rb", "id_rb", type=int, help="Identifiant du bassin versant")
+def refresh_notes_summary(id_rb):
+    """Rafraîchit les notes maximales par bassin versant (pr_zh.rb_notes_summary)"""
+    # done at the end of each rescoring job (and by score_hierarchy --rb)
+    if id_rb is None:
+        id_rbs = [id_rb for (id_rb,) in DB.session.query(TRiverBasin.id_rb).all()]
+    else:
+        id_rbs = [id_rb]
+    for id_rb in id_rbs:
+        # the maximum notes of a river basin being rescored are the ones of
+        # its former rules until its job publishes its notes
+        if get_unpublished_job(id_rb) is None:
+            publish_notes_summary(id_rb)
+    DB.session.commit()
+
+
+@blueprint.cli.command("score_hierarchy")
+@click.option("--rb", "id_rb", type=int, help="Identifiant du bassin versant")
+@click.option("--zh", "id_zh_list", type=int, multiple=True, help="Identifiant de zone humide")
+def score_hierarchy(id_rb, id_zh_list):
+    """Calcule et enregistre les notes de hiérarchisation des zones humides d'un bassin versant"""
+    if id_rb is None and not id_zh_list:
+        raise click.UsageError("--rb ou --zh est requis")
+    hierarchies, errors = score_hierarchies(id_zh_list=list(id_zh_list) or None, id_rb=id_rb)
+    if id_rb is not None and get_unpublished_job(id_rb) is None:
+        # all the notes of the river basin are computed with the current rules
+        publish_notes_summary(id_rb)
+        DB.session.commit()
+    click.echo(f"{len(hierarchies)} zones humides notées")
+    for id_zh, error in sorted(errors.items()):
+        click.echo(f"ZH {id_zh} : {error['message']} ({error['details']})", err=True)
+
+
+@blueprint.cli.command("rescoring_worker")
+@click.option("--processes", type=int, default=1, help="Nombre de processus en parallèle")
+@click.option("--once", is_flag=True, help="S'arrête quand la file est vide")
+@click.option("--poll", type=int, default=10, help="Secondes entre deux lectures de la file vide")
+@click.option("--rb", "id_rb", type=int, help="Ajoute d'abord une tâche pour ce bassin versant")
+def rescoring_worker(processes, once, poll, id_rb):
+    """Recalcule les notes de hiérarchisation des bassins versants dont les règles ont changé"""
+    if id_rb is not None:
+        enqueue_rescoring(id_rb)
+
+    def report(job):
+        click.echo(
+            f"Bassin versant {job.id_rb} : {job.nb_done}/{job.nb_zh} zones humides "
+            f"({job.nb_errors} erreurs) - {job.status}"
+        )
+
+    run_workers(processes=processes, once=once, poll=poll, report=report)
+
+
+@blueprint.cli.command("rescoring_status")
+def rescoring_status():
+    """Affiche l'avancement des recalculs des notes de hiérarchisation"""
+    for job in get_rescoring_jobs():
+        click.echo(
+            f"Tâche {job.id_job} - bassin versant {job.id_rb} : {job.status}, "
+            f"{job.nb_done}/{job.nb_zh if job.nb_zh is not None else '?'} zones humides "
+            f"({job.nb_errors} erreurs)"
+        )
+
+
+@blueprint.cli.command("simulate_hierarchy")
+@click.option("--rb", "id_rb", type=int, required=True, help="Identifiant du bassin versant")
+@click.option(
+    "--rules", "rules_file", type=click.File("r"), required=True, help="Jeu de règles (json)"
+)
+def simulate_hierarchy(id_rb, rules_file):
+    """Simule la hiérarchisation des zones humides d'un bassin versant avec d'autres règles"""
+    click.echo(json.dumps(simulate_rules(id_rb, json.load(rules_file)), indent=2))
+
+
+@blueprint.cli.command("pdf_export_worker")
+@click.option(
+    "--processes",
+    type=int,
+    default=None,
+    help="Nombre de pdf générés en parallèle (paramètre pdf_export_processes par défaut)",
+)
+@click.option("--once", is_flag=True, help="S'arrête quand la file est vide")
+@click.option("--poll", type=int, default=5, help="Secondes entre deux lectures de la file vide")
+def pdf_export_worker(processes, once, poll):
+    """Génère les fiches de synthèse pdf demandées (pr_zh.t_pdf_exports)"""
+    if processes is None:
+        processes = blueprint.config["pdf_export_processes"]
+
+    def render(id_zh):
+        # url_for of the pdf templates needs a request
+        with current_app.test_request_context(base_url=current_app.config["API_ENDPOINT"]):
+            return create_pdf_export(id_zh)
+
+    def report(export):
+        click.echo(f"Export {export.id_export} - zone humide {export.id_zh} : {export.status}")
+
+    run_pdf_workers(processes=processes, render=render, once=once, poll=poll, report=report)
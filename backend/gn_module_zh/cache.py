@@ -0,0 +1,334 @@
+import hashlib
+import json
+import os
+import tempfile
+import threading
+from collections import OrderedDict
+from pathlib import Path
+
+from flask import g
+from geonature.utils.env import DB
+from pypnnomenclature.models import TNomenclatures
+from ref_geo.models import BibAreasTypes
+from sqlalchemy import func
+
+from .model.zh_schema import (
+    BibActions,
+    CorImpactTypes,
+    CorProtectionLevelType,
+    CorUrbanTypeRange,
+    RbNotesSummary,
+    TCacheVersions,
+    TRiverBasin,
+)
+
+# name of the version bumped by the triggers on t_zh and its child tables
+ZH_DATA = "zh"
+# name of the version bumped by the triggers on the hierarchy rules tables
+RULES_DATA = "rules"
+# name of the version bumped by the triggers on the nomenclatures and the
+# module reference tables displayed in the cards
+LABELS_DATA = "labels"
+# name of the version bumped when the hierarchy notes are written outside of
+# the zh forms (rescoring queue, batch scoring, hierarchy view)
+NOTES_DATA = "notes"
+
+# versions written by every save of a zh form, kept in a sequence rather
+# than in a (locked) row of pr_zh.t_cache_versions
+SEQUENCE_VERSIONS = {ZH_DATA: "pr_zh.s_cache_version_zh"}
+
+
+def get_version(name):
+    """
+    Returns the version of the data `name` (pr_zh.t_cache_versions or its
+    sequence), read once per request
+    """
+    versions = g.setdefault("zh_cache_versions", {})
+    if name not in versions:
+        if name in SEQUENCE_VERSIONS:
+            version = DB.session.execute(
+                f"SELECT last_value FROM {SEQUENCE_VERSIONS[name]}"
+            ).scalar()
+        else:
+            version = (
+                DB.session.query(TCacheVersions.version)
+                .filter(TCacheVersions.name == name)
+                .scalar()
+            )
+        versions[name] = version or 0
+    return versions[name]
+
+
+def bump_version(name):
+    """
+    Increments the version of the data `name` in the current transaction,
+    as the triggers do, for the writes the triggers do not track (a sequence
+    version is incremented at once, it is not transactional)
+    """
+    if name in SEQUENCE_VERSIONS:
+        DB.session.execute("SELECT nextval(:sequence)", {"sequence": SEQUENCE_VERSIONS[name]})
+    else:
+        DB.session.execute(
+            """
+            INSERT INTO pr_zh.t_cache_versions (name, version, update_date)
+            VALUES (:name, 1, now())
+            ON CONFLICT (name) DO UPDATE
+                SET version = pr_zh.t_cache_versions.version + 1, update_date = now()
+            """,
+            {"name": name},
+        )
+    versions = g.get("zh_cache_versions")
+    if versions is not None:
+        versions.pop(name, None)
+
+
+def get_version_date(name):
+    """
+    Returns the date (timezone aware) of the last change of the data `name`,
+    None if it never changed or if its version is a sequence
+    """
+    return (
+        DB.session.query(
+            TCacheVersions.update_date.op("AT TIME ZONE")(func.current_setting("TimeZone"))
+        )
+        .filter(TCacheVersions.name == name)
+        .scalar()
+    )
+
+
+def make_key(*parts):
+    """
+    Hash of the canonical json (sorted keys) of the parts
+    """
+    payload = json.dumps(parts, sort_keys=True, separators=(",", ":"), default=str)
+    return hashlib.sha256(payload.encode("utf-8")).hexdigest()
+
+
+class VersionedCache:
+    """
+    Process LRU cache whose entries are only valid for the version
+    of the data they were computed from
+    """
+
+    def __init__(self, maxsize=1024):
+        self.maxsize = maxsize
+        self._entries = OrderedDict()
+        self._lock = threading.Lock()
+
+    def get(self, key, version):
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is None or entry[0] != version:
+                return None
+            self._entries.move_to_end(key)
+            return entry[1]
+
+    def set(self, key, version, value):
+        with self._lock:
+            self._entries[key] = (version, value)
+            self._entries.move_to_end(key)
+            while len(self._entries) > self.maxsize:
+                self._entries.popitem(last=False)
+
+    def get_or_load(self, key, version, load):
+        value = self.get(key, version)
+        if value is None:
+            value = load()
+            self.set(key, version, value)
+        return value
+
+
+class DiskCache:
+    """
+    Versioned cache stored in a directory (one json file per key) shared by
+    the processes of the workers. The least recently used files are removed
+    beyond maxsize, the values must be serializable in json
+    """
+
+    def __init__(self, path, maxsize=4096):
+        self.path = Path(path)
+        self.maxsize = maxsize
+        self.path.mkdir(parents=True, exist_ok=True)
+
+    def __get_path(self, key):
+        return self.path / f"{key}.json"
+
+    def get(self, key, version):
+        path = self.__get_path(key)
+        try:
+            with open(path, encoding="utf-8") as file:
+                entry = json.load(file)
+            # last use date, for the eviction
+            os.utime(path)
+        except (OSError, ValueError):
+            return None
+        if entry.get("version") != version:
+            return None
+        return entry.get("value")
+
+    def set(self, key, version, value):
+        try:
+            # written in a temporary file then renamed: never read half written
+            with tempfile.NamedTemporaryFile(
+                "w", encoding="utf-8", dir=self.path, suffix=".tmp", delete=False
+            ) as file:
+                json.dump({"version": version, "value": value}, file)
+            os.replace(file.name, self.__get_path(key))
+            self.__evict()
+        except OSError:
+            # the cache is an optimization, the value is still returned
+            pass
+
+    def __evict(self):
+        paths = list(self.path.glob("*.json"))
+        if len(paths) <= self.maxsize:
+            return
+        paths.sort(key=lambda path: path.stat().st_mtime)
+        for path in paths[: len(paths) - self.maxsize]:
+            try:
+                path.unlink()
+            except FileNotFoundError:
+                # removed by another worker
+                pass
+
+
+class TieredCache:
+    """
+    Process LRU cache backed by an optional disk cache: the values found on
+    the disk (computed by another worker) are kept in the process cache
+    """
+
+    def __init__(self, memory, disk=None):
+        self.memory = memory
+        self.disk = disk
+
+    def get(self, key, version):
+        value = self.memory.get(key, version)
+        if value is None and self.disk is not None:
+            value = self.disk.get(key, version)
+            if value is not None:
+                self.memory.set(key, version, value)
+        return value
+
+    def set(self, key, version, value):
+        self.memory.set(key, version, value)
+        if self.disk is not None:
+            self.disk.set(key, version, value)
+
+    def get_or_load(self, key, version, load):
+        value = self.get(key, version)
+        if value is None:
+            value = load()
+            self.set(key, version, value)
+        return value
+
+
+rules_cache = VersionedCache(maxsize=64)
+labels_cache = VersionedCache(maxsize=1)
+
+_response_cache = None
+_response_cache_lock = threading.Lock()
+
+
+def get_response_cache(config) -> TieredCache:
+    """
+    Cache of the serialized zh payloads (form data, card, evaluation), created
+    on first use from the module config (response_cache_size,
+    response_cache_dir, response_cache_disk_size)
+    """
+    global _response_cache
+    with _response_cache_lock:
+        if _response_cache is None:
+            disk = None
+            if config["response_cache_dir"]:
+                disk = DiskCache(
+                    config["response_cache_dir"], maxsize=config["response_cache_disk_size"]
+                )
+            _response_cache = TieredCache(
+                VersionedCache(maxsize=config["response_cache_size"]), disk
+            )
+        return _response_cache
+
+
+def _load_notes_summary():
+    columns = [column.name for column in RbNotesSummary.__table__.columns]
+    return {
+        row.id_rb: {column: getattr(row, column) for column in columns}
+        for row in DB.session.query(RbNotesSummary).all()
+    }
+
+
+def _load_river_basin_names():
+    return dict(DB.session.query(TRiverBasin.id_rb, TRiverBasin.name).all())
+
+
+def get_notes_summary(id_rb: int) -> dict:
+    """
+    Row of the pr_zh.rb_notes_summary table (maximum notes of the rules the
+    stored notes were computed with) of a river basin, loaded for all the
+    basins once per version of the notes: the table is refreshed with the
+    notes at the end of each rescoring job
+    """
+    summary = rules_cache.get_or_load(
+        "rb_notes_summary", get_version(NOTES_DATA), _load_notes_summary
+    )
+    return dict(summary[id_rb])
+
+
+def get_river_basin_name(id_rb: int) -> str:
+    names = rules_cache.get_or_load(
+        "river_basin_names", get_version(RULES_DATA), _load_river_basin_names
+    )
+    return names[id_rb]
+
+
+def _load_labels():
+    return {
+        "nomenclatures": {
+            row.id_nomenclature: row._asdict()
+            for row in DB.session.query(
+                TNomenclatures.id_nomenclature,
+                TNomenclatures.cd_nomenclature,
+                TNomenclatures.label_default,
+                TNomenclatures.label_fr,
+            ).all()
+        },
+        "actions": dict(DB.session.query(BibActions.id_action, BibActions.name).all()),
+        "area_types": dict(DB.session.query(BibAreasTypes.id_type, BibAreasTypes.type_code).all()),
+        "impact_types": {
+            row.id_cor_impact_types: row._asdict()
+            for row in DB.session.query(
+                CorImpactTypes.id_cor_impact_types, CorImpactTypes.id_impact, CorImpactTypes.active
+            ).all()
+        },
+        "protection_levels": [
+            row._asdict()
+            for row in DB.session.query(
+                CorProtectionLevelType.id_protection,
+                CorProtectionLevelType.id_protection_status,
+                CorProtectionLevelType.id_protection_type,
+            )
+            .order_by(CorProtectionLevelType.id_protection)
+            .all()
+        ],
+        "urban_ranges": dict(
+            DB.session.query(CorUrbanTypeRange.id_cor, CorUrbanTypeRange.id_range_type).all()
+        ),
+    }
+
+
+def get_labels() -> dict:
+    """
+    Labels of the nomenclatures and of the module reference tables displayed
+    in the cards, by id, loaded once per version (pr_zh.t_cache_versions
+    'labels', bumped by the triggers on these tables)
+    """
+    return labels_cache.get_or_load("labels", get_version(LABELS_DATA), _load_labels)
+
+
+def reset_versions():
+    """
+    Forgets the versions read in the current context, for the long running
+    commands (the versions are otherwise read once per request)
+    """
+    g.pop("zh_cache_versions", None)
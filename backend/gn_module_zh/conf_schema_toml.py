@@ -155,6 +155,21 @@ pdf_small_layer_number = 0
 pdf_last_page_img = ""
 # Name of the source
 pdf_title = "Inventaire des zones humides"
+# Number of pdf rendered at the same time by the pdf_export_worker command
+pdf_export_processes = 2
+
+
+# cache of the zh form data, card and evaluation :
+
+# number of payloads kept in memory by each worker
+response_cache_size = 256
+# directory shared by the workers to store the payloads, not used if empty
+response_cache_dir = ""
+# number of payloads kept in response_cache_dir
+response_cache_disk_size = 4096
+# seconds after which the payloads are computed again (they embed the
+# synthese taxa, ref_geo areas and users, not versioned), never if 0
+response_cache_ttl = 3600
 
 
 class GnModuleSchemaConf(Schema):
@@ -178,3 +193,8 @@ class GnModuleSchemaConf(Schema):
     pdf_small_layer_number = fields.Integer(load_default=pdf_small_layer_number)
     pdf_last_page_img = fields.String(load_default=pdf_last_page_img)
     pdf_title = fields.String(load_default=pdf_title)
+    pdf_export_processes = fields.Integer(load_default=pdf_export_processes)
+    response_cache_size = fields.Integer(load_default=response_cache_size)
+    response_cache_dir = fields.String(load_default=response_cache_dir)
+    response_cache_disk_size = fields.Integer(load_default=response_cache_disk_size)
+    response_cache_ttl = fields.Integer(load_default=response_cache_ttl)
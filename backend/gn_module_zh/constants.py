@@ -98,3 +98,66 @@ COR_VOLET = {
 }
 
 COR_RUB = {"Statut et gestion": "rub_statut", "Interêt patrimonial": "rub_interet_pat"}
+
+# Layout of the hierarchy: for each volet, its rb_notes_summary column and its
+# categories (key in the hierarchy dict, bib_hier_categories abbreviation,
+# rb_notes_summary column and t_rules abbreviations of its items)
+HIERARCHY_LAYOUT = (
+    (
+        "volet1",
+        "volet_1",
+        (
+            ("cat1_sdage", "cat1", "rub_sdage", ("sdage",)),
+            (
+                "cat2_heritage",
+                "cat2",
+                "rub_interet_pat",
+                ("hab", "flore", "vertebrates", "invertebrates"),
+            ),
+            ("cat3_eco", "cat3", "rub_eco", ("eco",)),
+            ("cat4_hydro", "cat4", "rub_hydro", ("protection", "epuration", "support")),
+            ("cat5_soc_eco", "cat5", "rub_socio", ("pedagogy", "production")),
+        ),
+    ),
+    (
+        "volet2",
+        "volet_2",
+        (
+            ("cat6_status", "cat6", "rub_statut", ("status", "management")),
+            ("cat7_fct_state", "cat7", "rub_etat_fonct", ("hydro", "bio")),
+            ("cat8_thread", "cat8", "rub_menaces", ("thread",)),
+        ),
+    ),
+)
+
+# t_rules abbreviations of the hierarchy rules using the zh functions (t_functions)
+HIERARCHY_FUNCTION_RULES = ("eco", "protection", "epuration", "support", "pedagogy", "production")
+
+# Hierarchy rules (t_rules abbreviations) depending on each field of the zh
+# forms (get_tab_data): saving a tab computes again only the notes of these
+# rules. The tab 0 (geometry) can change the river basin of the zh, all its
+# rules are computed again
+HIERARCHY_DEPENDENCIES = {
+    "id_sdage": ("sdage",),
+    "nb_hab": ("hab",),
+    "is_carto_hab": ("hab",),
+    "nb_flora_sp": ("flore",),
+    "nb_vertebrate_sp": ("vertebrates",),
+    "nb_invertebrate_sp": ("invertebrates",),
+    "is_other_inventory": ("flore", "vertebrates", "invertebrates"),
+    "managements": ("flore", "vertebrates", "invertebrates", "management"),
+    "fonctions_hydro": HIERARCHY_FUNCTION_RULES,
+    "fonctions_bio": HIERARCHY_FUNCTION_RULES,
+    "interet_patrim": HIERARCHY_FUNCTION_RULES,
+    "val_soc_eco": HIERARCHY_FUNCTION_RULES,
+    "protections": ("status",),
+    "id_diag_hydro": ("hydro",),
+    "id_diag_bio": ("bio",),
+    "id_thread": ("thread",),
+}
+
+# status of the jobs of the queues (rescoring, pdf exports)
+PENDING = "pending"
+RUNNING = "running"
+DONE = "done"
+FAILED = "failed"
@@ -11,6 +11,7 @@ from pypnnomenclature.models import TNomenclatures
 from sqlalchemy import and_, func
 
 from .api_error import ZHApiError
+from .geometry import set_main_rb
 from .model.code import Code
 from .model.zh_schema import (
     TZH,
@@ -25,7 +26,6 @@ from .model.zh_schema import (
     CorZhFctArea,
     CorZhHydro,
     CorZhLimFs,
-    CorZhNotes,
     CorZhProtection,
     CorZhRb,
     CorZhRef,
@@ -216,6 +216,7 @@ def post_cor_zh_rb(geom, id_zh):
     for rb in rbs:
         DB.session.add(CorZhRb(id_zh=id_zh, id_rb=rb.id_rb))
         DB.session.flush()
+    set_main_rb(geom, id_zh)
     # except Exception as e:
     #     if e.__class__.__name__ == "DataError":
     #         raise ZHApiError(
@@ -1071,41 +1072,3 @@ def update_file_extension(id_media, extension):
         )
     except Exception as e:
         raise ZHApiError(message="update_file_extension_error", details=str(e))
-
-
-def post_note(id_zh, cor_rule_id, note, attribute_id, note_type_id):
-    try:
-        element = (
-            DB.session.query(CorZhNotes)
-            .filter(CorZhNotes.id_zh == id_zh)
-            .filter(CorZhNotes.cor_rule_id == cor_rule_id)
-            .first()
-        )
-        if element:
-            if element.note != note:
-                element.note = note
-                element.attribute_id = attribute_id
-                element.note_type_id = note_type_id
-                DB.session.flush()
-        else:
-            DB.session.add(
-                CorZhNotes(
-                    id_zh=id_zh,
-                    cor_rule_id=cor_rule_id,
-                    note=note,
-                    attribute_id=attribute_id,
-                    note_type_id=note_type_id,
-                )
-            )
-            DB.session.flush()
-    except Exception as e:
-        if e.__class__.__name__ == "DataError":
-            raise ZHApiError(
-                message="post_note_db_error",
-                details=str(e.orig.diag.sqlstate + ": " + e.orig.diag.message_primary),
-                status_code=400,
-            )
-        exc_type, value, tb = sys.exc_info()
-        raise ZHApiError(
-            message="post_note_error", details=str(exc_type) + ": " + str(e.with_traceback(tb))
-        )
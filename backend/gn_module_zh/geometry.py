@@ -1,8 +1,9 @@
 import sys
 
+from geoalchemy2 import Geography
 from geoalchemy2.shape import to_shape
 from geonature.utils.env import DB
-from sqlalchemy import func
+from sqlalchemy import cast, func, select
 from werkzeug.exceptions import BadRequest
 
 from .api_error import ZHApiError
@@ -58,27 +59,43 @@ def set_area(geom):
     )
 
 
-def get_main_rb(query: list) -> int:
-    rb_id = None
-    area = 0
-    for q_ in query:
-        zh_polygon = (
-            DB.session.query(TZH.geom).filter(TZH.id_zh == getattr(q_, "id_zh")).first().geom
+def set_main_rb(geom, id_zh: int):
+    """
+    Flags (cor_zh_rb.is_main) the river basin of a zh having the largest
+    intersection with its geometry (geojson), in one statement
+    """
+    polygon = func.ST_SetSRID(func.ST_GeomFromGeoJSON(str(geom)), 4326)
+    cor_rb = CorZhRb.__table__.alias()
+    main_rb = (
+        select([cor_rb.c.id_rb])
+        .select_from(cor_rb.join(TRiverBasin, TRiverBasin.id_rb == cor_rb.c.id_rb))
+        .where(cor_rb.c.id_zh == id_zh)
+        .order_by(
+            func.ST_Area(
+                cast(func.ST_Intersection(TRiverBasin.geom, polygon), Geography), False
+            ).desc(),
+            cor_rb.c.id_rb,
         )
-        rb_polygon = (
-            DB.session.query(CorZhRb, TRiverBasin)
-            .join(TRiverBasin, TRiverBasin.id_rb == CorZhRb.id_rb)
-            .filter(TRiverBasin.id_rb == getattr(q_, "id_rb"))
-            .first()
-            .TRiverBasin.geom
-        )
-        intersection = DB.session.query(
-            func.ST_Intersection(
-                func.ST_GeomFromText(func.ST_AsText(zh_polygon)),
-                func.ST_GeomFromText(func.ST_AsText(rb_polygon)),
-            )
-        ).scalar()
-        if DB.session.query(func.ST_Area(intersection, False)).scalar() > area:
-            area = DB.session.query(func.ST_Area(intersection, False)).scalar()
-            rb_id = getattr(q_, "id_rb")
-    return rb_id
+        .limit(1)
+        .as_scalar()
+    )
+    DB.session.query(CorZhRb).filter(CorZhRb.id_zh == id_zh).update(
+        {CorZhRb.is_main: CorZhRb.id_rb == main_rb}, synchronize_session=False
+    )
+
+
+def get_main_rbs(id_zh_list=None, id_rb=None) -> dict:
+    """
+    Returns the main river basin (cor_zh_rb.is_main, set when the geometry of
+    the zh is saved) of several zh, by id_zh
+
+    Args:
+        id_zh_list(list): ids of the zh, all the zh if None
+        id_rb(int): only keeps the zh whose main river basin is id_rb
+    """
+    query = DB.session.query(CorZhRb.id_zh, CorZhRb.id_rb).filter(CorZhRb.is_main)
+    if id_zh_list is not None:
+        query = query.filter(CorZhRb.id_zh.in_(id_zh_list))
+    if id_rb is not None:
+        query = query.filter(CorZhRb.id_rb == id_rb)
+    return {row.id_zh: row.id_rb for row in query.all()}
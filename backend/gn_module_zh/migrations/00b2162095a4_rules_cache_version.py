@@ -0,0 +1,42 @@
+"""rules cache version
+
+Revision ID: 00b2162095a4
+Revises: 54ea6ea1b16a
+Create Date: 2026-10-18 11:58:36.118472
+
+"""
+from alembic import op
+
+
+# revision identifiers, used by Alembic.
+revision = "00b2162095a4"
+down_revision = "54ea6ea1b16a"
+branch_labels = None
+depends_on = None
+
+# tables whose writes invalidate the values cached from the hierarchy rules
+RULES_TABLES = [
+    "t_rules",
+    "cor_rb_rules",
+    "t_items",
+    "cor_item_value",
+    "cor_rule_nomenc",
+    "t_cor_qualif",
+    "t_river_basin",
+]
+
+
+def upgrade():
+    for table in RULES_TABLES:
+        op.execute(
+            f"""
+            CREATE TRIGGER tri_bump_cache_version_rules
+            AFTER INSERT OR UPDATE OR DELETE OR TRUNCATE ON pr_zh.{table}
+            FOR EACH STATEMENT EXECUTE PROCEDURE pr_zh.fct_trg_bump_cache_version('rules');
+            """
+        )
+
+
+def downgrade():
+    for table in RULES_TABLES:
+        op.execute(f"DROP TRIGGER IF EXISTS tri_bump_cache_version_rules ON pr_zh.{table};")
@@ -0,0 +1,184 @@
+"""zh score summary
+
+Revision ID: 41ddddd99151
+Revises: 45acc950140f
+Create Date: 2026-10-18 15:21:37.640112
+
+"""
+from alembic import op
+
+
+# revision identifiers, used by Alembic.
+revision = "41ddddd99151"
+down_revision = "45acc950140f"
+branch_labels = None
+depends_on = None
+
+# rb_notes_summary column of each bib_hier_categories abbreviation, by volet
+VOLETS = {
+    "volet_1": {
+        "cat1": "rub_sdage",
+        "cat2": "rub_interet_pat",
+        "cat3": "rub_eco",
+        "cat4": "rub_hydro",
+        "cat5": "rub_socio",
+    },
+    "volet_2": {
+        "cat6": "rub_statut",
+        "cat7": "rub_etat_fonct",
+        "cat8": "rub_menaces",
+    },
+}
+
+# columns of t_zh_score_summary used to sort the zh of a river basin
+SORT_COLUMNS = ["final_note", "global_note", "volet_1", "volet_2"]
+
+
+def upgrade():
+    categories = {cat: column for volet in VOLETS.values() for cat, column in volet.items()}
+    category_columns = ",\n".join(f"{column} real" for column in categories.values())
+    category_sums = ",\n".join(
+        f"sum(note) FILTER (WHERE cat = '{cat}') AS {column}" for cat, column in categories.items()
+    )
+    volet_sums = ",\n".join(
+        "coalesce(sum(note) FILTER (WHERE cat IN ({})), 0) AS {}".format(
+            ", ".join(f"'{cat}'" for cat in volet), name
+        )
+        for name, volet in VOLETS.items()
+    )
+    columns = ", ".join(categories.values())
+    zh_columns = ", ".join(f"zh_notes.{column}" for column in categories.values())
+    op.execute(
+        f"""
+        CREATE TABLE pr_zh.t_zh_score_summary (
+            id_zh integer NOT NULL,
+            id_rb integer NOT NULL,
+            global_note real NOT NULL,
+            volet_1 real NOT NULL,
+            volet_2 real NOT NULL,
+            final_note real,
+            {category_columns},
+            update_date timestamp DEFAULT now() NOT NULL,
+            CONSTRAINT pk_t_zh_score_summary PRIMARY KEY (id_zh),
+            CONSTRAINT fk_t_zh_score_summary_id_zh FOREIGN KEY (id_zh)
+                REFERENCES pr_zh.t_zh(id_zh) ON UPDATE CASCADE ON DELETE CASCADE,
+            CONSTRAINT fk_t_zh_score_summary_id_rb FOREIGN KEY (id_rb)
+                REFERENCES pr_zh.t_river_basin(id_rb) ON UPDATE CASCADE ON DELETE CASCADE
+        );
+        COMMENT ON TABLE pr_zh.t_zh_score_summary IS 'notes de hiérarchisation de chaque zone humide par volet et rubrique, calculées à partir de cor_zh_notes pour son bassin versant principal';
+
+        CREATE OR REPLACE FUNCTION pr_zh.refresh_zh_score_summary(zh_ids integer[])
+        RETURNS void
+        LANGUAGE plpgsql
+        AS $function$
+        BEGIN
+            DELETE FROM pr_zh.t_zh_score_summary WHERE id_zh = ANY(zh_ids);
+            INSERT INTO pr_zh.t_zh_score_summary
+                (id_zh, id_rb, global_note, volet_1, volet_2, final_note, {columns})
+            WITH cat_notes AS (
+                SELECT czn.id_zh, czr.id_rb, bhc.abbreviation AS cat, round(sum(czn.note)) AS note
+                FROM pr_zh.cor_zh_notes czn
+                JOIN pr_zh.cor_rb_rules crr ON crr.cor_rule_id = czn.cor_rule_id
+                JOIN pr_zh.cor_zh_rb czr
+                    ON czr.id_zh = czn.id_zh AND czr.id_rb = crr.rb_id AND czr.is_main
+                JOIN pr_zh.t_rules r ON r.rule_id = crr.rule_id
+                JOIN pr_zh.bib_hier_categories bhc ON bhc.cat_id = r.cat_id
+                WHERE czn.id_zh = ANY(zh_ids)
+                GROUP BY czn.id_zh, czr.id_rb, bhc.abbreviation
+            ),
+            zh_notes AS (
+                SELECT
+                    id_zh,
+                    id_rb,
+                    {volet_sums},
+                    {category_sums}
+                FROM cat_notes
+                GROUP BY id_zh, id_rb
+            )
+            SELECT
+                zh_notes.id_zh,
+                zh_notes.id_rb,
+                zh_notes.volet_1 + zh_notes.volet_2,
+                zh_notes.volet_1,
+                zh_notes.volet_2,
+                CASE
+                    WHEN coalesce(rns.volet_1, 0) + coalesce(rns.volet_2, 0) = 0 THEN NULL
+                    WHEN zh_notes.volet_1 + zh_notes.volet_2 = 0 THEN 0
+                    ELSE round(
+                        ((zh_notes.volet_1 + zh_notes.volet_2)::numeric
+                        / (coalesce(rns.volet_1, 0) + coalesce(rns.volet_2, 0)) * 100),
+                        1
+                    )
+                END,
+                {zh_columns}
+            FROM zh_notes
+            LEFT JOIN pr_zh.rb_notes_summary rns ON rns.id_rb = zh_notes.id_rb;
+        END;
+        $function$;
+
+        CREATE OR REPLACE FUNCTION pr_zh.fct_trg_refresh_zh_score_summary()
+        RETURNS trigger
+        LANGUAGE plpgsql
+        AS $function$
+        BEGIN
+            IF TG_OP = 'INSERT' THEN
+                PERFORM pr_zh.refresh_zh_score_summary(
+                    ARRAY(SELECT DISTINCT id_zh FROM new_notes)
+                );
+            ELSIF TG_OP = 'UPDATE' THEN
+                PERFORM pr_zh.refresh_zh_score_summary(
+                    ARRAY(SELECT id_zh FROM new_notes UNION SELECT id_zh FROM old_notes)
+                );
+            ELSE
+                PERFORM pr_zh.refresh_zh_score_summary(
+                    ARRAY(SELECT DISTINCT id_zh FROM old_notes)
+                );
+            END IF;
+            RETURN NULL;
+        END;
+        $function$;
+
+        CREATE TRIGGER tri_refresh_zh_score_summary_insert
+        AFTER INSERT ON pr_zh.cor_zh_notes
+        REFERENCING NEW TABLE AS new_notes
+        FOR EACH STATEMENT EXECUTE PROCEDURE pr_zh.fct_trg_refresh_zh_score_summary();
+
+        CREATE TRIGGER tri_refresh_zh_score_summary_update
+        AFTER UPDATE ON pr_zh.cor_zh_notes
+        REFERENCING OLD TABLE AS old_notes NEW TABLE AS new_notes
+        FOR EACH STATEMENT EXECUTE PROCEDURE pr_zh.fct_trg_refresh_zh_score_summary();
+
+        CREATE TRIGGER tri_refresh_zh_score_summary_delete
+        AFTER DELETE ON pr_zh.cor_zh_notes
+        REFERENCING OLD TABLE AS old_notes
+        FOR EACH STATEMENT EXECUTE PROCEDURE pr_zh.fct_trg_refresh_zh_score_summary();
+
+        SELECT pr_zh.refresh_zh_score_summary(ARRAY(SELECT DISTINCT id_zh FROM pr_zh.cor_zh_notes));
+        """
+    )
+    for column in SORT_COLUMNS:
+        op.execute(
+            f"""
+            CREATE INDEX i_t_zh_score_summary_id_rb_{column}
+                ON pr_zh.t_zh_score_summary (id_rb, {column} DESC NULLS LAST, id_zh);
+            """
+        )
+    op.execute(
+        """
+        CREATE INDEX i_t_zh_score_summary_final_note
+            ON pr_zh.t_zh_score_summary (final_note DESC NULLS LAST, id_zh);
+        """
+    )
+
+
+def downgrade():
+    op.execute(
+        """
+        DROP TRIGGER IF EXISTS tri_refresh_zh_score_summary_delete ON pr_zh.cor_zh_notes;
+        DROP TRIGGER IF EXISTS tri_refresh_zh_score_summary_update ON pr_zh.cor_zh_notes;
+        DROP TRIGGER IF EXISTS tri_refresh_zh_score_summary_insert ON pr_zh.cor_zh_notes;
+        DROP FUNCTION IF EXISTS pr_zh.fct_trg_refresh_zh_score_summary();
+        DROP FUNCTION IF EXISTS pr_zh.refresh_zh_score_summary(integer[]);
+        DROP TABLE IF EXISTS pr_zh.t_zh_score_summary;
+        """
+    )
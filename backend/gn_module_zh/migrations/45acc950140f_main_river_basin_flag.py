@@ -0,0 +1,51 @@
+"""main river basin flag
+
+Revision ID: 45acc950140f
+Revises: 76fef7e29d7f
+Create Date: 2026-10-18 14:47:12.503816
+
+"""
+from alembic import op
+
+
+# revision identifiers, used by Alembic.
+revision = "45acc950140f"
+down_revision = "76fef7e29d7f"
+branch_labels = None
+depends_on = None
+
+
+def upgrade():
+    op.execute(
+        """
+        ALTER TABLE pr_zh.cor_zh_rb ADD COLUMN is_main boolean DEFAULT false NOT NULL;
+        COMMENT ON COLUMN pr_zh.cor_zh_rb.is_main IS 'bassin versant principal de la zone humide (plus grande surface d''intersection), utilisé pour la hiérarchisation';
+
+        UPDATE pr_zh.cor_zh_rb
+        SET is_main = true
+        FROM (
+            SELECT DISTINCT ON (czr.id_zh) czr.id_zh, czr.id_rb
+            FROM pr_zh.cor_zh_rb czr
+            JOIN pr_zh.t_zh zh ON zh.id_zh = czr.id_zh
+            JOIN pr_zh.t_river_basin rb ON rb.id_rb = czr.id_rb
+            ORDER BY
+                czr.id_zh,
+                ST_Area(ST_Intersection(zh.geom, rb.geom)::geography, false) DESC,
+                czr.id_rb
+        ) AS main_rb
+        WHERE cor_zh_rb.id_zh = main_rb.id_zh AND cor_zh_rb.id_rb = main_rb.id_rb;
+
+        CREATE UNIQUE INDEX i_cor_zh_rb_main_id_zh ON pr_zh.cor_zh_rb (id_zh) WHERE is_main;
+        CREATE INDEX i_cor_zh_rb_main_id_rb ON pr_zh.cor_zh_rb (id_rb) WHERE is_main;
+        """
+    )
+
+
+def downgrade():
+    op.execute(
+        """
+        DROP INDEX IF EXISTS pr_zh.i_cor_zh_rb_main_id_rb;
+        DROP INDEX IF EXISTS pr_zh.i_cor_zh_rb_main_id_zh;
+        ALTER TABLE pr_zh.cor_zh_rb DROP COLUMN IF EXISTS is_main;
+        """
+    )
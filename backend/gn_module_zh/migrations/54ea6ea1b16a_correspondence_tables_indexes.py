@@ -0,0 +1,36 @@
+"""correspondence tables indexes
+
+Revision ID: 54ea6ea1b16a
+Revises: fa91b5442e2c
+Create Date: 2026-10-18 11:21:52.640215
+
+"""
+from alembic import op
+
+
+# revision identifiers, used by Alembic.
+revision = "54ea6ea1b16a"
+down_revision = "fa91b5442e2c"
+branch_labels = None
+depends_on = None
+
+
+def upgrade():
+    # the primary keys only cover one direction of the search semi-joins
+    op.execute(
+        """
+        CREATE INDEX IF NOT EXISTS i_cor_zh_area_id_zh ON pr_zh.cor_zh_area (id_zh);
+        CREATE INDEX IF NOT EXISTS i_cor_zh_rb_id_rb_id_zh ON pr_zh.cor_zh_rb (id_rb, id_zh);
+        CREATE INDEX IF NOT EXISTS i_cor_zh_hydro_id_hydro_id_zh ON pr_zh.cor_zh_hydro (id_hydro, id_zh);
+        """
+    )
+
+
+def downgrade():
+    op.execute(
+        """
+        DROP INDEX IF EXISTS pr_zh.i_cor_zh_area_id_zh;
+        DROP INDEX IF EXISTS pr_zh.i_cor_zh_rb_id_rb_id_zh;
+        DROP INDEX IF EXISTS pr_zh.i_cor_zh_hydro_id_hydro_id_zh;
+        """
+    )
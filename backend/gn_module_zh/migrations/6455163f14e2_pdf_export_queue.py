@@ -0,0 +1,52 @@
+"""pdf export queue
+
+Revision ID: 6455163f14e2
+Revises: da9d975bc798
+Create Date: 2026-10-18 17:25:48.906137
+
+"""
+from alembic import op
+
+
+# revision identifiers, used by Alembic.
+revision = "6455163f14e2"
+down_revision = "da9d975bc798"
+branch_labels = None
+depends_on = None
+
+
+def upgrade():
+    op.execute(
+        """
+        CREATE TABLE pr_zh.t_pdf_exports (
+            id_export serial NOT NULL,
+            id_zh integer NOT NULL,
+            id_role integer NOT NULL,
+            status varchar(20) DEFAULT 'pending' NOT NULL,
+            id_media integer,
+            error text,
+            create_date timestamp DEFAULT now() NOT NULL,
+            start_date timestamp,
+            end_date timestamp,
+            CONSTRAINT pk_t_pdf_exports PRIMARY KEY (id_export),
+            CONSTRAINT fk_t_pdf_exports_id_zh FOREIGN KEY (id_zh)
+                REFERENCES pr_zh.t_zh(id_zh) ON UPDATE CASCADE ON DELETE CASCADE,
+            CONSTRAINT fk_t_pdf_exports_id_role FOREIGN KEY (id_role)
+                REFERENCES utilisateurs.t_roles(id_role) ON UPDATE CASCADE ON DELETE CASCADE,
+            CONSTRAINT fk_t_pdf_exports_id_media FOREIGN KEY (id_media)
+                REFERENCES gn_commons.t_medias(id_media) ON UPDATE CASCADE ON DELETE SET NULL,
+            CONSTRAINT check_t_pdf_exports_status
+                CHECK (status IN ('pending', 'running', 'done', 'failed'))
+        );
+        COMMENT ON TABLE pr_zh.t_pdf_exports IS 'file des exports pdf des fiches de synthèse des zones humides, traités par la commande pdf_export_worker';
+
+        -- un seul export en attente ou en cours par zone humide
+        CREATE UNIQUE INDEX i_t_pdf_exports_active_id_zh
+            ON pr_zh.t_pdf_exports (id_zh) WHERE status IN ('pending', 'running');
+        CREATE INDEX i_t_pdf_exports_status ON pr_zh.t_pdf_exports (status);
+        """
+    )
+
+
+def downgrade():
+    op.execute("DROP TABLE IF EXISTS pr_zh.t_pdf_exports;")
@@ -0,0 +1,161 @@
+"""rescoring queue
+
+Revision ID: 76fef7e29d7f
+Revises: 93cbc3eed2c0
+Create Date: 2026-10-18 14:02:41.318204
+
+"""
+from alembic import op
+
+
+# revision identifiers, used by Alembic.
+revision = "76fef7e29d7f"
+down_revision = "93cbc3eed2c0"
+branch_labels = None
+depends_on = None
+
+# rules tables of one river basin
+RB_RULES_TABLES = ["cor_rb_rules", "t_items"]
+
+# rules tables shared by all the river basins
+SHARED_RULES_TABLES = ["t_rules", "cor_item_value", "cor_rule_nomenc", "t_cor_qualif"]
+
+
+def upgrade():
+    op.execute(
+        """
+        CREATE TABLE pr_zh.t_rescoring_jobs (
+            id_job serial NOT NULL,
+            id_rb integer NOT NULL,
+            status varchar(20) DEFAULT 'pending' NOT NULL,
+            nb_zh integer,
+            nb_done integer DEFAULT 0 NOT NULL,
+            nb_errors integer DEFAULT 0 NOT NULL,
+            create_date timestamp DEFAULT now() NOT NULL,
+            start_date timestamp,
+            end_date timestamp,
+            CONSTRAINT pk_t_rescoring_jobs PRIMARY KEY (id_job),
+            CONSTRAINT fk_t_rescoring_jobs_id_rb FOREIGN KEY (id_rb)
+                REFERENCES pr_zh.t_river_basin(id_rb) ON UPDATE CASCADE ON DELETE CASCADE,
+            CONSTRAINT check_t_rescoring_jobs_status
+                CHECK (status IN ('pending', 'running', 'done', 'failed'))
+        );
+        COMMENT ON TABLE pr_zh.t_rescoring_jobs IS 'file des recalculs des notes de hiérarchisation des zones humides d''un bassin versant après modification de ses règles';
+
+        -- une seule tâche en attente par bassin versant
+        CREATE UNIQUE INDEX i_t_rescoring_jobs_pending_id_rb
+            ON pr_zh.t_rescoring_jobs (id_rb) WHERE status = 'pending';
+        CREATE INDEX i_t_rescoring_jobs_status ON pr_zh.t_rescoring_jobs (status);
+
+        CREATE TABLE pr_zh.t_rescoring_batches (
+            id_batch serial NOT NULL,
+            id_job integer NOT NULL,
+            id_zh_list integer[] NOT NULL,
+            status varchar(20) DEFAULT 'pending' NOT NULL,
+            attempts integer DEFAULT 0 NOT NULL,
+            update_date timestamp DEFAULT now() NOT NULL,
+            error text,
+            CONSTRAINT pk_t_rescoring_batches PRIMARY KEY (id_batch),
+            CONSTRAINT fk_t_rescoring_batches_id_job FOREIGN KEY (id_job)
+                REFERENCES pr_zh.t_rescoring_jobs(id_job) ON UPDATE CASCADE ON DELETE CASCADE,
+            CONSTRAINT check_t_rescoring_batches_status
+                CHECK (status IN ('pending', 'running', 'done', 'failed'))
+        );
+        COMMENT ON TABLE pr_zh.t_rescoring_batches IS 'lots de zones humides d''une tâche de recalcul des notes de hiérarchisation';
+
+        CREATE INDEX i_t_rescoring_batches_id_job ON pr_zh.t_rescoring_batches (id_job);
+        CREATE INDEX i_t_rescoring_batches_status ON pr_zh.t_rescoring_batches (status);
+
+        CREATE TABLE pr_zh.t_rescoring_notes (
+            id_job integer NOT NULL,
+            id_zh integer NOT NULL,
+            cor_rule_id integer NOT NULL,
+            note real NOT NULL,
+            attribute_id integer NOT NULL,
+            note_type_id integer NOT NULL,
+            CONSTRAINT pk_t_rescoring_notes PRIMARY KEY (id_job, id_zh, cor_rule_id),
+            CONSTRAINT fk_t_rescoring_notes_id_job FOREIGN KEY (id_job)
+                REFERENCES pr_zh.t_rescoring_jobs(id_job) ON UPDATE CASCADE ON DELETE CASCADE
+        );
+        COMMENT ON TABLE pr_zh.t_rescoring_notes IS 'notes de hiérarchisation calculées par une tâche de recalcul, recopiées dans cor_zh_notes en une seule transaction à la fin de la tâche';
+
+        CREATE OR REPLACE FUNCTION pr_zh.enqueue_rescoring(rb integer)
+        RETURNS void
+        LANGUAGE plpgsql
+        AS $function$
+        BEGIN
+            IF rb IS NOT NULL AND EXISTS (SELECT 1 FROM pr_zh.t_river_basin WHERE id_rb = rb) THEN
+                INSERT INTO pr_zh.t_rescoring_jobs (id_rb) VALUES (rb)
+                ON CONFLICT (id_rb) WHERE status = 'pending' DO NOTHING;
+            END IF;
+        END;
+        $function$;
+
+        CREATE OR REPLACE FUNCTION pr_zh.fct_trg_enqueue_rescoring_rb()
+        RETURNS trigger
+        LANGUAGE plpgsql
+        AS $function$
+        BEGIN
+            IF TG_OP IN ('UPDATE', 'DELETE') THEN
+                IF TG_TABLE_NAME = 'cor_rb_rules' THEN
+                    PERFORM pr_zh.enqueue_rescoring(OLD.rb_id);
+                ELSE
+                    PERFORM pr_zh.enqueue_rescoring(rb_id)
+                    FROM pr_zh.cor_rb_rules WHERE cor_rule_id = OLD.cor_rule_id;
+                END IF;
+            END IF;
+            IF TG_OP IN ('INSERT', 'UPDATE') THEN
+                IF TG_TABLE_NAME = 'cor_rb_rules' THEN
+                    PERFORM pr_zh.enqueue_rescoring(NEW.rb_id);
+                ELSE
+                    PERFORM pr_zh.enqueue_rescoring(rb_id)
+                    FROM pr_zh.cor_rb_rules WHERE cor_rule_id = NEW.cor_rule_id;
+                END IF;
+            END IF;
+            RETURN NULL;
+        END;
+        $function$;
+
+        CREATE OR REPLACE FUNCTION pr_zh.fct_trg_enqueue_rescoring_all()
+        RETURNS trigger
+        LANGUAGE plpgsql
+        AS $function$
+        BEGIN
+            PERFORM pr_zh.enqueue_rescoring(rb_id)
+            FROM (SELECT DISTINCT rb_id FROM pr_zh.cor_rb_rules) AS rbs;
+            RETURN NULL;
+        END;
+        $function$;
+        """
+    )
+    for table in RB_RULES_TABLES:
+        op.execute(
+            f"""
+            CREATE TRIGGER tri_enqueue_rescoring
+            AFTER INSERT OR UPDATE OR DELETE ON pr_zh.{table}
+            FOR EACH ROW EXECUTE PROCEDURE pr_zh.fct_trg_enqueue_rescoring_rb();
+            """
+        )
+    for table in SHARED_RULES_TABLES:
+        op.execute(
+            f"""
+            CREATE TRIGGER tri_enqueue_rescoring
+            AFTER INSERT OR UPDATE OR DELETE OR TRUNCATE ON pr_zh.{table}
+            FOR EACH STATEMENT EXECUTE PROCEDURE pr_zh.fct_trg_enqueue_rescoring_all();
+            """
+        )
+
+
+def downgrade():
+    for table in RB_RULES_TABLES + SHARED_RULES_TABLES:
+        op.execute(f"DROP TRIGGER IF EXISTS tri_enqueue_rescoring ON pr_zh.{table};")
+    op.execute(
+        """
+        DROP FUNCTION IF EXISTS pr_zh.fct_trg_enqueue_rescoring_all();
+        DROP FUNCTION IF EXISTS pr_zh.fct_trg_enqueue_rescoring_rb();
+        DROP FUNCTION IF EXISTS pr_zh.enqueue_rescoring(integer);
+        DROP TABLE IF EXISTS pr_zh.t_rescoring_notes;
+        DROP TABLE IF EXISTS pr_zh.t_rescoring_batches;
+        DROP TABLE IF EXISTS pr_zh.t_rescoring_jobs;
+        """
+    )
@@ -0,0 +1,86 @@
+"""materialized rb_notes_summary
+
+Revision ID: 93cbc3eed2c0
+Revises: 00b2162095a4
+Create Date: 2026-10-18 12:26:10.772931
+
+"""
+from alembic import op
+
+
+# revision identifiers, used by Alembic.
+revision = "93cbc3eed2c0"
+down_revision = "00b2162095a4"
+branch_labels = None
+depends_on = None
+
+# select of the pr_zh.rb_notes_summary view (script_create_tables.sql)
+RB_NOTES_SUMMARY = """
+    SELECT
+        rb.name AS bassin_versant,
+        COALESCE(rub1.note,0) + COALESCE(rub2.note,0) + COALESCE(rub3.note,0) + COALESCE(rub4.note,0) + COALESCE(rub5.note,0) + COALESCE(rub6.note,0) + COALESCE(rub7.note,0) + COALESCE(rub8.note,0) AS global_note,
+        COALESCE(rub1.note,0) + COALESCE(rub2.note,0) + COALESCE(rub3.note,0) + COALESCE(rub4.note,0) + COALESCE(rub5.note,0) AS volet_1,
+        COALESCE(rub6.note,0) + COALESCE(rub7.note,0) + COALESCE(rub8.note,0) AS volet_2,
+        rub1.note AS rub_sdage,
+        rub2.note AS rub_interet_pat,
+        rub3.note AS rub_eco,
+        rub4.note AS rub_hydro,
+        rub5.note AS rub_socio,
+        rub6.note AS rub_statut,
+        rub7.note AS rub_etat_fonct,
+        rub8.note AS rub_menaces{id_rb}
+    FROM pr_zh.t_river_basin rb
+    RIGHT JOIN pr_zh.cor_rb_rules rb_rules ON rb.id_rb = rb_rules.rb_id
+    JOIN (SELECT * FROM pr_zh.get_cat_note_without_subcats(1)) rub1 ON rub1.rb_id = rb.id_rb
+    JOIN (SELECT * FROM pr_zh.get_cat_note_with_subcats(2)) rub2 ON rub2.rb_id = rb.id_rb
+    JOIN (SELECT * FROM pr_zh.get_cat_note_without_subcats(3)) rub3 ON rub3.rb_id = rb.id_rb
+    JOIN (SELECT * FROM pr_zh.get_cat_note_with_subcats(4)) rub4 ON rub4.rb_id = rb.id_rb
+    JOIN (SELECT * FROM pr_zh.get_cat_note_with_subcats(5)) rub5 ON rub5.rb_id = rb.id_rb
+    JOIN (SELECT * FROM pr_zh.get_cat_note_with_subcats(6)) rub6 ON rub6.rb_id = rb.id_rb
+    JOIN (SELECT * FROM pr_zh.get_cat_note_with_subcats(7)) rub7 ON rub7.rb_id = rb.id_rb
+    JOIN (SELECT * FROM pr_zh.get_cat_note_without_subcats(8)) rub8 ON rub8.rb_id = rb.id_rb
+    GROUP BY rb.id_rb, rb.name, rub1.note, rub2.note, rub3.note, rub4.note, rub5.note, rub6.note, rub7.note, rub8.note
+    ORDER BY rb.id_rb ASC
+"""
+
+
+def upgrade():
+    # the view is kept (v_rb_notes_summary, maximum notes of the current
+    # rules) with the id_rb column: the names of the river basins are not unique
+    op.execute(
+        f"""
+        ALTER VIEW pr_zh.rb_notes_summary RENAME TO v_rb_notes_summary;
+        CREATE OR REPLACE VIEW pr_zh.v_rb_notes_summary AS (
+            {RB_NOTES_SUMMARY.format(id_rb=", rb.id_rb")}
+        );
+
+        CREATE TABLE pr_zh.rb_notes_summary AS SELECT * FROM pr_zh.v_rb_notes_summary;
+        ALTER TABLE pr_zh.rb_notes_summary
+            ADD CONSTRAINT pk_rb_notes_summary PRIMARY KEY (id_rb);
+        COMMENT ON TABLE pr_zh.rb_notes_summary IS 'notes maximales de chaque bassin versant pour les règles avec lesquelles ses notes de hiérarchisation ont été calculées, rafraîchies à la fin de chaque tâche de recalcul des notes';
+
+        CREATE OR REPLACE FUNCTION pr_zh.refresh_rb_notes_summary(rb integer DEFAULT NULL)
+        RETURNS void
+        LANGUAGE plpgsql
+        AS $function$
+        BEGIN
+            DELETE FROM pr_zh.rb_notes_summary WHERE rb IS NULL OR id_rb = rb;
+            INSERT INTO pr_zh.rb_notes_summary
+                SELECT * FROM pr_zh.v_rb_notes_summary WHERE rb IS NULL OR id_rb = rb;
+        END;
+        $function$;
+        """
+    )
+
+
+def downgrade():
+    op.execute(
+        f"""
+        DROP FUNCTION IF EXISTS pr_zh.refresh_rb_notes_summary(integer);
+        DROP TABLE IF EXISTS pr_zh.rb_notes_summary;
+        DROP VIEW IF EXISTS pr_zh.v_rb_notes_summary;
+        CREATE VIEW pr_zh.rb_notes_summary AS (
+            {RB_NOTES_SUMMARY.format(id_rb="")}
+        );
+        """
+    )
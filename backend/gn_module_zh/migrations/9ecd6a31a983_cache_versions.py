@@ -0,0 +1,117 @@
+"""cache versions
+
+Revision ID: 9ecd6a31a983
+Revises: f2c1e648f6ca
+Create Date: 2026-10-18 10:03:27.904512
+
+"""
+from alembic import op
+
+
+# revision identifiers, used by Alembic.
+revision = "9ecd6a31a983"
+down_revision = "f2c1e648f6ca"
+branch_labels = None
+depends_on = None
+
+# tables whose writes invalidate the values cached from the zh data (the
+# hierarchy notes have their own version, bumped by the rescoring queue)
+ZH_TABLES = [
+    "t_zh",
+    "cor_lim_list",
+    "cor_zh_area",
+    "cor_zh_cb",
+    "cor_zh_corine_cover",
+    "cor_zh_fct_area",
+    "cor_zh_hydro",
+    "cor_zh_lim_fs",
+    "cor_zh_protection",
+    "cor_zh_rb",
+    "cor_zh_ref",
+    "t_actions",
+    "t_activity",
+    "t_functions",
+    "t_hab_heritage",
+    "t_inflow",
+    "t_instruments",
+    "t_management_plans",
+    "t_management_structures",
+    "t_outflow",
+    "t_ownership",
+    "t_urban_planning_docs",
+]
+
+
+def upgrade():
+    op.execute(
+        """
+        CREATE TABLE pr_zh.t_cache_versions (
+            name varchar(50) NOT NULL,
+            version bigint DEFAULT 0 NOT NULL,
+            update_date timestamp DEFAULT now(),
+            CONSTRAINT pk_t_cache_versions PRIMARY KEY (name)
+        );
+        COMMENT ON TABLE pr_zh.t_cache_versions IS 'version des données utilisées par les caches du module, incrémentée à chaque modification';
+
+        CREATE OR REPLACE FUNCTION pr_zh.fct_trg_bump_cache_version()
+        RETURNS trigger
+        LANGUAGE plpgsql
+        AS $function$
+        BEGIN
+            INSERT INTO pr_zh.t_cache_versions (name, version, update_date)
+            VALUES (TG_ARGV[0], 1, now())
+            ON CONFLICT (name) DO UPDATE
+                SET version = pr_zh.t_cache_versions.version + 1, update_date = now();
+            RETURN NULL;
+        END;
+        $function$;
+
+        -- the zh version is written by every save of a zh form: a sequence
+        -- is not locked by the concurrent transactions, unlike a row
+        CREATE SEQUENCE pr_zh.s_cache_version_zh;
+        COMMENT ON SEQUENCE pr_zh.s_cache_version_zh IS 'version des données des zones humides utilisées par les caches du module, incrémentée à la validation de chaque transaction les modifiant';
+
+        CREATE OR REPLACE FUNCTION pr_zh.fct_trg_bump_cache_sequence()
+        RETURNS trigger
+        LANGUAGE plpgsql
+        AS $function$
+        BEGIN
+            PERFORM nextval(TG_ARGV[0]::regclass);
+            RETURN NULL;
+        END;
+        $function$;
+        """
+    )
+    for table in ZH_TABLES:
+        # deferred to the commit: the values cached by a concurrent request
+        # with the new version are read after the writes of the transaction
+        op.execute(
+            f"""
+            CREATE CONSTRAINT TRIGGER tri_bump_cache_version_zh
+            AFTER INSERT OR UPDATE OR DELETE ON pr_zh.{table}
+            DEFERRABLE INITIALLY DEFERRED
+            FOR EACH ROW EXECUTE PROCEDURE pr_zh.fct_trg_bump_cache_sequence('pr_zh.s_cache_version_zh');
+
+            CREATE TRIGGER tri_bump_cache_version_zh_truncate
+            AFTER TRUNCATE ON pr_zh.{table}
+            FOR EACH STATEMENT EXECUTE PROCEDURE pr_zh.fct_trg_bump_cache_sequence('pr_zh.s_cache_version_zh');
+            """
+        )
+
+
+def downgrade():
+    for table in ZH_TABLES:
+        op.execute(
+            f"""
+            DROP TRIGGER IF EXISTS tri_bump_cache_version_zh ON pr_zh.{table};
+            DROP TRIGGER IF EXISTS tri_bump_cache_version_zh_truncate ON pr_zh.{table};
+            """
+        )
+    op.execute(
+        """
+        DROP FUNCTION IF EXISTS pr_zh.fct_trg_bump_cache_sequence();
+        DROP SEQUENCE IF EXISTS pr_zh.s_cache_version_zh;
+        DROP FUNCTION IF EXISTS pr_zh.fct_trg_bump_cache_version();
+        DROP TABLE IF EXISTS pr_zh.t_cache_versions;
+        """
+    )
@@ -0,0 +1,42 @@
+"""labels cache version
+
+Revision ID: da9d975bc798
+Revises: 41ddddd99151
+Create Date: 2026-10-18 16:42:09.215733
+
+"""
+from alembic import op
+
+
+# revision identifiers, used by Alembic.
+revision = "da9d975bc798"
+down_revision = "41ddddd99151"
+branch_labels = None
+depends_on = None
+
+# tables whose writes invalidate the labels cached for the cards
+LABELS_TABLES = [
+    "ref_nomenclatures.t_nomenclatures",
+    "ref_geo.bib_areas_types",
+    "pr_zh.bib_actions",
+    "pr_zh.cor_impact_types",
+    "pr_zh.cor_protection_level_type",
+    "pr_zh.cor_urban_type_range",
+]
+
+
+def upgrade():
+    for table in LABELS_TABLES:
+        op.execute(
+            f"""
+            CREATE TRIGGER tri_bump_cache_version_labels
+            AFTER INSERT OR UPDATE OR DELETE OR TRUNCATE ON {table}
+            FOR EACH STATEMENT EXECUTE PROCEDURE pr_zh.fct_trg_bump_cache_version('labels');
+            """
+        )
+
+
+def downgrade():
+    for table in LABELS_TABLES:
+        op.execute(f"DROP TRIGGER IF EXISTS tri_bump_cache_version_labels ON {table};")
+    op.execute("DELETE FROM pr_zh.t_cache_versions WHERE name = 'labels';")
@@ -0,0 +1,38 @@
+"""zh list sort indexes
+
+Revision ID: f2c1e648f6ca
+Revises: 22b14fc3abe0
+Create Date: 2026-10-18 09:12:41.518203
+
+"""
+from alembic import op
+
+
+# revision identifiers, used by Alembic.
+revision = "f2c1e648f6ca"
+down_revision = "22b14fc3abe0"
+branch_labels = None
+depends_on = None
+
+
+def upgrade():
+    # (column, id_zh) indexes used by the keyset pagination of the zh list
+    op.execute(
+        """
+        CREATE INDEX IF NOT EXISTS i_t_zh_update_date_id_zh ON pr_zh.t_zh (update_date, id_zh);
+        CREATE INDEX IF NOT EXISTS i_t_zh_create_date_id_zh ON pr_zh.t_zh (create_date, id_zh);
+        CREATE INDEX IF NOT EXISTS i_t_zh_main_name_id_zh ON pr_zh.t_zh (main_name, id_zh);
+        CREATE INDEX IF NOT EXISTS i_t_zh_code_id_zh ON pr_zh.t_zh (code, id_zh);
+        """
+    )
+
+
+def downgrade():
+    op.execute(
+        """
+        DROP INDEX IF EXISTS pr_zh.i_t_zh_update_date_id_zh;
+        DROP INDEX IF EXISTS pr_zh.i_t_zh_create_date_id_zh;
+        DROP INDEX IF EXISTS pr_zh.i_t_zh_main_name_id_zh;
+        DROP INDEX IF EXISTS pr_zh.i_t_zh_code_id_zh;
+        """
+    )
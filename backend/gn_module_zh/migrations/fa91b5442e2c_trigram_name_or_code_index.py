@@ -0,0 +1,44 @@
+"""trigram name or code index
+
+Revision ID: fa91b5442e2c
+Revises: 9ecd6a31a983
+Create Date: 2026-10-18 10:48:05.331870
+
+"""
+from alembic import op
+
+
+# revision identifiers, used by Alembic.
+revision = "fa91b5442e2c"
+down_revision = "9ecd6a31a983"
+branch_labels = None
+depends_on = None
+
+
+def upgrade():
+    op.execute(
+        """
+        CREATE EXTENSION IF NOT EXISTS "pg_trgm";
+
+        -- unaccent is only stable (its dictionary can change), it cannot be used in an index
+        -- unless it is wrapped in an immutable function with an explicit dictionary
+        CREATE OR REPLACE FUNCTION pr_zh.immutable_unaccent(text)
+        RETURNS text
+        LANGUAGE sql IMMUTABLE PARALLEL SAFE STRICT
+        AS $function$
+            SELECT public.unaccent('public.unaccent'::regdictionary, $1)
+        $function$;
+
+        CREATE INDEX IF NOT EXISTS i_t_zh_fullname_trgm ON pr_zh.t_zh
+            USING gin (lower(pr_zh.immutable_unaccent(main_name || ' ' || code)) gin_trgm_ops);
+        """
+    )
+
+
+def downgrade():
+    op.execute(
+        """
+        DROP INDEX IF EXISTS pr_zh.i_t_zh_fullname_trgm;
+        DROP FUNCTION IF EXISTS pr_zh.immutable_unaccent(text);
+        """
+    )
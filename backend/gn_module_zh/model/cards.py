@@ -1,23 +1,19 @@
 from itertools import groupby
 from werkzeug.exceptions import NotFound
 
-from ref_geo.models import BibAreasTypes, LAreas
+from ref_geo.models import LAreas
 from geonature.utils.env import DB
 from pypn_habref_api.models import Habref
-from pypnnomenclature.models import TNomenclatures
 
 from ..api_error import ZHApiError
+from ..cache import get_labels
 from ..hierarchy import Hierarchy
 from ..nomenclatures import get_corine_biotope
 from .zh import ZH
 from .zh_schema import (
     TZH,
-    BibActions,
     BibOrganismes,
     CorChStatus,
-    CorImpactTypes,
-    CorProtectionLevelType,
-    CorUrbanTypeRange,
     CorZhArea,
     CorZhHydro,
     CorZhRb,
@@ -27,41 +23,29 @@ from .zh_schema import (
 
 
 class Utils(ZH):
+    # the labels are read from the nomenclatures loaded once per version (get_labels)
     @staticmethod
     def get_mnemo(ids):
         if ids:
+            nomenclatures = get_labels()["nomenclatures"]
             if type(ids) is int:
-                return (
-                    DB.session.query(TNomenclatures)
-                    .filter(TNomenclatures.id_nomenclature == ids)
-                    .one()
-                    .label_default
-                )
-            return [
-                DB.session.query(TNomenclatures)
-                .filter(TNomenclatures.id_nomenclature == id)
-                .one()
-                .label_default
-                for id in ids
-            ]
+                return nomenclatures[ids]["label_default"]
+            return [nomenclatures[id]["label_default"] for id in ids]
         return []
 
     @staticmethod
     def get_cd_and_mnemo(ids):
         if ids:
+            nomenclatures = get_labels()["nomenclatures"]
             if type(ids) is int:
-                result = (
-                    DB.session.query(TNomenclatures)
-                    .filter(TNomenclatures.id_nomenclature == ids)
-                    .one()
-                )
-                return (result.cd_nomenclature, result.label_default)
+                result = nomenclatures[ids]
+                return (result["cd_nomenclature"], result["label_default"])
 
-            return (
-                DB.session.query(TNomenclatures.cd_nomenclature, TNomenclatures.label_default)
-                .filter(TNomenclatures.id_nomenclature.in_(ids))
-                .all()
-            )
+            return [
+                (nomenclatures[id]["cd_nomenclature"], nomenclatures[id]["label_default"])
+                for id in ids
+                if id in nomenclatures
+            ]
 
         return []
 
@@ -157,11 +141,10 @@ class Info:
 
 
 class Localisation:
-    def __init__(self, id_zh, regions, departments):
-        self.id_zh = id_zh
+    def __init__(self, municipalities, regions, departments):
         self.regions = regions
         self.departments = departments
-        self.municipalities = self.__get_municipalities_info()
+        self.municipalities = self.__get_municipalities_info(municipalities)
 
     def __str__(self):
         return {
@@ -170,20 +153,20 @@ class Localisation:
             "commune": self.municipalities,
         }
 
-    def __get_municipalities_info(self):
+    def __get_municipalities_info(self, municipalities):
         return [
             Municipalities(
                 municipality.LiMunicipalities.nom_com,
                 municipality.LiMunicipalities.insee_com,
                 municipality.CorZhArea.cover,
             ).__str__()
-            for municipality in CorZhArea.get_municipalities_info(self.id_zh)
+            for municipality in municipalities
         ]
 
 
 class Author:
-    def __init__(self, id_zh, create_date, update_date):
-        self.zh = TZH.get_tzh_by_id(id_zh)
+    def __init__(self, zh, create_date, update_date):
+        self.zh = zh
         self.create_date = create_date
         self.update_date = update_date
         self.create_author = self.__get_author()
@@ -511,6 +494,7 @@ class Basin:
             for (name,) in DB.session.query(TRiverBasin.name)
             .filter(TRiverBasin.id_rb == CorZhRb.id_rb)
             .filter(CorZhRb.id_zh == self.id_zh)
+            .order_by(CorZhRb.is_main.desc(), TRiverBasin.name)
             .all()
         ]
 
@@ -581,10 +565,12 @@ class Activity:
         self.remark_activity: str = remark_activity
 
     def __str_impact(self):
+        labels = get_labels()
+        impact_types = [labels["impact_types"].get(id) for id in self.ids_impact]
         return [
-            cor.TNomenclatures.label_fr
-            for cor in CorImpactTypes.get_impacts()
-            if cor.CorImpactTypes.id_cor_impact_types in self.ids_impact
+            labels["nomenclatures"][impact_type["id_impact"]]["label_fr"]
+            for impact_type in impact_types
+            if impact_type is not None and impact_type["active"]
         ]
 
     def __str__(self):
@@ -679,12 +665,7 @@ class Status:
         refs = []
         for ref in CorZhArea.get_ref_geo_info(self.id_zh, id_types):
             for i in ref:
-                type_code = (
-                    DB.session.query(BibAreasTypes)
-                    .filter(BibAreasTypes.id_type == i.LAreas.id_type)
-                    .one()
-                    .type_code
-                )
+                type_code = get_labels()["area_types"][i.LAreas.id_type]
                 refs.append(
                     {
                         "area_name": i.LAreas.area_name,
@@ -725,17 +706,13 @@ class Status:
         self.__protections: list(int) = protections
 
     def __str_protections(self):
-        q_protections = (
-            DB.session.query(CorProtectionLevelType)
-            .filter(CorProtectionLevelType.id_protection_status.in_(self.protections))
-            .all()
-        )
         temp = [
             {
-                "status": Utils.get_mnemo(protection.id_protection_status),
-                "category": Utils.get_mnemo(protection.id_protection_type),
+                "status": Utils.get_mnemo(protection["id_protection_status"]),
+                "category": Utils.get_mnemo(protection["id_protection_type"]),
             }
-            for protection in q_protections
+            for protection in get_labels()["protection_levels"]
+            if protection["id_protection_status"] in self.protections
         ]
         return [
             {"category": key or "AUTRE", "items": list(group)}
@@ -828,13 +805,7 @@ class UrbanDoc:
             .area_name,
             "type_doc": Utils.get_mnemo(self.id_doc_type),
             "type_classement": [
-                Utils.get_mnemo(
-                    DB.session.query(CorUrbanTypeRange)
-                    .filter(CorUrbanTypeRange.id_cor == id)
-                    .one()
-                    .id_range_type
-                )
-                for id in self.id_cors
+                Utils.get_mnemo(get_labels()["urban_ranges"][id]) for id in self.id_cors
             ],
             "remarque": Utils.get_string(self.remark),
         }
@@ -1022,20 +993,20 @@ class Action:
 
     def __str__(self):
         return {
-            "proposition": DB.session.query(BibActions)
-            .filter(BibActions.id_action == self.id_action)
-            .one()
-            .name,
+            "proposition": get_labels()["actions"][self.id_action],
             "niveau": Utils.get_mnemo(self.id_priority_level),
             "remarque": Utils.get_string(self.remark),
         }
 
 
 class Card(ZH):
-    def __init__(self, id_zh, type, ref_geo_config):
+    def __init__(self, id_zh, type, ref_geo_config, zh=None):
         self.id_zh = id_zh
         self.type = type
         self.ref_geo_config = ref_geo_config
+        # one snapshot of the zh for the properties, the geometry and the evaluation
+        self.snapshot = zh if zh is not None else ZH(id_zh)
+        self.feature = self.snapshot.__repr__()
         self.properties = self.get_properties()
         self.eval = self.get_eval()
         self.info = Info()
@@ -1051,10 +1022,10 @@ class Card(ZH):
             self.hierarchy = None
 
     def get_properties(self):
-        return ZH(self.id_zh).__repr__()["properties"]
+        return self.feature["properties"]
 
     def get_eval(self):
-        return ZH(self.id_zh).get_eval()
+        return self.snapshot.get_eval()
 
     def __repr__(self):
         return {
@@ -1070,7 +1041,7 @@ class Card(ZH):
         }
 
     def __set_geometry(self):
-        return ZH(self.id_zh).__repr__()["geometry"]
+        return self.feature["geometry"]
 
     def __set_info(self):
         self.__set_identification()
@@ -1090,7 +1061,7 @@ class Card(ZH):
 
     def __set_localisation(self):
         self.info.localisation = Localisation(
-            self.id_zh,
+            self.snapshot.load()["municipalities"],
             self.properties["geo_info"]["regions"],
             self.properties["geo_info"]["departments"]
             # self.ref_geo_config
@@ -1098,7 +1069,7 @@ class Card(ZH):
 
     def __set_author(self):
         self.info.authors = Author(
-            self.id_zh, self.properties["create_date"], self.properties["update_date"]
+            self.snapshot.zh, self.properties["create_date"], self.properties["update_date"]
         )
 
     def __set_references(self):
@@ -2,7 +2,7 @@
 # The rules here are "Global" rules so they are
 # not written in the database.
 from dataclasses import asdict, dataclass, field
-from typing import List, Optional
+from typing import FrozenSet, List, Mapping, Optional, Tuple
 
 
 @dataclass
@@ -24,3 +24,137 @@ class GlobalMark(BaseItem):
 class GlobalItem(BaseItem):
     attribut: str = ""
     id_attribut: int = 0
+
+
+class FrozenDict(dict):
+    """
+    Read-only dict, picklable unlike types.MappingProxyType
+    """
+
+    def _readonly(self, *args, **kwargs):
+        raise TypeError("FrozenDict is read-only")
+
+    __setitem__ = __delitem__ = _readonly
+    clear = pop = popitem = setdefault = update = _readonly
+
+    def __reduce__(self):
+        return (FrozenDict, (dict(self),))
+
+
+@dataclass(frozen=True)
+class Rule:
+    """
+    Rule (t_rules) of the hierarchy and its parameters in a river basin
+    (cor_rb_rules, t_items), cor_rule_id is None if the rule is not active
+    """
+
+    abb: str
+    rule_id: int
+    name: str
+    cor_rule_id: Optional[int] = None
+    # (attribute_id, note, note_type_id) of t_items, ordered by val_id
+    items: Tuple[Tuple[int, int, int], ...] = ()
+    # (nomenc_id, qualif_id) of cor_rule_nomenc
+    nomencs: Tuple[Tuple[int, Optional[int]], ...] = ()
+    attribute_ids: FrozenSet[int] = field(init=False)
+    notes: Mapping[Tuple[int, int], Tuple[int, ...]] = field(init=False)
+    denominator: Optional[int] = field(init=False)
+
+    def __post_init__(self):
+        notes = {}
+        for attribute_id, note, note_type_id in self.items:
+            notes[(attribute_id, note_type_id)] = notes.get((attribute_id, note_type_id), ()) + (
+                note,
+            )
+        object.__setattr__(self, "attribute_ids", frozenset(item[0] for item in self.items))
+        object.__setattr__(self, "notes", FrozenDict(notes))
+        object.__setattr__(
+            self, "denominator", max((item[1] for item in self.items), default=None)
+        )
+
+    @property
+    def active(self) -> bool:
+        return self.cor_rule_id is not None
+
+    def get_nomencs(self, qualif_id=None) -> List[int]:
+        return [
+            nomenc_id for nomenc_id, nomenc_qualif in self.nomencs if nomenc_qualif == qualif_id
+        ]
+
+
+@dataclass(frozen=True)
+class RuleReferential:
+    """
+    Nomenclatures and correspondences shared by the rules of all the river basins
+    """
+
+    # HIERARCHY id_nomenclature by cd_nomenclature
+    hierarchy: Mapping[str, int]
+    # (mnemonique, id_nomenclature) of FONCTIONS_QUALIF, ordered by id_nomenclature
+    functions_qualif: Tuple[Tuple[str, int], ...]
+    high_knowledge_id: Optional[int]
+    management_plan_id: Optional[int]
+    naturalist_ids: FrozenSet[int]
+    # (label_default, mnemonique) by id_nomenclature
+    labels: Mapping[int, Tuple[str, str]]
+    # bib_hier_categories label by abbreviation
+    categories: Mapping[str, str]
+    # (val_min, val_max) of cor_item_value by attribute_id
+    item_values: Mapping[int, Tuple[int, int]]
+    # t_cor_qualif id_qualification by combination
+    combinations: Mapping[str, int]
+    # bib_note_types note_ids by id_knowledge
+    knowledge_notes: Mapping[int, Tuple[int, ...]]
+    # knowledge mnemonique by note_id
+    knowledge_labels: Mapping[int, str]
+
+
+@dataclass(frozen=True)
+class RuleModel:
+    """
+    Immutable hierarchy rules of a river basin, valid for one version of the rules
+    """
+
+    rb_id: int
+    name: str
+    version: int
+    rules: Mapping[str, Rule]
+    # maximum notes of the river basin (rb_notes_summary row)
+    denominators: Mapping[str, int]
+    referential: RuleReferential
+
+
+@dataclass(frozen=True)
+class ZhFunction:
+    """
+    Function (t_functions) of a zh
+    """
+
+    id_function: int
+    id_qualification: Optional[int] = None
+    id_knowledge: Optional[int] = None
+
+
+@dataclass(frozen=True)
+class ZhSnapshot:
+    """
+    Data of a zh used by the hierarchy rules
+    """
+
+    id_zh: int
+    id_sdage: Optional[int] = None
+    id_thread: Optional[int] = None
+    nb_hab: Optional[int] = None
+    nb_flora_sp: Optional[int] = None
+    nb_vertebrate_sp: Optional[int] = None
+    nb_invertebrate_sp: Optional[int] = None
+    is_carto_hab: Optional[bool] = None
+    is_other_inventory: Optional[bool] = None
+    # cd_nomenclature of the hydrological and biological diagnostics
+    diag_hydro_cd: Optional[str] = None
+    diag_bio_cd: Optional[str] = None
+    functions: Tuple[ZhFunction, ...] = ()
+    # id_protection_status of the protections
+    statuses: Tuple[int, ...] = ()
+    # id_nature of the management plans
+    plans: Tuple[Optional[int], ...] = ()
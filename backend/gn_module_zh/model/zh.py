@@ -1,5 +1,10 @@
+from collections import defaultdict
+
 # instance de la BDD
 from geonature.utils.env import DB
+from pypnnomenclature.models import BibNomenclaturesTypes, TNomenclatures
+from sqlalchemy import func
+from sqlalchemy.orm import aliased
 
 from .zh_schema import (
     TZH,
@@ -27,35 +32,133 @@ from .zh_schema import (
     TUrbanPlanningDocs,
 )
 
+# tables with an id_zh column loaded by ZH.load
+ZH_TABLES = (
+    CorZhLimFs,
+    CorZhCb,
+    CorZhCorineCover,
+    TActivity,
+    TOutflow,
+    TInflow,
+    THabHeritage,
+    TOwnership,
+    TManagementStructures,
+    TInstruments,
+    CorZhProtection,
+    TUrbanPlanningDocs,
+    TActions,
+)
+
+# qualifications of the functions displayed in the evaluation
+EVAL_QUALIFICATIONS = ("Moyenne", "Forte")
+
 
 class ZH(TZH):
     __abstract__ = True
 
     def __init__(self, id_zh):
         self.zh = DB.session.query(TZH).filter(TZH.id_zh == id_zh).one()
+        self.zh_data = None
 
     @staticmethod
     def get_data_by_id(table_name, id_zh):
         return DB.session.query(table_name).filter(table_name.id_zh == id_zh).all()
 
+    @staticmethod
+    def get_data_by_ids(column, ids):
+        """
+        Rows of the table of column whose column value is in ids, grouped by
+        this value, in one query (none if ids is empty)
+        """
+        rows = defaultdict(list)
+        ids = {id for id in ids if id is not None}
+        if ids:
+            for row in DB.session.query(column.class_).filter(column.in_(ids)).all():
+                rows[getattr(row, column.key)].append(row)
+        return rows
+
+    def load(self):
+        """
+        Loads, on first call, all the data of the zh with one query per table.
+        The getters below read this snapshot so that building the form data,
+        the evaluation and the card of a zh queries each table once
+        """
+        if self.zh_data is None:
+            zh_data = {table: ZH.get_data_by_id(table, self.zh.id_zh) for table in ZH_TABLES}
+            zh_data["lims"] = CorLimList.get_lims_by_id(self.zh.id_lim_list)
+            zh_data["references"] = CorZhRef.get_references_by_id(self.zh.id_zh)
+            zh_data["functions"] = ZH.get_functions_by_id(self.zh.id_zh)
+            zh_data["departments"] = CorZhArea.get_departments(self.zh.id_zh)
+            zh_data["municipalities"] = CorZhArea.get_municipalities_info(self.zh.id_zh)
+            # rows of the tables linked to the tables of the zh, in one query each
+            zh_data["impacts"] = ZH.get_data_by_ids(
+                CorImpactList.id_impact_list,
+                [activity.id_impact_list for activity in zh_data[TActivity]],
+            )
+            zh_data["plans"] = ZH.get_data_by_ids(
+                TManagementPlans.id_structure,
+                [structure.id_structure for structure in zh_data[TManagementStructures]],
+            )
+            zh_data["protection_levels"] = ZH.get_data_by_ids(
+                CorProtectionLevelType.id_protection,
+                [protection.id_protection for protection in zh_data[CorZhProtection]],
+            )
+            zh_data["doc_ranges"] = ZH.get_data_by_ids(
+                CorZhDocRange.id_doc,
+                [urban_doc.id_doc for urban_doc in zh_data[TUrbanPlanningDocs]],
+            )
+            self.zh_data = zh_data
+        return self.zh_data
+
+    @staticmethod
+    def get_functions_by_id(id_zh):
+        """
+        Functions of a zh with the nomenclature type (category) of the function
+        and the mnemonique of its qualification
+        """
+        function_nomenclature = aliased(TNomenclatures)
+        qualification = aliased(TNomenclatures)
+        return (
+            DB.session.query(
+                TFunctions,
+                BibNomenclaturesTypes.mnemonique.label("category"),
+                qualification.mnemonique.label("qualification"),
+            )
+            .join(
+                function_nomenclature,
+                function_nomenclature.id_nomenclature == TFunctions.id_function,
+            )
+            .join(
+                BibNomenclaturesTypes,
+                BibNomenclaturesTypes.id_type == function_nomenclature.id_type,
+            )
+            .join(qualification, qualification.id_nomenclature == TFunctions.id_qualification)
+            .filter(
+                TFunctions.id_zh == id_zh,
+                qualification.id_type
+                == func.ref_nomenclatures.get_id_nomenclature_type("FONCTIONS_QUALIF"),
+            )
+            .all()
+        )
+
     def get_id_lims(self):
-        lim_list = CorLimList.get_lims_by_id(self.zh.id_lim_list)
+        lim_list = self.load()["lims"]
         return {"id_lims": [id.id_lim for id in lim_list]}
 
     def get_id_lims_fs(self):
-        lim_fs_list = ZH.get_data_by_id(CorZhLimFs, self.zh.id_zh)
+        lim_fs_list = self.load()[CorZhLimFs]
         return {"id_lims_fs": [id.id_lim_fs for id in lim_fs_list]}
 
     def get_id_references(self):
-        ref_list = CorZhRef.get_references_by_id(self.zh.id_zh)
+        ref_list = self.load()["references"]
         return {"id_references": [ref.as_dict() for ref in ref_list]}
 
     def get_cb_codes(self):
-        corine_biotopes = ZH.get_data_by_id(CorZhCb, self.zh.id_zh)
+        corine_biotopes = self.load()[CorZhCb]
         return {"cb_codes_corine_biotope": [cb_code.lb_code for cb_code in corine_biotopes]}
 
     def get_corine_landcovers(self):
-        landcovers = ZH.get_data_by_id(CorZhCorineCover, self.zh.id_zh)
+        landcovers = self.load()[CorZhCorineCover]
         return {"id_corine_landcovers": [landcover.id_cover for landcover in landcovers]}
 
     def get_activities(self):
@@ -66,17 +169,17 @@ class ZH(TZH):
                     "id_localisation": activity.id_position,
                     "ids_impact": [
                         impact.id_cor_impact_types
-                        for impact in CorImpactList.get_impacts_by_uuid(activity.id_impact_list)
+                        for impact in self.load()["impacts"][activity.id_impact_list]
                     ],
                     "remark_activity": activity.remark_activity,
                 }
-                for activity in ZH.get_data_by_id(TActivity, self.zh.id_zh)
+                for activity in self.load()[TActivity]
             ]
         }
 
     def get_flows(self):
-        q_outflows = ZH.get_data_by_id(TOutflow, self.zh.id_zh)
-        q_inflows = ZH.get_data_by_id(TInflow, self.zh.id_zh)
+        q_outflows = self.load()[TOutflow]
+        q_inflows = self.load()[TInflow]
         flows = [
             {
                 "outflows": [
@@ -110,9 +213,9 @@ class ZH(TZH):
                     "id_qualification": function.id_qualification,
                     "id_knowledge": function.id_knowledge,
                 }
-                for function in TFunctions.get_functions_by_id_and_category(
-                    self.zh.id_zh, category, is_eval
-                )
+                for function, function_category, qualification in self.load()["functions"]
+                if function_category == category
+                and (not is_eval or qualification in EVAL_QUALIFICATIONS)
             ]
         }
 
@@ -125,7 +228,7 @@ class ZH(TZH):
                     "id_preservation_state": hab_heritage.id_preservation_state,
                     "hab_cover": hab_heritage.hab_cover,
                 }
-                for hab_heritage in ZH.get_data_by_id(THabHeritage, self.zh.id_zh)
+                for hab_heritage in self.load()[THabHeritage]
             ]
         }
 
@@ -133,19 +236,15 @@ class ZH(TZH):
         return {
             "ownerships": [
                 {"id_status": ownership.id_status, "remark": ownership.remark}
-                for ownership in ZH.get_data_by_id(TOwnership, self.zh.id_zh)
+                for ownership in self.load()[TOwnership]
             ]
         }
 
     def get_managements(self):
-        q_management_structures = ZH.get_data_by_id(TManagementStructures, self.zh.id_zh)
+        q_management_structures = self.load()[TManagementStructures]
         managements = []
         for management in q_management_structures:
-            q_management_plans = (
-                DB.session.query(TManagementPlans)
-                .filter(TManagementPlans.id_structure == management.id_structure)
-                .all()
-            )
+            q_management_plans = self.load()["plans"][management.id_structure]
             plans = []
             if q_management_plans:
                 for plan in q_management_plans:
@@ -169,21 +268,16 @@ class ZH(TZH):
                     if instrument.instrument_date
                     else None,
                 }
-                for instrument in ZH.get_data_by_id(TInstruments, self.zh.id_zh)
+                for instrument in self.load()[TInstruments]
             ]
         }
 
     def get_protections(self):
         return {
             "protections": [
-                DB.session.query(CorProtectionLevelType)
-                .filter(CorProtectionLevelType.id_protection == protec)
-                .one()
-                .id_protection_status
-                for protec in [
-                    protection.id_protection
-                    for protection in ZH.get_data_by_id(CorZhProtection, self.zh.id_zh)
-                ]
+                protection_level.id_protection_status
+                for protection in self.load()[CorZhProtection]
+                for protection_level in self.load()["protection_levels"][protection.id_protection]
             ]
         }
 
@@ -193,15 +287,10 @@ class ZH(TZH):
                 {
                     "id_area": urban_doc.id_area,
                     "id_doc_type": urban_doc.id_doc_type,
-                    "id_cors": [
-                        doc.id_cor
-                        for doc in DB.session.query(CorZhDocRange)
-                        .filter(CorZhDocRange.id_doc == urban_doc.id_doc)
-                        .all()
-                    ],
+                    "id_cors": [doc.id_cor for doc in self.load()["doc_ranges"][urban_doc.id_doc]],
                     "remark": urban_doc.remark,
                 }
-                for urban_doc in ZH.get_data_by_id(TUrbanPlanningDocs, self.zh.id_zh)
+                for urban_doc in self.load()[TUrbanPlanningDocs]
             ]
         }
 
@@ -213,13 +302,13 @@ class ZH(TZH):
                     "id_priority_level": action.id_priority_level,
                     "remark": action.remark,
                 }
-                for action in ZH.get_data_by_id(TActions, self.zh.id_zh)
+                for action in self.load()[TActions]
             ]
         }
 
     def get_fauna_nb(self):
-        vertebrates = self.zh.as_dict()["nb_vertebrate_sp"]
-        invertebrates = self.zh.as_dict()["nb_invertebrate_sp"]
+        vertebrates = self.zh.nb_vertebrate_sp
+        invertebrates = self.zh.nb_invertebrate_sp
 
         if vertebrates is None and invertebrates is None:
             return None
@@ -236,7 +325,7 @@ class ZH(TZH):
     def get_departments(self):
         return [
             {"code": dep.LAreas.area_code, "nom": dep.LAreas.area_name}
-            for dep in CorZhArea.get_departments(self.zh.id_zh)
+            for dep in self.load()["departments"]
         ]
 
     def get_municipalities(self, query):
@@ -261,7 +350,7 @@ class ZH(TZH):
 
     def get_geo_info(self):
         departments = self.get_departments()
-        q_municipalities = CorZhArea.get_municipalities_info(self.zh.id_zh)
+        q_municipalities = self.load()["municipalities"]
         municipalities = self.get_municipalities(q_municipalities)
         regions = self.get_regions(q_municipalities)
         return {
@@ -280,13 +369,13 @@ class ZH(TZH):
         eval.update(self.get_functions("VAL_SOC_ECO", is_eval=True))
         eval.update(
             {
-                "nb_flora_sp": self.zh.as_dict()["nb_flora_sp"],
-                "nb_hab": self.zh.as_dict()["nb_hab"],
+                "nb_flora_sp": self.zh.nb_flora_sp,
+                "nb_hab": self.zh.nb_hab,
                 "nb_fauna_sp": self.get_fauna_nb(),
-                "total_hab_cover": self.zh.as_dict()["total_hab_cover"],
-                "id_thread": self.zh.as_dict()["id_thread"],
-                "id_diag_hydro": self.zh.as_dict()["id_diag_hydro"],
-                "id_diag_bio": self.zh.as_dict()["id_diag_bio"],
+                "total_hab_cover": self.zh.total_hab_cover,
+                "id_thread": self.zh.id_thread,
+                "id_diag_hydro": self.zh.id_diag_hydro,
+                "id_diag_bio": self.zh.id_diag_bio,
             }
         )
         return eval
@@ -8,7 +8,7 @@ from pypnnomenclature.models import BibNomenclaturesTypes, TNomenclatures
 from pypnusershub.db.models import User
 from pypnusershub.db.tools import InsufficientRightsError
 from sqlalchemy import ForeignKey
-from sqlalchemy.dialects.postgresql import UUID
+from sqlalchemy.dialects.postgresql import ARRAY, UUID
 from sqlalchemy.ext.hybrid import hybrid_property
 from sqlalchemy.orm import column_property, relationship
 from sqlalchemy.sql import and_, cast, func, select
@@ -20,6 +20,48 @@ from utils_flask_sqla_geo.serializers import geoserializable
 blueprint = Blueprint("pr_zh", __name__)
 
 
+def is_allowed_to(level, is_owner, is_in_organism):
+    """
+    Droit d'un utilisateur sur une zh en fonction de son niveau d'accès,
+    s'il est le créateur de la zh (is_owner) et s'il appartient
+    à l'organisme du créateur (is_in_organism)
+    """
+    # Si l'utilisateur n'a pas de droit d'accès aux données
+    if level == 0 or level not in (1, 2, 3):
+        return False
+
+    # Si l'utilisateur à le droit d'accéder à toutes les données
+    if level == 3:
+        return True
+
+    # Si l'utilisateur est propriétaire de la données
+    if is_owner:
+        return True
+
+    # Si l'utilisateur appartient à un organisme
+    # qui a un droit sur la données et
+    # que son niveau d'accès est 2 ou 3
+    if is_in_organism and level in (2, 3):
+        return True
+    return False
+
+
+def get_rights_table(user_cruved):
+    """
+    Droits (cruved) d'un utilisateur pour chaque combinaison
+    (is_owner, is_in_organism) : calculés une fois par requête puis
+    lus pour chaque zh d'une liste
+    """
+    return {
+        (is_owner, is_in_organism): {
+            action: is_allowed_to(level, is_owner, is_in_organism)
+            for action, level in user_cruved.items()
+        }
+        for is_owner in (True, False)
+        for is_in_organism in (True, False)
+    }
+
+
 class ZhModel(DB.Model):
     """
     Classe abstraite permettant d'ajout des méthodes
@@ -40,24 +82,7 @@ class ZhModel(DB.Model):
         Fonction permettant de dire si un utilisateur
         peu ou non agir sur une donnée
         """
-        # Si l'utilisateur n'a pas de droit d'accès aux données
-        if level == 0 or level not in (1, 2, 3):
-            return False
-
-        # Si l'utilisateur à le droit d'accéder à toutes les données
-        if level == 3:
-            return True
-
-        # Si l'utilisateur est propriétaire de la données
-        if self.user_is_owner(user):
-            return True
-
-        # Si l'utilisateur appartient à un organisme
-        # qui a un droit sur la données et
-        # que son niveau d'accès est 2 ou 3
-        if self.user_is_in_dataset_actor(user) and level in (2, 3):
-            return True
-        return False
+        return is_allowed_to(level, self.user_is_owner(user), self.user_is_in_dataset_actor(user))
 
     def get_zh_if_allowed(self, user, action, level):
         """
@@ -69,7 +94,7 @@ class ZhModel(DB.Model):
             return self
 
         raise InsufficientRightsError(
-            ('User "{}" cannot "{}" this current zh').format(user.id_role),
+            ('User "{}" cannot "{}" this current zh').format(user.id_role, action),
             403,
         )
 
@@ -389,6 +414,7 @@ class CorZhRb(DB.Model):
     __table_args__ = {"schema": "pr_zh"}
     id_zh = DB.Column(DB.Integer, ForeignKey(TZH.id_zh), primary_key=True)
     id_rb = DB.Column(DB.Integer, ForeignKey(TRiverBasin.id_rb), primary_key=True)
+    is_main = DB.Column(DB.Boolean, nullable=False, default=False)
 
 
 class THydroArea(DB.Model):
@@ -974,7 +1000,8 @@ class CorItemValue(DB.Model):
 class RbNotesSummary(DB.Model):
     __tablename__ = "rb_notes_summary"
     __table_args__ = {"schema": "pr_zh"}
-    bassin_versant = DB.Column(DB.Unicode, primary_key=True)
+    id_rb = DB.Column(DB.Integer, primary_key=True)
+    bassin_versant = DB.Column(DB.Unicode)
     global_note = DB.Column(DB.Integer)
     volet_1 = DB.Column(DB.Integer)
     volet_2 = DB.Column(DB.Integer)
@@ -1011,3 +1038,82 @@ class CorZhNotes(DB.Model):
     note = DB.Column(DB.Float)
     attribute_id = DB.Column(DB.Integer, ForeignKey(TNomenclatures.id_nomenclature))
     note_type_id = DB.Column(DB.Integer, ForeignKey(BibNoteTypes.note_id))
+
+
+class TCacheVersions(DB.Model):
+    __tablename__ = "t_cache_versions"
+    __table_args__ = {"schema": "pr_zh"}
+    name = DB.Column(DB.Unicode(length=50), primary_key=True)
+    version = DB.Column(DB.BigInteger, nullable=False, default=0)
+    update_date = DB.Column(DB.DateTime)
+
+
+class TRescoringJobs(DB.Model):
+    __tablename__ = "t_rescoring_jobs"
+    __table_args__ = {"schema": "pr_zh"}
+    id_job = DB.Column(DB.Integer, primary_key=True)
+    id_rb = DB.Column(DB.Integer, ForeignKey(TRiverBasin.id_rb), nullable=False)
+    status = DB.Column(DB.Unicode(length=20), nullable=False, default="pending")
+    nb_zh = DB.Column(DB.Integer)
+    nb_done = DB.Column(DB.Integer, nullable=False, default=0)
+    nb_errors = DB.Column(DB.Integer, nullable=False, default=0)
+    create_date = DB.Column(DB.DateTime)
+    start_date = DB.Column(DB.DateTime)
+    end_date = DB.Column(DB.DateTime)
+
+
+class TRescoringBatches(DB.Model):
+    __tablename__ = "t_rescoring_batches"
+    __table_args__ = {"schema": "pr_zh"}
+    id_batch = DB.Column(DB.Integer, primary_key=True)
+    id_job = DB.Column(DB.Integer, ForeignKey(TRescoringJobs.id_job), nullable=False)
+    id_zh_list = DB.Column(ARRAY(DB.Integer), nullable=False)
+    status = DB.Column(DB.Unicode(length=20), nullable=False, default="pending")
+    attempts = DB.Column(DB.Integer, nullable=False, default=0)
+    update_date = DB.Column(DB.DateTime)
+    error = DB.Column(DB.Unicode)
+
+
+class TRescoringNotes(DB.Model):
+    __tablename__ = "t_rescoring_notes"
+    __table_args__ = {"schema": "pr_zh"}
+    id_job = DB.Column(DB.Integer, ForeignKey(TRescoringJobs.id_job), primary_key=True)
+    id_zh = DB.Column(DB.Integer, primary_key=True)
+    cor_rule_id = DB.Column(DB.Integer, primary_key=True)
+    note = DB.Column(DB.Float, nullable=False)
+    attribute_id = DB.Column(DB.Integer, nullable=False)
+    note_type_id = DB.Column(DB.Integer, nullable=False)
+
+
+class TZhScoreSummary(DB.Model):
+    __tablename__ = "t_zh_score_summary"
+    __table_args__ = {"schema": "pr_zh"}
+    id_zh = DB.Column(DB.Integer, ForeignKey(TZH.id_zh), primary_key=True)
+    id_rb = DB.Column(DB.Integer, ForeignKey(TRiverBasin.id_rb), nullable=False)
+    global_note = DB.Column(DB.Float, nullable=False)
+    volet_1 = DB.Column(DB.Float, nullable=False)
+    volet_2 = DB.Column(DB.Float, nullable=False)
+    final_note = DB.Column(DB.Float)
+    rub_sdage = DB.Column(DB.Float)
+    rub_interet_pat = DB.Column(DB.Float)
+    rub_eco = DB.Column(DB.Float)
+    rub_hydro = DB.Column(DB.Float)
+    rub_socio = DB.Column(DB.Float)
+    rub_statut = DB.Column(DB.Float)
+    rub_etat_fonct = DB.Column(DB.Float)
+    rub_menaces = DB.Column(DB.Float)
+    update_date = DB.Column(DB.DateTime)
+
+
+class TPdfExports(DB.Model):
+    __tablename__ = "t_pdf_exports"
+    __table_args__ = {"schema": "pr_zh"}
+    id_export = DB.Column(DB.Integer, primary_key=True)
+    id_zh = DB.Column(DB.Integer, ForeignKey(TZH.id_zh), nullable=False)
+    id_role = DB.Column(DB.Integer, ForeignKey(User.id_role), nullable=False)
+    status = DB.Column(DB.Unicode(length=20), nullable=False, default="pending")
+    id_media = DB.Column(DB.Integer)
+    error = DB.Column(DB.Unicode)
+    create_date = DB.Column(DB.DateTime)
+    start_date = DB.Column(DB.DateTime)
+    end_date = DB.Column(DB.DateTime)
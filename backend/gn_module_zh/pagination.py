@@ -0,0 +1,142 @@
+import base64
+import json
+from datetime import date, datetime
+from decimal import Decimal
+from uuid import UUID
+
+from geoalchemy2 import Geometry
+from pypnnomenclature.models import TNomenclatures
+from pypnusershub.db.models import Organisme, User
+from sqlalchemy import and_, or_, tuple_
+from werkzeug.exceptions import BadRequest
+
+from .model.zh_schema import TZH
+from .search import coauthor, coorganism
+
+# columns joined by the zh list query (search.get_list_query) it can be sorted on
+JOINED_SORT_COLUMNS = {
+    "sdage": TNomenclatures.label_default,
+    "author": User.nom_role,
+    "update_author": coauthor.nom_role,
+    "organism": Organisme.nom_organisme,
+    "update_organism": coorganism.nom_organisme,
+}
+
+# sort values which are not json types, stored in the cursor as a string
+# tagged with their type (datetime before date, which it inherits from)
+CURSOR_TYPES = {
+    "datetime": (datetime, datetime.fromisoformat),
+    "date": (date, date.fromisoformat),
+    "uuid": (UUID, UUID),
+    "decimal": (Decimal, Decimal),
+}
+
+
+def get_sort_column(orderby):
+    """
+    Returns the column used to sort the zh list, None if orderby is not sortable
+    """
+    if orderby in JOINED_SORT_COLUMNS:
+        return JOINED_SORT_COLUMNS[orderby]
+    if orderby in TZH.__table__.columns:
+        return getattr(TZH, orderby, None)
+    return None
+
+
+def encode_cursor(orderby, order, value, id_zh):
+    for tag, (value_type, _) in CURSOR_TYPES.items():
+        if isinstance(value, value_type):
+            value = {tag: value.isoformat() if isinstance(value, date) else str(value)}
+            break
+    try:
+        payload = json.dumps({"orderby": orderby, "order": order, "value": value, "id_zh": id_zh})
+    except TypeError:
+        raise BadRequest(f"The zh list cannot be paginated with a cursor on {orderby}")
+    return base64.urlsafe_b64encode(payload.encode("utf-8")).decode("ascii")
+
+
+def decode_cursor(cursor, orderby, order):
+    """
+    Returns the (value, id_zh) of the last row of the previous page
+
+    The cursor is only valid for the sort it was generated with
+    """
+    try:
+        payload = json.loads(base64.urlsafe_b64decode(cursor.encode("ascii")))
+        value = payload["value"]
+        if isinstance(value, dict):
+            ((tag, raw),) = value.items()
+            value = CURSOR_TYPES[tag][1](raw)
+        id_zh = int(payload["id_zh"])
+    except (ValueError, TypeError, KeyError, AttributeError, ArithmeticError):
+        raise BadRequest("Invalid cursor")
+    if payload.get("orderby") != orderby or payload.get("order") != order:
+        raise BadRequest("Cursor does not match the requested sort")
+    return value, id_zh
+
+
+def seek_predicate(col, desc, value, last_id):
+    """
+    Returns the filter selecting the rows after (value, last_id) in the
+    order (col, id_zh), both ascending or both descending.
+
+    Postgres sorts NULL values last in ascending order and first in
+    descending order, so the NULL rows are handled apart from the row value
+    comparison (which is never true with a NULL).
+    """
+    if desc:
+        if value is None:
+            return or_(col.isnot(None), and_(col.is_(None), TZH.id_zh < last_id))
+        return tuple_(col, TZH.id_zh) < tuple_(value, last_id)
+    if value is None:
+        return and_(col.is_(None), TZH.id_zh > last_id)
+    return or_(tuple_(col, TZH.id_zh) > tuple_(value, last_id), col.is_(None))
+
+
+def seek_page(query, orderby, order, cursor, limit):
+    """
+    Keyset pagination of the zh list.
+
+    Args:
+        cursor(str): next_cursor returned with the previous page, empty string
+        for the first page
+
+    Returns the zh (or light rows) of the page and the cursor of the next
+    page (None if this is the last page)
+    """
+    # the light list query selects columns instead of the TZH entity
+    single_entity = len(query.column_descriptions) == 1
+    col = get_sort_column(orderby)
+    if col is None:
+        orderby = None
+        order = "asc"
+    elif isinstance(col.type, Geometry):
+        # a geometry cannot be compared to the value of a cursor
+        raise BadRequest(f"The zh list cannot be paginated with a cursor on {orderby}")
+    desc = order == "desc"
+
+    if cursor:
+        value, last_id = decode_cursor(cursor, orderby, order)
+        if col is None:
+            query = query.filter(TZH.id_zh > last_id)
+        else:
+            query = query.filter(seek_predicate(col, desc, value, last_id))
+
+    if col is None:
+        rows = query.order_by(TZH.id_zh).limit(limit).all()
+        data = rows
+        values = [None] * len(rows)
+    else:
+        rows = (
+            query.add_columns(col.label("sort_value"))
+            .order_by(col.desc() if desc else col, TZH.id_zh.desc() if desc else TZH.id_zh)
+            .limit(limit)
+            .all()
+        )
+        data = [row[0] for row in rows] if single_entity else rows
+        values = [row.sort_value for row in rows]
+
+    next_cursor = None
+    if limit > 0 and len(data) == limit:
+        next_cursor = encode_cursor(orderby, order, values[-1], data[-1].id_zh)
+    return data, next_cursor
@@ -0,0 +1,203 @@
+# Queue of the pdf exports of the zh cards (pr_zh.t_pdf_exports). The API
+# only submits the exports, they are rendered by the pdf_export_worker
+# processes which claim them with SELECT ... FOR UPDATE SKIP LOCKED: the
+# number of processes bounds the number of cards rendered at the same time,
+# out of the workers of the API.
+import multiprocessing
+import sys
+import time
+from datetime import datetime as dt, timedelta
+
+from flask import current_app
+from geonature.utils.env import DB
+from sqlalchemy import func, or_
+from sqlalchemy.dialects.postgresql import insert
+from werkzeug.exceptions import NotFound
+
+from .constants import DONE, FAILED, PENDING, RUNNING
+from .model.zh_schema import TZH, TPdfExports
+from .utils import get_last_pdf_export
+
+# a running export not ended since this delay is claimed again (stopped worker)
+STALE_EXPORT_DELAY = timedelta(minutes=30)
+
+
+def get_export(id_export: int) -> TPdfExports:
+    export = DB.session.query(TPdfExports).get(id_export)
+    if export is None:
+        raise NotFound(f"The pdf export {id_export} does not exist")
+    return export
+
+
+def get_export_status(export: TPdfExports) -> dict:
+    status = {
+        "id_export": export.id_export,
+        "id_zh": export.id_zh,
+        "status": export.status,
+        "id_media": export.id_media,
+        "error": export.error,
+        "create_date": str(export.create_date) if export.create_date else None,
+        "end_date": str(export.end_date) if export.end_date else None,
+    }
+    if export.status == PENDING:
+        # number of exports rendered before this one
+        status["queue_position"] = (
+            DB.session.query(func.count(TPdfExports.id_export))
+            .filter(
+                TPdfExports.status.in_([PENDING, RUNNING]),
+                TPdfExports.id_export < export.id_export,
+            )
+            .scalar()
+        )
+    return status
+
+
+def submit_export(id_zh: int, id_role: int) -> TPdfExports:
+    """
+    Adds an export of the card of a zh to the queue
+
+    The export is done at once if a pdf of the card was exported after the
+    last update of the zh (get_last_pdf_export). Returns the pending or
+    running export of the zh if there is one, whoever submitted it: the
+    exports are shared by the users who can read the zh.
+    """
+    zh = DB.session.query(TZH).filter(TZH.id_zh == id_zh).one()
+    media = get_last_pdf_export(id_zh=id_zh, last_date=zh.update_date)
+    if media is not None:
+        now = dt.now()
+        export = TPdfExports(
+            id_zh=id_zh,
+            id_role=id_role,
+            status=DONE,
+            id_media=media.id_media,
+            start_date=now,
+            end_date=now,
+        )
+        DB.session.add(export)
+        DB.session.commit()
+        return export
+    DB.session.execute(
+        insert(TPdfExports)
+        .values(id_zh=id_zh, id_role=id_role, status=PENDING)
+        .on_conflict_do_nothing(
+            index_elements=[TPdfExports.id_zh],
+            index_where=TPdfExports.status.in_([PENDING, RUNNING]),
+        )
+    )
+    DB.session.commit()
+    return (
+        DB.session.query(TPdfExports)
+        .filter(TPdfExports.id_zh == id_zh)
+        .order_by(TPdfExports.status.in_([PENDING, RUNNING]).desc(), TPdfExports.id_export.desc())
+        .first()
+    )
+
+
+def claim_export():
+    """
+    Claims the oldest pending (or stale) export
+
+    Returns the claimed export, None if there is no export to render
+    """
+    export = (
+        DB.session.query(TPdfExports)
+        .filter(
+            or_(
+                TPdfExports.status == PENDING,
+                (TPdfExports.status == RUNNING)
+                & (TPdfExports.start_date < dt.now() - STALE_EXPORT_DELAY),
+            )
+        )
+        .order_by(TPdfExports.id_export)
+        .with_for_update(skip_locked=True)
+        .first()
+    )
+    if export is None:
+        DB.session.rollback()
+        return None
+    export.status = RUNNING
+    export.start_date = dt.now()
+    DB.session.commit()
+    return export
+
+
+def run_export(export, render) -> TPdfExports:
+    """
+    Renders the pdf of an export with render(id_zh), which stores it as a
+    media of the zh and returns its id_media, unless a pdf was exported
+    after the last update of the zh since the submission
+
+    Returns the ended export
+    """
+    id_export, id_zh = export.id_export, export.id_zh
+    status, error, id_media = DONE, None, None
+    try:
+        zh = DB.session.query(TZH).filter(TZH.id_zh == id_zh).one()
+        media = get_last_pdf_export(id_zh=id_zh, last_date=zh.update_date)
+        id_media = media.id_media if media is not None else render(id_zh)
+    except Exception as e:
+        DB.session.rollback()
+        exc_type, value, tb = sys.exc_info()
+        status, error = FAILED, str(exc_type) + ": " + str(e.with_traceback(tb))
+
+    DB.session.query(TPdfExports).filter(TPdfExports.id_export == id_export).update(
+        {"status": status, "error": error, "id_media": id_media, "end_date": dt.now()},
+        synchronize_session=False,
+    )
+    DB.session.commit()
+    return DB.session.query(TPdfExports).get(id_export)
+
+
+def run_worker(render, once=False, poll=5, report=None):
+    """
+    Renders the exports of the queue, one at a time, until it is empty
+    (once) or forever
+
+    Args:
+        render(callable): renders and stores the pdf of a zh, returns its id_media
+        once(bool): stops when there is no export left
+        poll(int): seconds between two reads of an empty queue
+        report(callable): called with each ended export
+
+    Returns the number of rendered exports
+    """
+    nb_exports = 0
+    while True:
+        export = claim_export()
+        if export is not None:
+            export = run_export(export, render)
+            nb_exports += 1
+            if report is not None:
+                report(export)
+            continue
+        if once:
+            return nb_exports
+        time.sleep(poll)
+
+
+def _run_worker_in_app(app, kwargs):
+    with app.app_context():
+        # the connections of the parent process are not shared
+        DB.engine.dispose()
+        run_worker(**kwargs)
+
+
+def run_workers(processes=1, **kwargs):
+    """
+    Runs run_worker in several processes: at most `processes` pdf are
+    rendered at the same time
+    """
+    if processes <= 1:
+        run_worker(**kwargs)
+        return
+    app = current_app._get_current_object()
+    DB.session.remove()
+    DB.engine.dispose()
+    context = multiprocessing.get_context("fork")
+    workers = [
+        context.Process(target=_run_worker_in_app, args=(app, kwargs)) for _ in range(processes)
+    ]
+    for worker in workers:
+        worker.start()
+    for worker in workers:
+        worker.join()
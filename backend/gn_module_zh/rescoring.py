@@ -0,0 +1,345 @@
+# Queue of the computations of the hierarchy notes after a change of the
+# rules of a river basin (pr_zh.t_rescoring_jobs, filled by the triggers on
+# cor_rb_rules, t_items and the shared rules tables). A job is split in
+# batches of zh (pr_zh.t_rescoring_batches) claimed by the workers with
+# SELECT ... FOR UPDATE SKIP LOCKED: several workers can run in parallel
+# with no other broker than PostgreSQL. The batches stage the notes they
+# compute (pr_zh.t_rescoring_notes), which replace the notes of the river
+# basin in the transaction ending the job: until then the search, the
+# ranking and the cards read the notes of the former rules.
+import multiprocessing
+import sys
+import time
+from datetime import datetime as dt, timedelta
+
+from flask import current_app
+from geonature.utils.env import DB
+from sqlalchemy import func, or_
+from sqlalchemy.orm import aliased
+
+from .cache import NOTES_DATA, bump_version, reset_versions
+from .constants import DONE, FAILED, PENDING, RUNNING
+from .geometry import get_main_rbs
+from .model.zh_schema import TZH, TRescoringBatches, TRescoringJobs
+from .scoring import CHUNK_SIZE, _chunks, drop_staged_notes, stage_notes
+
+# a running batch not updated since this delay is claimed again (stopped worker)
+STALE_BATCH_DELAY = timedelta(minutes=30)
+# number of times a batch is computed before its job fails
+MAX_BATCH_ATTEMPTS = 3
+
+
+def get_rescoring_jobs():
+    """
+    Returns the jobs not done, then the last done job of each river basin
+    """
+    last_done = (
+        DB.session.query(TRescoringJobs.id_rb, func.max(TRescoringJobs.id_job).label("id_job"))
+        .filter(TRescoringJobs.status == DONE)
+        .group_by(TRescoringJobs.id_rb)
+        .subquery()
+    )
+    return (
+        DB.session.query(TRescoringJobs)
+        .filter(
+            or_(
+                TRescoringJobs.status != DONE,
+                TRescoringJobs.id_job.in_(DB.session.query(last_done.c.id_job)),
+            )
+        )
+        .order_by(TRescoringJobs.status == DONE, TRescoringJobs.id_job)
+        .all()
+    )
+
+
+def publish_notes_summary(id_rb: int):
+    """
+    Refreshes the maximum notes of a river basin (pr_zh.rb_notes_summary) and
+    the final notes of its zh, which depend on them, with its stored notes
+    """
+    DB.session.execute("SELECT pr_zh.refresh_rb_notes_summary(:id_rb)", {"id_rb": id_rb})
+    DB.session.execute(
+        """
+        SELECT pr_zh.refresh_zh_score_summary(
+            ARRAY(SELECT id_zh FROM pr_zh.t_zh_score_summary WHERE id_rb = :id_rb)
+        )
+        """,
+        {"id_rb": id_rb},
+    )
+    bump_version(NOTES_DATA)
+
+
+def publish_notes(id_job: int, id_rb: int) -> int:
+    """
+    Replaces the notes of the zh of a river basin with the notes staged by
+    its rescoring job and refreshes its maximum and final notes, in the
+    transaction which ends the job (the caller commits). The zh added to the
+    river basin since the job was planned are computed first.
+
+    Nothing is published if a newer job of the river basin exists (its rules
+    changed again): the newer job publishes the notes. The staged notes are
+    deleted.
+
+    Returns the number of zh which could not be scored
+    """
+    failed = []
+    newer = (
+        DB.session.query(TRescoringJobs.id_job)
+        .filter(TRescoringJobs.id_rb == id_rb, TRescoringJobs.id_job > id_job)
+        .exists()
+    )
+    if not DB.session.query(newer).scalar():
+        id_zh_list = sorted(get_main_rbs(id_rb=id_rb))
+        computed = {
+            row[0]
+            for row in DB.session.execute(
+                """
+                SELECT unnest(id_zh_list) FROM pr_zh.t_rescoring_batches WHERE id_job = :id_job
+                UNION
+                SELECT id_zh FROM pr_zh.t_rescoring_notes WHERE id_job = :id_job
+                """,
+                {"id_job": id_job},
+            )
+        }
+        missing = [id_zh for id_zh in id_zh_list if id_zh not in computed]
+        if missing:
+            failed = stage_notes(id_job, id_rb, missing)
+        params = {"id_job": id_job, "id_zh_list": id_zh_list}
+        DB.session.execute(
+            """
+            DELETE FROM pr_zh.cor_zh_notes notes
+            WHERE notes.id_zh = ANY(CAST(:id_zh_list AS integer[]))
+            AND NOT EXISTS (
+                SELECT 1 FROM pr_zh.t_rescoring_notes staged
+                WHERE staged.id_job = :id_job
+                AND staged.id_zh = notes.id_zh
+                AND staged.cor_rule_id = notes.cor_rule_id
+            )
+            """,
+            params,
+        )
+        # the unchanged notes are not rewritten
+        DB.session.execute(
+            """
+            INSERT INTO pr_zh.cor_zh_notes (id_zh, cor_rule_id, note, attribute_id, note_type_id)
+            SELECT id_zh, cor_rule_id, note, attribute_id, note_type_id
+            FROM pr_zh.t_rescoring_notes
+            WHERE id_job = :id_job AND id_zh = ANY(CAST(:id_zh_list AS integer[]))
+            ON CONFLICT (id_zh, cor_rule_id) DO UPDATE SET
+                note = EXCLUDED.note,
+                attribute_id = EXCLUDED.attribute_id,
+                note_type_id = EXCLUDED.note_type_id
+            WHERE (cor_zh_notes.note, cor_zh_notes.attribute_id, cor_zh_notes.note_type_id)
+                IS DISTINCT FROM (EXCLUDED.note, EXCLUDED.attribute_id, EXCLUDED.note_type_id)
+            """,
+            params,
+        )
+        publish_notes_summary(id_rb)
+    drop_staged_notes(id_job)
+    return len(failed)
+
+
+def plan_job(batch_size=CHUNK_SIZE):
+    """
+    Splits the oldest pending job in batches of zh, the job of a river basin
+    whose previous job is running waits for its end
+
+    Returns the planned job, None if there is no pending job
+    """
+    running = aliased(TRescoringJobs)
+    job = (
+        DB.session.query(TRescoringJobs)
+        .filter(
+            TRescoringJobs.status == PENDING,
+            ~DB.session.query(running.id_job)
+            .filter(running.id_rb == TRescoringJobs.id_rb, running.status == RUNNING)
+            .exists(),
+        )
+        .order_by(TRescoringJobs.id_job)
+        .with_for_update(skip_locked=True)
+        .first()
+    )
+    if job is None:
+        DB.session.rollback()
+        return None
+    id_zh_list = sorted(get_main_rbs(id_rb=job.id_rb))
+    for chunk in _chunks(id_zh_list, batch_size):
+        DB.session.add(TRescoringBatches(id_job=job.id_job, id_zh_list=chunk, status=PENDING))
+    job.nb_zh = len(id_zh_list)
+    job.start_date = dt.now()
+    job.status = RUNNING if id_zh_list else DONE
+    if not id_zh_list:
+        job.end_date = job.start_date
+        # the zh added to the river basin meanwhile are computed
+        job.nb_errors = publish_notes(job.id_job, job.id_rb)
+    DB.session.commit()
+    return job
+
+
+def claim_batch():
+    """
+    Claims the oldest pending, stale or failed (less than MAX_BATCH_ATTEMPTS
+    times) batch of a running job
+
+    Returns the claimed batch, None if there is no batch to compute
+    """
+    batch = (
+        DB.session.query(TRescoringBatches)
+        .join(TRescoringJobs, TRescoringJobs.id_job == TRescoringBatches.id_job)
+        .filter(
+            TRescoringJobs.status == RUNNING,
+            or_(
+                TRescoringBatches.status == PENDING,
+                (TRescoringBatches.status == RUNNING)
+                & (TRescoringBatches.update_date < dt.now() - STALE_BATCH_DELAY),
+                (TRescoringBatches.status == FAILED)
+                & (TRescoringBatches.attempts < MAX_BATCH_ATTEMPTS),
+            ),
+        )
+        .order_by(TRescoringBatches.id_batch)
+        .with_for_update(of=TRescoringBatches, skip_locked=True)
+        .first()
+    )
+    if batch is None:
+        DB.session.rollback()
+        return None
+    batch.status = RUNNING
+    batch.attempts += 1
+    batch.update_date = dt.now()
+    DB.session.commit()
+    return batch
+
+
+def run_batch(batch) -> TRescoringJobs:
+    """
+    Computes and stages the notes of the zh of a batch, and the progress of
+    its job, in one transaction. The zh which cannot be scored have no
+    staged notes: their notes are deleted when the job publishes its notes.
+
+    A batch which raises an error is rolled back and claimed again, its job
+    fails after MAX_BATCH_ATTEMPTS attempts (its staged notes are deleted and
+    never published). The job is done once all its batches are done: the
+    last batch publishes the notes of the job.
+
+    Returns the job of the batch
+    """
+    id_batch, id_job, id_zh_list = batch.id_batch, batch.id_job, list(batch.id_zh_list)
+    attempts = batch.attempts
+    status, error = DONE, None
+    failed = []
+    try:
+        reset_versions()
+        # the zh are locked until their notes are staged: the notes staged
+        # by a zh form saved meanwhile (rescore_zh) are not overwritten
+        DB.session.query(TZH.id_zh).filter(TZH.id_zh.in_(id_zh_list)).with_for_update(
+            read=True
+        ).all()
+        id_rb = (
+            DB.session.query(TRescoringJobs.id_rb).filter(TRescoringJobs.id_job == id_job).scalar()
+        )
+        failed = stage_notes(id_job, id_rb, id_zh_list)
+    except Exception as e:
+        DB.session.rollback()
+        exc_type, value, tb = sys.exc_info()
+        status, error = FAILED, str(exc_type) + ": " + str(e.with_traceback(tb))
+
+    DB.session.query(TRescoringBatches).filter(TRescoringBatches.id_batch == id_batch).update(
+        {"status": status, "error": error, "update_date": dt.now()}, synchronize_session=False
+    )
+    # the job row is locked by these updates: the batches of a job are ended
+    # one at a time, and after the zh forms saved in a transaction staging
+    # their notes in the job (rescore_zh)
+    jobs = DB.session.query(TRescoringJobs).filter(TRescoringJobs.id_job == id_job)
+    if status == DONE:
+        jobs.update(
+            {
+                "nb_done": TRescoringJobs.nb_done + len(id_zh_list),
+                "nb_errors": TRescoringJobs.nb_errors + len(failed),
+            },
+            synchronize_session=False,
+        )
+        remaining = (
+            DB.session.query(TRescoringBatches.id_batch)
+            .filter(TRescoringBatches.id_job == id_job, TRescoringBatches.status != DONE)
+            .exists()
+        )
+        if jobs.filter(TRescoringJobs.status == RUNNING, ~remaining).update(
+            {"status": DONE, "end_date": dt.now()}, synchronize_session=False
+        ):
+            jobs.update(
+                {"nb_errors": TRescoringJobs.nb_errors + publish_notes(id_job, id_rb)},
+                synchronize_session=False,
+            )
+    elif attempts >= MAX_BATCH_ATTEMPTS:
+        # its other batches are not claimed any more
+        jobs.update({"status": FAILED, "end_date": dt.now()}, synchronize_session=False)
+    if jobs.filter(TRescoringJobs.status == FAILED).count():
+        # including the notes staged by the batches which were running when
+        # the job failed
+        drop_staged_notes(id_job)
+    DB.session.commit()
+    return jobs.one()
+
+
+def run_worker(once=False, poll=10, batch_size=CHUNK_SIZE, report=None):
+    """
+    Computes the batches of the queue until it is empty (once) or forever
+
+    Args:
+        once(bool): stops when there is no job left
+        poll(int): seconds between two reads of an empty queue
+        batch_size(int): number of zh per batch of the planned jobs
+        report(callable): called with the job after each batch
+
+    Returns the number of computed batches
+    """
+    nb_batches = 0
+    while True:
+        batch = claim_batch()
+        if batch is not None:
+            job = run_batch(batch)
+            nb_batches += 1
+            if report is not None:
+                report(job)
+            continue
+        if plan_job(batch_size) is not None:
+            continue
+        if once:
+            return nb_batches
+        time.sleep(poll)
+
+
+def _run_worker_in_app(app, kwargs):
+    with app.app_context():
+        # the connections of the parent process are not shared
+        DB.engine.dispose()
+        run_worker(**kwargs)
+
+
+def run_workers(processes=1, **kwargs):
+    """
+    Runs run_worker in several processes, the batches are shared between the
+    processes by the queue
+    """
+    if processes <= 1:
+        run_worker(**kwargs)
+        return
+    app = current_app._get_current_object()
+    DB.session.remove()
+    DB.engine.dispose()
+    context = multiprocessing.get_context("fork")
+    workers = [
+        context.Process(target=_run_worker_in_app, args=(app, kwargs)) for _ in range(processes)
+    ]
+    for worker in workers:
+        worker.start()
+    for worker in workers:
+        worker.join()
+
+
+def enqueue_rescoring(id_rb: int):
+    """
+    Adds a job for a river basin (one pending job at most per river basin)
+    """
+    DB.session.execute("SELECT pr_zh.enqueue_rescoring(:id_rb)", {"id_rb": id_rb})
+    DB.session.commit()
@@ -0,0 +1,610 @@
+import sys
+from collections import defaultdict
+
+from geonature.utils.env import DB
+from pypnnomenclature.models import BibNomenclaturesTypes, TNomenclatures
+from sqlalchemy import or_, select
+from sqlalchemy.dialects.postgresql import insert
+from sqlalchemy.orm import aliased
+from werkzeug.exceptions import NotFound
+
+from .api_error import ZHApiError
+from .cache import (
+    NOTES_DATA,
+    RULES_DATA,
+    bump_version,
+    get_river_basin_name,
+    get_version,
+    rules_cache,
+)
+from .constants import DONE, RUNNING
+from .geometry import get_main_rbs
+from .model.hierarchy import (
+    FrozenDict,
+    Rule,
+    RuleModel,
+    RuleReferential,
+    ZhFunction,
+    ZhSnapshot,
+)
+from .model.zh_schema import (
+    TZH,
+    BibHierCategories,
+    BibHierSubcategories,
+    BibNoteTypes,
+    CorItemValue,
+    CorProtectionLevelType,
+    CorRbRules,
+    CorRuleNomenc,
+    CorZhNotes,
+    CorZhProtection,
+    TCorQualif,
+    TFunctions,
+    TItems,
+    TManagementPlans,
+    TManagementStructures,
+    TRescoringJobs,
+    TRescoringNotes,
+    TRules,
+)
+from .scoring_kernel import score_item, score_zh
+
+# number of zh loaded (and notes written) per query
+CHUNK_SIZE = 500
+
+# nomenclature types used to qualify the zh
+NOMENCLATURE_TYPES = ("HIERARCHY", "FONCTIONS_QUALIF", "FONCTIONS_CONNAISSANCE", "PLAN_GESTION")
+
+
+def _chunks(values, size=CHUNK_SIZE):
+    values = list(values)
+    for i in range(0, len(values), size):
+        yield values[i : i + size]
+
+
+def _load_referential() -> RuleReferential:
+    nomenclatures = (
+        DB.session.query(
+            TNomenclatures.id_nomenclature,
+            TNomenclatures.cd_nomenclature,
+            TNomenclatures.mnemonique,
+            TNomenclatures.label_default,
+            BibNomenclaturesTypes.mnemonique.label("type"),
+        )
+        .join(BibNomenclaturesTypes, BibNomenclaturesTypes.id_type == TNomenclatures.id_type)
+        .filter(
+            or_(
+                BibNomenclaturesTypes.mnemonique.in_(NOMENCLATURE_TYPES),
+                TNomenclatures.mnemonique == "Naturaliste",
+                TNomenclatures.id_nomenclature.in_(select([TItems.attribute_id])),
+            )
+        )
+        .order_by(TNomenclatures.id_nomenclature)
+        .all()
+    )
+    by_type = defaultdict(dict)
+    for nomenc in nomenclatures:
+        by_type[nomenc.type][nomenc.cd_nomenclature] = nomenc.id_nomenclature
+
+    knowledge_notes = defaultdict(tuple)
+    knowledge_labels = {}
+    for note_type in (
+        DB.session.query(
+            BibNoteTypes.note_id, BibNoteTypes.id_knowledge, TNomenclatures.mnemonique
+        )
+        .outerjoin(TNomenclatures, TNomenclatures.id_nomenclature == BibNoteTypes.id_knowledge)
+        .all()
+    ):
+        knowledge_notes[note_type.id_knowledge] += (note_type.note_id,)
+        knowledge_labels[note_type.note_id] = note_type.mnemonique
+
+    return RuleReferential(
+        hierarchy=FrozenDict(by_type["HIERARCHY"]),
+        functions_qualif=tuple(
+            (nomenc.mnemonique, nomenc.id_nomenclature)
+            for nomenc in nomenclatures
+            if nomenc.type == "FONCTIONS_QUALIF"
+        ),
+        high_knowledge_id=by_type["FONCTIONS_CONNAISSANCE"].get("1"),
+        management_plan_id=by_type["PLAN_GESTION"].get("5"),
+        naturalist_ids=frozenset(
+            nomenc.id_nomenclature
+            for nomenc in nomenclatures
+            if nomenc.mnemonique == "Naturaliste"
+        ),
+        labels=FrozenDict(
+            {
+                nomenc.id_nomenclature: (nomenc.label_default, nomenc.mnemonique)
+                for nomenc in nomenclatures
+            }
+        ),
+        categories=FrozenDict(
+            DB.session.query(BibHierCategories.abbreviation, BibHierCategories.label).all()
+        ),
+        item_values=FrozenDict(
+            {
+                value.attribute_id: (value.val_min, value.val_max)
+                for value in DB.session.query(CorItemValue).all()
+            }
+        ),
+        combinations=FrozenDict(
+            DB.session.query(TCorQualif.combination, TCorQualif.id_qualification).all()
+        ),
+        knowledge_notes=FrozenDict(knowledge_notes),
+        knowledge_labels=FrozenDict(knowledge_labels),
+    )
+
+
+def get_referential() -> RuleReferential:
+    """
+    Nomenclatures and correspondences of the hierarchy rules, loaded once per
+    version of the rules
+    """
+    return rules_cache.get_or_load(
+        "hierarchy_referential", get_version(RULES_DATA), _load_referential
+    )
+
+
+def _load_denominators(rb_id: int) -> dict:
+    """
+    Maximum notes of the current rules of a river basin (pr_zh.v_rb_notes_summary
+    view): the pr_zh.rb_notes_summary table holds the ones of the stored
+    notes, refreshed at the end of the rescoring jobs
+    """
+    row = DB.session.execute(
+        "SELECT * FROM pr_zh.v_rb_notes_summary WHERE id_rb = :id_rb", {"id_rb": rb_id}
+    ).first()
+    if row is None:
+        raise ZHApiError(
+            message="no_rb_rules",
+            details="no maximum notes for the rules of the river basin",
+        )
+    return dict(row)
+
+
+def _load_rule_model(rb_id: int, version: int) -> RuleModel:
+    items = defaultdict(tuple)
+    cor_rules = {}
+    for row in (
+        DB.session.query(
+            CorRbRules.rule_id,
+            CorRbRules.cor_rule_id,
+            TItems.attribute_id,
+            TItems.note,
+            TItems.note_type_id,
+        )
+        .outerjoin(TItems, TItems.cor_rule_id == CorRbRules.cor_rule_id)
+        .filter(CorRbRules.rb_id == rb_id)
+        .order_by(TItems.val_id)
+        .all()
+    ):
+        cor_rules[row.rule_id] = row.cor_rule_id
+        if row.attribute_id is not None:
+            items[row.rule_id] += ((row.attribute_id, row.note, row.note_type_id),)
+    if not cor_rules:
+        raise ZHApiError(
+            message="no_rb_rules",
+            details="no existing rules for the river basin",
+        )
+
+    nomencs = defaultdict(tuple)
+    for cor in DB.session.query(CorRuleNomenc).all():
+        nomencs[cor.rule_id] += ((cor.nomenc_id, cor.qualif_id),)
+
+    rules = {}
+    subcategory = aliased(BibHierSubcategories)
+    for rule in (
+        DB.session.query(TRules, BibHierCategories.label, subcategory.label.label("subcat"))
+        .join(BibHierCategories, BibHierCategories.cat_id == TRules.cat_id)
+        .outerjoin(subcategory, subcategory.subcat_id == TRules.subcat_id)
+        .all()
+    ):
+        rule_id = rule.TRules.rule_id
+        rules[rule.TRules.abbreviation] = Rule(
+            abb=rule.TRules.abbreviation,
+            rule_id=rule_id,
+            name=(rule.subcat or rule.label).capitalize(),
+            cor_rule_id=cor_rules.get(rule_id),
+            items=items[rule_id],
+            nomencs=nomencs[rule_id],
+        )
+
+    return RuleModel(
+        rb_id=rb_id,
+        name=get_river_basin_name(rb_id),
+        version=version,
+        rules=FrozenDict(rules),
+        denominators=FrozenDict(_load_denominators(rb_id)),
+        referential=get_referential(),
+    )
+
+
+def get_rule_model(rb_id: int) -> RuleModel:
+    """
+    Hierarchy rules of a river basin, loaded once per version of the rules
+    (pr_zh.t_cache_versions 'rules', bumped by the triggers on the rule tables)
+    """
+    version = get_version(RULES_DATA)
+    return rules_cache.get_or_load(
+        f"rule_model_{rb_id}", version, lambda: _load_rule_model(rb_id, version)
+    )
+
+
+def load_zh_data(id_zh_list: list) -> dict:
+    """
+    Loads the snapshots (data used by the hierarchy rules) of several zh,
+    by id_zh, one query per table
+    """
+    diag_hydro = aliased(TNomenclatures)
+    diag_bio = aliased(TNomenclatures)
+    data = {}
+    for row in (
+        DB.session.query(
+            TZH.id_zh,
+            TZH.id_sdage,
+            TZH.id_thread,
+            TZH.nb_hab,
+            TZH.nb_flora_sp,
+            TZH.nb_vertebrate_sp,
+            TZH.nb_invertebrate_sp,
+            TZH.is_carto_hab,
+            TZH.is_other_inventory,
+            diag_hydro.cd_nomenclature.label("diag_hydro_cd"),
+            diag_bio.cd_nomenclature.label("diag_bio_cd"),
+        )
+        .outerjoin(diag_hydro, diag_hydro.id_nomenclature == TZH.id_diag_hydro)
+        .outerjoin(diag_bio, diag_bio.id_nomenclature == TZH.id_diag_bio)
+        .filter(TZH.id_zh.in_(id_zh_list))
+        .all()
+    ):
+        data[row.id_zh] = row._asdict()
+    functions = defaultdict(list)
+    statuses = defaultdict(list)
+    plans = defaultdict(list)
+
+    for function in (
+        DB.session.query(
+            TFunctions.id_zh,
+            TFunctions.id_function,
+            TFunctions.id_qualification,
+            TFunctions.id_knowledge,
+        )
+        .filter(TFunctions.id_zh.in_(id_zh_list))
+        .all()
+    ):
+        functions[function.id_zh].append(
+            ZhFunction(
+                id_function=function.id_function,
+                id_qualification=function.id_qualification,
+                id_knowledge=function.id_knowledge,
+            )
+        )
+
+    for protection in (
+        DB.session.query(CorZhProtection.id_zh, CorProtectionLevelType.id_protection_status)
+        .join(
+            CorProtectionLevelType,
+            CorZhProtection.id_protection == CorProtectionLevelType.id_protection,
+        )
+        .filter(CorZhProtection.id_zh.in_(id_zh_list))
+        .all()
+    ):
+        statuses[protection.id_zh].append(protection.id_protection_status)
+
+    for plan in (
+        DB.session.query(TManagementStructures.id_zh, TManagementPlans.id_nature)
+        .join(
+            TManagementPlans,
+            TManagementPlans.id_structure == TManagementStructures.id_structure,
+        )
+        .filter(TManagementStructures.id_zh.in_(id_zh_list))
+        .all()
+    ):
+        plans[plan.id_zh].append(plan.id_nature)
+
+    return {
+        id_zh: ZhSnapshot(
+            **values,
+            functions=tuple(functions[id_zh]),
+            statuses=tuple(statuses[id_zh]),
+            plans=tuple(plans[id_zh]),
+        )
+        for id_zh, values in data.items()
+    }
+
+
+def load_zh_snapshot(id_zh: int) -> ZhSnapshot:
+    try:
+        return load_zh_data([id_zh])[id_zh]
+    except KeyError:
+        raise NotFound("The ZH does not exist")
+
+
+def write_notes(rows: list):
+    """
+    Upserts cor_zh_notes rows in bulk, the unchanged notes are not rewritten
+    """
+    table = CorZhNotes.__table__
+    for chunk in _chunks(rows):
+        statement = insert(table).values(chunk)
+        statement = statement.on_conflict_do_update(
+            index_elements=[table.c.id_zh, table.c.cor_rule_id],
+            set_={
+                "note": statement.excluded.note,
+                "attribute_id": statement.excluded.attribute_id,
+                "note_type_id": statement.excluded.note_type_id,
+            },
+            where=or_(
+                table.c.note.is_distinct_from(statement.excluded.note),
+                table.c.attribute_id.is_distinct_from(statement.excluded.attribute_id),
+                table.c.note_type_id.is_distinct_from(statement.excluded.note_type_id),
+            ),
+        )
+        DB.session.execute(statement)
+
+
+def load_notes(id_zh_list) -> dict:
+    """
+    Returns the stored notes (note, attribute_id, note_type_id) of several zh,
+    by (id_zh, cor_rule_id)
+    """
+    stored = {}
+    for chunk in _chunks(set(id_zh_list)):
+        for note in (
+            DB.session.query(
+                CorZhNotes.id_zh,
+                CorZhNotes.cor_rule_id,
+                CorZhNotes.note,
+                CorZhNotes.attribute_id,
+                CorZhNotes.note_type_id,
+            )
+            .filter(CorZhNotes.id_zh.in_(chunk))
+            .all()
+        ):
+            stored[(note.id_zh, note.cor_rule_id)] = (
+                note.note,
+                note.attribute_id,
+                note.note_type_id,
+            )
+    return stored
+
+
+def get_changed_notes(rows: list) -> list:
+    """
+    Returns the cor_zh_notes rows that differ from the stored notes
+    """
+    stored = load_notes(row["id_zh"] for row in rows)
+    return [
+        row
+        for row in rows
+        if stored.get((row["id_zh"], row["cor_rule_id"]))
+        != (row["note"], row["attribute_id"], row["note_type_id"])
+    ]
+
+
+def save_notes(rows: list) -> int:
+    """
+    Writes the notes of a scoring run that changed, nothing is written (and
+    the statement-level cache triggers are not fired) if no note changed.
+    The caller commits.
+
+    Returns the number of written notes
+    """
+    try:
+        changed = get_changed_notes(rows)
+        if changed:
+            write_notes(changed)
+        return len(changed)
+    except Exception as e:
+        if e.__class__.__name__ == "DataError":
+            raise ZHApiError(
+                message="post_note_db_error",
+                details=str(e.orig.diag.sqlstate + ": " + e.orig.diag.message_primary),
+                status_code=400,
+            )
+        exc_type, value, tb = sys.exc_info()
+        raise ZHApiError(
+            message="post_note_error", details=str(exc_type) + ": " + str(e.with_traceback(tb))
+        )
+
+
+def delete_notes(id_zh: int, cor_rule_ids) -> int:
+    """
+    Deletes the stored notes of a zh for the given cor_rule_ids, the caller
+    commits
+
+    Returns the number of deleted notes
+    """
+    if not cor_rule_ids:
+        return 0
+    return (
+        DB.session.query(CorZhNotes)
+        .filter(CorZhNotes.id_zh == id_zh, CorZhNotes.cor_rule_id.in_(list(cor_rule_ids)))
+        .delete(synchronize_session=False)
+    )
+
+
+def get_unpublished_job(id_rb: int, lock=False):
+    """
+    Returns the last rescoring job of a river basin if its notes are not
+    published (job not done), None otherwise: the stored notes of its zh are
+    then the notes of the former rules until the job publishes its notes
+
+    Args:
+        lock(bool): locks the job (FOR SHARE) until the end of the
+            transaction, its notes cannot be published meanwhile
+    """
+    query = (
+        DB.session.query(TRescoringJobs)
+        .filter(TRescoringJobs.id_rb == id_rb)
+        .order_by(TRescoringJobs.id_job.desc())
+    )
+    if lock:
+        query = query.with_for_update(read=True).populate_existing()
+    job = query.first()
+    if job is None or job.status == DONE:
+        return None
+    return job
+
+
+def stage_notes(id_job: int, id_rb: int, id_zh_list: list) -> list:
+    """
+    Computes the notes of several zh of a river basin with its current rules
+    and stages them in pr_zh.t_rescoring_notes (the caller commits): they
+    replace the notes of cor_zh_notes when the job publishes its notes. The
+    previously staged notes of the zh are replaced.
+
+    Returns the ids of the zh which cannot be scored (no staged notes)
+    """
+    try:
+        model = get_rule_model(id_rb)
+    except ZHApiError:
+        # no rules left in the river basin
+        model = None
+    rows = []
+    failed = []
+    if model is None:
+        failed = list(id_zh_list)
+    else:
+        for id_zh, zh in load_zh_data(id_zh_list).items():
+            try:
+                rows += score_zh(zh, model)[1]
+            except ZHApiError:
+                failed.append(id_zh)
+    for chunk in _chunks(id_zh_list):
+        DB.session.query(TRescoringNotes).filter(
+            TRescoringNotes.id_job == id_job, TRescoringNotes.id_zh.in_(chunk)
+        ).delete(synchronize_session=False)
+    for chunk in _chunks(rows):
+        DB.session.execute(
+            insert(TRescoringNotes.__table__).values([dict(row, id_job=id_job) for row in chunk])
+        )
+    return failed
+
+
+def drop_staged_notes(id_job: int) -> int:
+    """
+    Deletes the notes staged by a rescoring job, the caller commits
+    """
+    return (
+        DB.session.query(TRescoringNotes)
+        .filter(TRescoringNotes.id_job == id_job)
+        .delete(synchronize_session=False)
+    )
+
+
+def rescore_zh(id_zh: int, abbs=None) -> int:
+    """
+    Computes again the notes of some hierarchy rules of a zh and writes the
+    changed ones in the current transaction (the caller commits). Used when a
+    tab of the zh forms is saved, the hierarchy view then only reads the
+    stored notes.
+
+    Args:
+        id_zh(int): id of the zh
+        abbs(set): abbreviations of the rules to compute, all the rules of the
+            main river basin of the zh if None (the notes of the rules of
+            other river basins are deleted)
+
+    The notes of the rules which cannot be computed (zh outside any river
+    basin, qualification not defined in the rules...) are deleted: the
+    hierarchy view computes them again and returns the error.
+
+    While the notes of the river basin are computed again (rescoring job not
+    done), the notes of the former rules are kept: the notes of all the
+    rules are staged for a running job, nothing is written for a pending or
+    failed job, whose batches compute the zh.
+
+    Returns the number of written notes (none while the river basin is
+    computed again)
+    """
+    if abbs is not None and not abbs:
+        return 0
+    stored = {cor_rule_id for (_, cor_rule_id) in load_notes([id_zh]).keys()}
+    main_rb = get_main_rbs(id_zh_list=[id_zh]).get(id_zh)
+    if main_rb is None:
+        return delete_notes(id_zh, stored)
+    job = get_unpublished_job(main_rb, lock=True)
+    if job is not None:
+        if job.status != RUNNING:
+            return 0
+        stage_notes(job.id_job, main_rb, [id_zh])
+        return 0
+    try:
+        model = get_rule_model(main_rb)
+    except ZHApiError:
+        return delete_notes(id_zh, stored)
+
+    zh = load_zh_snapshot(id_zh)
+    rows = []
+    failed = set()
+    for rule in model.rules.values():
+        if not rule.active or (abbs is not None and rule.abb not in abbs):
+            continue
+        try:
+            rows.append(score_item(rule, zh, model.referential)[1][1])
+        except ZHApiError:
+            failed.add(rule.cor_rule_id)
+    if abbs is None:
+        active = {rule.cor_rule_id for rule in model.rules.values() if rule.active}
+        failed |= stored - active
+    return delete_notes(id_zh, failed & stored) + save_notes(rows)
+
+
+def score_hierarchies(id_zh_list=None, id_rb=None, persist=True):
+    """
+    Computes the hierarchy of several zh with a few set-based queries
+
+    Args:
+        id_zh_list(list): ids of the zh to score
+        id_rb(int): scores all the zh whose main river basin is id_rb
+        persist(bool): writes the changed notes in cor_zh_notes (in one
+            transaction), except for the river basins being computed again
+            by a rescoring job
+
+    Returns the hierarchies (same structure as Hierarchy.as_dict) and the
+    errors of the zh that could not be scored, by id_zh
+    """
+    try:
+        main_rbs = get_main_rbs(id_zh_list=id_zh_list, id_rb=id_rb)
+        errors = {}
+        for id_zh in set(id_zh_list or []) - set(main_rbs):
+            errors[id_zh] = {"message": "The ZH is not in a river basin", "details": None}
+
+        zh_by_rb = defaultdict(list)
+        for id_zh, zh_rb in main_rbs.items():
+            zh_by_rb[zh_rb].append(id_zh)
+
+        hierarchies = {}
+        nb_changed = 0
+        for zh_rb, id_zhs in zh_by_rb.items():
+            try:
+                model = get_rule_model(zh_rb)
+            except ZHApiError as e:
+                for id_zh in id_zhs:
+                    errors[id_zh] = {"message": e.message, "details": e.details}
+                continue
+            for chunk in _chunks(sorted(id_zhs)):
+                rows = []
+                for id_zh, zh in load_zh_data(chunk).items():
+                    try:
+                        hierarchies[id_zh], zh_rows = score_zh(zh, model)
+                    except ZHApiError as e:
+                        errors[id_zh] = {"message": e.message, "details": e.details}
+                        continue
+                    rows += zh_rows
+                if persist and get_unpublished_job(zh_rb) is None:
+                    nb_changed += save_notes(rows)
+        if nb_changed:
+            bump_version(NOTES_DATA)
+            DB.session.commit()
+        return hierarchies, errors
+    except Exception as e:
+        DB.session.rollback()
+        if e.__class__.__name__ == "ZHApiError":
+            raise ZHApiError(message=str(e.message), details=str(e.details))
+        exc_type, value, tb = sys.exc_info()
+        raise ZHApiError(
+            message="score_hierarchies_error",
+            details=str(exc_type) + ": " + str(e.with_traceback(tb)),
+        )
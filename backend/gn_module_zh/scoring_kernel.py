@@ -0,0 +1,313 @@
+# Scoring kernel of the hierarchy: pure functions computing the notes of a
+# zh from its snapshot (ZhSnapshot) and the rules of its river basin
+# (RuleModel), without any database access. Used by the hierarchy view and
+# the batch scoring.
+from .api_error import ZHApiError
+from .constants import HIERARCHY_DEPENDENCIES, HIERARCHY_LAYOUT
+from .model.hierarchy import RuleModel, ZhSnapshot
+
+# t_zh columns of the rules qualified with the zh value
+VALUE_COLUMNS = {
+    "sdage": "id_sdage",
+    "hab": "nb_hab",
+    "flore": "nb_flora_sp",
+    "vertebrates": "nb_vertebrate_sp",
+    "invertebrates": "nb_invertebrate_sp",
+    "hydro": "diag_hydro_cd",
+    "bio": "diag_bio_cd",
+    "thread": "id_thread",
+}
+
+HERITAGE_RULES = ("hab", "flore", "vertebrates", "invertebrates")
+
+FUNCTION_RULES = ("protection", "epuration", "support", "pedagogy", "production")
+
+# position of each function qualification in the t_cor_qualif combinations
+COMBINATION_POSITIONS = {"Non évaluée": 0, "Nulle à faible": 1, "Moyenne": 2, "Forte": 3}
+
+# HIERARCHY cd_nomenclature of the functional state of the zh by diagnostic cd
+FCT_STATE_QUALIFS = {"0": "NE", "1": "bon", "2": "moyen", "3": "mauvais"}
+
+
+def get_str_note(note, denominator):
+    if (note is None) or (denominator is None):
+        return None
+    return str(note) + "/" + str(denominator)
+
+
+def _get_selected_functions(rule, zh):
+    nomenc_ids = rule.get_nomencs()
+    return [function for function in zh.functions if function.id_function in nomenc_ids]
+
+
+def _get_combination(rule, zh, referential):
+    selected_ids = [function.id_qualification for function in _get_selected_functions(rule, zh)]
+    res_list = []
+    for mnemo, id_nomenclature in referential.functions_qualif:
+        if mnemo in COMBINATION_POSITIONS:
+            res_list.insert(COMBINATION_POSITIONS[mnemo], selected_ids.count(id_nomenclature))
+    return "".join(str(res) for res in res_list)
+
+
+def _get_qualif(rule, zh, referential):
+    abb = rule.abb
+    hierarchy = referential.hierarchy
+    if abb in ("sdage", "thread"):
+        return getattr(zh, VALUE_COLUMNS[abb])
+    if abb in HERITAGE_RULES:
+        nb = getattr(zh, VALUE_COLUMNS[abb]) or 0
+        for attribute_id, _, _ in rule.items:
+            bounds = referential.item_values.get(attribute_id)
+            if bounds is not None and bounds[0] <= nb <= bounds[1]:
+                return attribute_id
+        raise ZHApiError(
+            message="Item class: __get_qualif_heritage",
+            details=f"no {abb} item for the value {nb}",
+        )
+    if abb == "eco":
+        if _get_selected_functions(rule, zh):
+            return hierarchy["res"]
+        return hierarchy["iso"]
+    if abb in FUNCTION_RULES:
+        combination = _get_combination(rule, zh, referential)
+        if combination not in referential.combinations:
+            raise ZHApiError(
+                message="Item class: __get_qualif_cat4_cat5",
+                details=f"no qualification for the combination {combination}",
+            )
+        return referential.combinations[combination]
+    if abb == "status":
+        statuses = zh.statuses
+        nothing = rule.get_nomencs(hierarchy.get("0"))
+        if not statuses or any(status in nothing for status in statuses):
+            return hierarchy.get("0")
+        high = rule.get_nomencs(hierarchy.get("fort"))
+        if any(status in high for status in statuses):
+            return hierarchy.get("fort")
+        return hierarchy.get("faible")
+    if abb == "management":
+        plan_id = referential.management_plan_id
+        if plan_id is not None and plan_id in zh.plans:
+            return hierarchy["OUI"]
+        return hierarchy["NON"]
+    if abb in ("hydro", "bio"):
+        cd = getattr(zh, VALUE_COLUMNS[abb])
+        if cd is None:
+            raise ZHApiError(
+                message="Item class: __get_qualif_val",
+                details=f"no {abb} diagnostic for the zh",
+            )
+        return hierarchy.get(FCT_STATE_QUALIFS.get(cd))
+    return None
+
+
+def _get_knowledge(rule, zh, qualif_id, referential):
+    abb = rule.abb
+    if abb == "hab":
+        return 3 if zh.is_carto_hab else 2
+    if abb in ("flore", "vertebrates", "invertebrates"):
+        is_naturalist_plan = any(plan in referential.naturalist_ids for plan in zh.plans)
+        return 3 if zh.is_other_inventory or is_naturalist_plan else 2
+    if abb == "protection":
+        selected_functions = _get_selected_functions(rule, zh)
+        if len(selected_functions) in [0, 1]:
+            return 2
+        knowledges = [function.id_knowledge for function in selected_functions]
+        return 3 if knowledges.count(referential.high_knowledge_id) >= 2 else 2
+    if abb in ("epuration", "support"):
+        rule_nomencs = {nomenc_id for nomenc_id, _ in rule.nomencs}
+        functions = [
+            function
+            for function in zh.functions
+            if function.id_qualification == qualif_id and function.id_function in rule_nomencs
+        ]
+        if len(functions) == 1:
+            note_ids = referential.knowledge_notes.get(functions[0].id_knowledge, ())
+            if len(note_ids) == 1:
+                return note_ids[0]
+        # if no function selected, return lacunaire ou nulle
+        return 2
+    return 1
+
+
+def _get_inactive_item(rule):
+    return {
+        "active": False,
+        "qualification": None,
+        "knowledge": None,
+        "name": rule.name,
+        "note": "Non paramétrée",
+    }
+
+
+def _get_item(rule, note, qualif_id, knowledge, referential):
+    return {
+        "active": True,
+        "qualification": referential.labels.get(qualif_id, (None, None))[0],
+        "knowledge": None if knowledge == 1 else referential.knowledge_labels.get(knowledge),
+        "name": rule.name,
+        "note": get_str_note(note, rule.denominator),
+    }
+
+
+def score_item(rule, zh, referential):
+    """
+    Returns the item of the hierarchy of a zh for a rule, and the cor_zh_notes row
+    of the rule (None if the rule is not active in the river basin)
+    """
+    if not rule.active:
+        return _get_inactive_item(rule), None
+
+    qualif_id = _get_qualif(rule, zh, referential)
+    if qualif_id not in rule.attribute_ids:
+        raise ZHApiError(
+            message="wrong_qualif",
+            details="zh qualif ({}) provided for {} rule is not part of the qualif list defined in the river basin hierarchy rules".format(
+                referential.labels.get(qualif_id, (None, qualif_id))[1], rule.abb
+            ),
+            status_code=400,
+        )
+    knowledge = _get_knowledge(rule, zh, qualif_id, referential)
+    notes = rule.notes.get((qualif_id, knowledge), ())
+    if len(notes) != 1:
+        raise ZHApiError(
+            message="Item class: __set_note",
+            details=f"{len(notes)} notes defined for the {rule.abb} qualification and knowledge",
+        )
+    note = round(notes[0], 2)
+    row = {
+        "id_zh": zh.id_zh,
+        "cor_rule_id": rule.cor_rule_id,
+        "note": note,
+        "attribute_id": qualif_id,
+        "note_type_id": knowledge,
+    }
+    return _get_item(rule, note, qualif_id, knowledge, referential), (note, row)
+
+
+def read_item(rule, stored, referential):
+    """
+    Returns the item of the hierarchy of a zh for an active rule and its note,
+    from the stored cor_zh_notes values (note, attribute_id, note_type_id).
+    Returns None if the note is missing or was not computed with the current
+    rules of the river basin
+    """
+    if stored is None:
+        return None
+    stored_note, qualif_id, knowledge = stored
+    notes = rule.notes.get((qualif_id, knowledge), ())
+    if len(notes) != 1 or stored_note is None or round(notes[0], 2) != stored_note:
+        return None
+    note = round(notes[0], 2)
+    return _get_item(rule, note, qualif_id, knowledge, referential), note
+
+
+def get_totals(model: RuleModel, notes: dict) -> dict:
+    """
+    Computes the notes of the categories and volets of a zh, its global and
+    final notes from the notes of its rules (note by rule abbreviation, None
+    for the rules not active), by rb_notes_summary column
+    """
+    denominators = model.denominators
+    totals = {"global_note": 0}
+    total_denom = 0
+    for _, volet_col, categories in HIERARCHY_LAYOUT:
+        volet_note = 0
+        for _, _, cat_col, abbs in categories:
+            cat_note = round(sum(notes.get(abb) or 0 for abb in abbs))
+            totals[cat_col] = cat_note
+            volet_note += cat_note
+        totals[volet_col] = volet_note
+        totals["global_note"] += volet_note
+        total_denom += denominators[volet_col] or 0
+
+    global_note = totals["global_note"]
+    if total_denom != 0:
+        final_note = round(((global_note / total_denom) * 100), 1) if global_note != 0 else 0
+    else:
+        final_note = None
+    totals["total_denominator"] = total_denom
+    totals["final_note"] = final_note
+    return totals
+
+
+def build_hierarchy(model: RuleModel, items: dict):
+    """
+    Builds the hierarchy of a zh (same structure as Hierarchy.as_dict) from
+    the items of its rules and their notes, (item, note) by rule abbreviation
+    """
+    denominators = model.denominators
+    totals = get_totals(model, {abb: item[1] for abb, item in items.items()})
+    hierarchy = {"river_basin_name": model.name}
+    for volet_key, volet_col, categories in HIERARCHY_LAYOUT:
+        volet = {}
+        for cat_key, cat_abb, cat_col, abbs in categories:
+            volet[cat_key] = {
+                "items": [items[abb][0] for abb in abbs],
+                "note": get_str_note(totals[cat_col], denominators[cat_col]),
+                "name": model.referential.categories[cat_abb],
+            }
+        volet["note"] = get_str_note(totals[volet_col], denominators[volet_col])
+        hierarchy[volet_key] = volet
+
+    hierarchy["global_note"] = get_str_note(totals["global_note"], totals["total_denominator"])
+    hierarchy["final_note"] = get_str_note(totals["final_note"], 100)
+    return hierarchy
+
+
+def get_layout_rules(model: RuleModel):
+    """
+    Returns the rules of the hierarchy layout of a river basin
+    """
+    return [
+        model.rules[abb]
+        for _, _, categories in HIERARCHY_LAYOUT
+        for _, _, _, abbs in categories
+        for abb in abbs
+    ]
+
+
+def score_zh(zh: ZhSnapshot, model: RuleModel):
+    """
+    Computes the hierarchy of a zh with the rules of its river basin
+
+    Returns the hierarchy, with the same structure as Hierarchy.as_dict,
+    and its cor_zh_notes rows
+    """
+    items = {}
+    rows = []
+    for rule in get_layout_rules(model):
+        item, scored = score_item(rule, zh, model.referential)
+        items[rule.abb] = (item, None)
+        if scored is not None:
+            items[rule.abb] = (item, scored[0])
+            rows.append(scored[1])
+    return build_hierarchy(model, items), rows
+
+
+def read_hierarchy(model: RuleModel, stored: dict):
+    """
+    Builds the hierarchy of a zh from its stored notes, (note, attribute_id,
+    note_type_id) by cor_rule_id, without computing them
+
+    Returns None if a note of an active rule is missing or was not computed
+    with the current rules of the river basin
+    """
+    items = {}
+    for rule in get_layout_rules(model):
+        if not rule.active:
+            items[rule.abb] = (_get_inactive_item(rule), None)
+            continue
+        item = read_item(rule, stored.get(rule.cor_rule_id), model.referential)
+        if item is None:
+            return None
+        items[rule.abb] = item
+    return build_hierarchy(model, items)
+
+
+def get_dependent_rules(fields):
+    """
+    Returns the abbreviations of the hierarchy rules depending on the given
+    fields of the zh forms (HIERARCHY_DEPENDENCIES)
+    """
+    return {abb for field in fields for abb in HIERARCHY_DEPENDENCIES.get(field, ())}
@@ -1,13 +1,25 @@
+import json
 import unicodedata
 
+from geojson import Feature
 from ref_geo.models import BibAreasTypes, LAreas
 from geonature.utils.env import DB
 from pypnnomenclature.models import TNomenclatures
-from sqlalchemy import and_, desc, func, or_
-from sqlalchemy.sql.expression import select
-from utils_flask_sqla.generic import GenericQuery
+from pypnusershub.db.models import Organisme, User
+from sqlalchemy import Unicode, and_, cast, exists, false, func, literal, null, or_
+from sqlalchemy.orm import aliased
+from sqlalchemy.sql.expression import select, union_all
+from werkzeug.exceptions import BadRequest
 
 from .api_error import ZHApiError
+from .cache import (
+    NOTES_DATA,
+    ZH_DATA,
+    VersionedCache,
+    get_notes_summary,
+    get_version,
+    make_key,
+)
 from .constants import (
     COR_RUB,
     COR_VOLET,
@@ -21,10 +33,13 @@ from .model.zh_schema import (
     TZH,
     BibHierCategories,
     BibHierPanes,
+    CorLimList,
     CorRbRules,
+    CorZhArea,
+    CorZhHydro,
     CorZhNotes,
+    CorZhRb,
     TFunctions,
-    THydroArea,
     TManagementPlans,
     TManagementStructures,
     TOwnership,
@@ -33,10 +48,52 @@ from .model.zh_schema import (
 )
 
 
+# area types whose intersections with the zh are stored in cor_zh_area
+# when the zh is saved (see forms.create_zh)
+MATERIALIZED_AREA_TYPES = ("COM", "DEP")
+
+# zh nomenclature columns counted by get_facets
+FACET_NOMENCLATURES = {
+    "sdage": TZH.id_sdage,
+    "diag_hydro": TZH.id_diag_hydro,
+    "diag_bio": TZH.id_diag_bio,
+}
+
+# same expression as the gin trigram index pr_zh.i_t_zh_fullname_trgm
+UNACCENT_FULLNAME = func.lower(func.pr_zh.immutable_unaccent(TZH.main_name + " " + TZH.code))
+
+# aliases used by the zh list query to join the update author and its organism
+coauthor = aliased(User, name="coauthor")
+coorganism = aliased(Organisme, name="coorganism")
+
+COUNT_MODES = ("exact", "estimate", "none")
+
+LIST_MODES = ("full", "light")
+
+# columns of the light list computed by aggregation, only selected if displayed
+AGGREGATED_COLUMNS = ("bassin_versant", "delims")
+
+count_cache = VersionedCache()
+
+
 def strip_accents(s):
     return "".join(c for c in unicodedata.normalize("NFD", s) if unicodedata.category(c) != "Mn")
 
 
+def get_list_query():
+    """
+    Query of the zh list, joined with the columns it can be sorted on
+    """
+    return (
+        DB.session.query(TZH)
+        .join(TNomenclatures, TZH.sdage)
+        .join(User, TZH.authors)
+        .join(coauthor, TZH.coauthors)
+        .join(Organisme, User.organisme)
+        .join(coorganism, coauthor.organisme)
+    )
+
+
 def main_search(query, json):
     for key in json.keys():
         if key in TZH.__table__.columns:
@@ -104,11 +161,241 @@ def main_search(query, json):
     # --- Hierarchy search
     hierarchy = json.get("hierarchy")
     if hierarchy is not None and basin is not None:
-        query = filter_hierarchy(query, json=hierarchy, basin=basin[0].get("name"))
+        query = filter_hierarchy(query, json=hierarchy, id_rb=basin[0].get("code"))
 
     return query
 
 
+def filter_scope(query, user, scope: int):
+    """
+    Restricts the query to the zh the user can read with this scope,
+    with the rules of ZhModel.user_is_allowed_to: all the zh for scope 3,
+    the zh created by the user (scope 1) or by a member of the user's
+    organism (scope 2)
+    """
+    if scope == 3:
+        return query
+    if scope not in (1, 2):
+        return query.filter(false())
+    is_owner = TZH.create_author == user.id_role
+    if scope == 1:
+        return query.filter(is_owner)
+    organism_members = select([User.id_role]).where(User.id_organisme == user.id_organisme)
+    return query.filter(or_(is_owner, TZH.create_author.in_(organism_members)))
+
+
+def get_scope_key(user, scope: int):
+    """
+    Part of the user's identity the result of filter_scope depends on
+    """
+    if scope == 1:
+        return [scope, user.id_role]
+    if scope == 2:
+        return [scope, user.id_role, user.id_organisme]
+    return [scope]
+
+
+def get_total(query, mode="exact", search=None, scope=None, user=None):
+    """
+    Returns the number of zh of the (unpaginated) list query
+
+    Args:
+        mode(str): "exact" counts the rows (cached until t_zh, one of its
+        child tables or the hierarchy notes are written), "estimate" uses the planner estimate of
+        pr_zh.t_zh when the list is not filtered (no search, scope 3),
+        "none" skips the count
+        search(dict): search json used to filter the query
+        scope(int): read scope of the user the query is filtered with
+        user: user the query is filtered for
+    """
+    if mode not in COUNT_MODES:
+        raise BadRequest(f"count must be one of {', '.join(COUNT_MODES)}")
+    if mode == "none":
+        return None
+    if mode == "estimate" and not search and scope == 3:
+        estimate = DB.session.execute(
+            "SELECT reltuples::bigint FROM pg_class WHERE oid = 'pr_zh.t_zh'::regclass"
+        ).scalar()
+        # reltuples is -1 (or 0 on old postgres) until the table is analyzed
+        if estimate is not None and estimate > 0:
+            return estimate
+
+    key = make_key(search or None, get_scope_key(user, scope))
+    # the hierarchy search filters on the notes
+    version = (get_version(ZH_DATA), get_version(NOTES_DATA))
+    total = count_cache.get(key, version)
+    if total is None:
+        total = query.count()
+        count_cache.set(key, version, total)
+    return total
+
+
+def get_light_query(query, columns):
+    """
+    Projection of the zh list query on the properties used by the map list:
+    basin names and delimitation criteria are aggregated by postgres instead
+    of being queried for each zh by the TZH hybrid properties
+
+    Args:
+        columns(list): props of the map list columns
+    """
+    entities = [
+        TZH.id_zh,
+        TZH.main_name,
+        TZH.code,
+        TZH.id_sdage,
+        TZH.create_author,
+        TZH.create_date,
+        TZH.update_date,
+        func.ST_AsGeoJSON(TZH.geom).label("geometry"),
+    ]
+    for prefix, user, organism in (
+        ("author", User, Organisme),
+        ("coauthor", coauthor, coorganism),
+    ):
+        entities += [
+            user.id_role.label(f"{prefix}_id_role"),
+            user.nom_role.label(f"{prefix}_nom_role"),
+            user.prenom_role.label(f"{prefix}_prenom_role"),
+            user.nom_complet.label(f"{prefix}_nom_complet"),
+            organism.id_organisme.label(f"{prefix}_id_organisme"),
+            organism.nom_organisme.label(f"{prefix}_nom_organisme"),
+        ]
+    if "bassin_versant" in columns:
+        entities.append(
+            select([func.coalesce(func.string_agg(TRiverBasin.name, ", "), "")])
+            .where(and_(CorZhRb.id_zh == TZH.id_zh, TRiverBasin.id_rb == CorZhRb.id_rb))
+            .correlate(TZH.__table__)
+            .label("bassin_versant")
+        )
+    if "delims" in columns:
+        # TNomenclatures is already joined (sdage) by the list query
+        lim = aliased(TNomenclatures)
+        entities.append(
+            select([func.coalesce(func.string_agg(lim.mnemonique, ", "), "")])
+            .where(
+                and_(
+                    CorLimList.id_lim_list == TZH.id_lim_list,
+                    lim.id_nomenclature == CorLimList.id_lim,
+                )
+            )
+            .correlate(TZH.__table__)
+            .label("delims")
+        )
+    return query.with_entities(*entities)
+
+
+def get_light_feature(row, columns):
+    """
+    GeoJSON feature of a light list row, with the same properties as the
+    serialized TZH for the map list
+    """
+    properties = {
+        "id_zh": row.id_zh,
+        "main_name": row.main_name,
+        "code": row.code,
+        "id_sdage": row.id_sdage,
+        "create_author": row.create_author,
+        "create_date": str(row.create_date) if row.create_date else None,
+        "update_date": str(row.update_date) if row.update_date else None,
+    }
+    for prefix, key in (("author", "authors"), ("coauthor", "coauthors")):
+        properties[key] = {
+            "id_role": getattr(row, f"{prefix}_id_role"),
+            "nom_role": getattr(row, f"{prefix}_nom_role"),
+            "prenom_role": getattr(row, f"{prefix}_prenom_role"),
+            "nom_complet": getattr(row, f"{prefix}_nom_complet"),
+            "id_organisme": getattr(row, f"{prefix}_id_organisme"),
+            "organisme": {
+                "id_organisme": getattr(row, f"{prefix}_id_organisme"),
+                "nom_organisme": getattr(row, f"{prefix}_nom_organisme"),
+            },
+        }
+    for column in AGGREGATED_COLUMNS:
+        if column in columns:
+            properties[column] = getattr(row, column)
+    return Feature(id=row.id_zh, geometry=json.loads(row.geometry), properties=properties)
+
+
+def get_facets(query):
+    """
+    Number of zh of the (filtered) query for each value of the search
+    panel filters, computed in one statement over the filtered zh ids
+
+    Returns a dict facet name: list of {id, code, label, count}
+    """
+    filtered = query.with_entities(TZH.id_zh).distinct().cte("filtered_zh")
+
+    def facet(name, id_, code, label, from_):
+        return (
+            select(
+                [
+                    literal(name).label("facet"),
+                    id_.label("id"),
+                    cast(null() if code is None else code, Unicode).label("code"),
+                    cast(label, Unicode).label("label"),
+                    func.count(filtered.c.id_zh.distinct()).label("count"),
+                ]
+            )
+            .select_from(from_)
+            .group_by(*[column for column in (id_, code, label) if column is not None])
+        )
+
+    facets = []
+    for name, column in FACET_NOMENCLATURES.items():
+        facets.append(
+            facet(
+                name,
+                column,
+                TNomenclatures.cd_nomenclature,
+                TNomenclatures.mnemonique,
+                TZH.__table__.join(filtered, filtered.c.id_zh == TZH.id_zh).outerjoin(
+                    TNomenclatures.__table__, TNomenclatures.id_nomenclature == column
+                ),
+            )
+        )
+    facets.append(
+        facet(
+            "statuts",
+            TOwnership.id_status,
+            TNomenclatures.cd_nomenclature,
+            TNomenclatures.mnemonique,
+            TOwnership.__table__.join(filtered, filtered.c.id_zh == TOwnership.id_zh).join(
+                TNomenclatures.__table__, TNomenclatures.id_nomenclature == TOwnership.id_status
+            ),
+        ).where(TOwnership.id_status.isnot(None))
+    )
+    facets.append(
+        facet(
+            "departement",
+            LAreas.id_area,
+            LAreas.area_code,
+            LAreas.area_name,
+            CorZhArea.__table__.join(filtered, filtered.c.id_zh == CorZhArea.id_zh)
+            .join(LAreas.__table__, LAreas.id_area == CorZhArea.id_area)
+            .join(BibAreasTypes.__table__, BibAreasTypes.id_type == LAreas.id_type),
+        ).where(BibAreasTypes.type_code == "DEP")
+    )
+    facets.append(
+        facet(
+            "basin",
+            TRiverBasin.id_rb,
+            None,
+            TRiverBasin.name,
+            CorZhRb.__table__.join(filtered, filtered.c.id_zh == CorZhRb.id_zh).join(
+                TRiverBasin.__table__, TRiverBasin.id_rb == CorZhRb.id_rb
+            ),
+        )
+    )
+
+    result = {name: [] for name in [*FACET_NOMENCLATURES, "statuts", "departement", "basin"]}
+    for row in DB.session.execute(union_all(*facets)):
+        result[row["facet"]].append(
+            {"id": row["id"], "code": row["code"], "label": row["label"], "count": row["count"]}
+        )
+    return result
+
+
 def filter_sdage(query, json: dict):
     ids = [obj.get("id_nomenclature") for obj in json]
     return query.filter(TZH.id_sdage.in_(ids))
@@ -117,16 +404,8 @@ def filter_sdage(query, json: dict):
 def filter_nameorcode(query, json: dict):
     # Checks if the code OR the name is already taken
     if json:
-        json = strip_accents(json)
-        # TODO: create index with another function to make unaccent immutable
-        unaccent_fullname = func.lower(func.unaccent(TZH.fullname))
-        subquery = (
-            DB.session.query(TZH.id_zh, func.similarity(unaccent_fullname, json).label("idx_trgm"))
-            .filter(unaccent_fullname.ilike("%" + json + "%"))
-            .order_by(desc("idx_trgm"))
-            .subquery()
-        )
-        return query.filter(TZH.id_zh == subquery.c.id_zh)
+        json = strip_accents(json).lower()
+        return query.filter(UNACCENT_FULLNAME.ilike("%" + json + "%"))
     return query
 
 
@@ -157,6 +436,17 @@ def filter_area(query, json: dict, type_code: str):
     if any(code is None for code in codes):
         return query
 
+    if type_code in MATERIALIZED_AREA_TYPES:
+        # intersections stored in cor_zh_area when the zh is saved
+        return query.filter(
+            exists()
+            .where(CorZhArea.id_zh == TZH.id_zh)
+            .where(CorZhArea.id_area == LAreas.id_area)
+            .where(LAreas.id_type == BibAreasTypes.id_type)
+            .where(BibAreasTypes.type_code == type_code)
+            .where(LAreas.area_code.in_(codes))
+        )
+
     # Filter on departments
     subquery = (
         DB.session.query(LAreas)
@@ -180,16 +470,9 @@ def filter_hydro(query, json):
     codes = [area.get("code", None) for area in json]
 
     if codes and all(code is not None for code in codes):
-        subquery = (
-            DB.session.query(THydroArea)
-            .with_entities(THydroArea.id_hydro, THydroArea.geom)
-            .filter(THydroArea.id_hydro.in_(codes))
-            .subquery()
-        )
-
-        # SET_SRID does not return a valid geom...
+        # intersections stored in cor_zh_hydro when the zh is saved
         query = query.filter(
-            func.ST_Transform(func.ST_SetSRID(TZH.geom, 4326), 4326).ST_Intersects(subquery.c.geom)
+            exists().where(CorZhHydro.id_zh == TZH.id_zh).where(CorZhHydro.id_hydro.in_(codes))
         )
 
     return query
@@ -199,18 +482,9 @@ def filter_basin(query, json):
     codes = [area.get("code", None) for area in json]
 
     if codes is not None:
-        subquery = (
-            DB.session.query(TRiverBasin)
-            .with_entities(
-                TRiverBasin.id_rb,
-                TRiverBasin.geom,
-            )
-            .filter(TRiverBasin.id_rb.in_(codes))
-            .subquery()
-        )
-        # SET_SRID does not return a valid geom...
+        # intersections stored in cor_zh_rb when the zh is saved
         query = query.filter(
-            func.ST_Transform(func.ST_SetSRID(TZH.geom, 4326), 4326).ST_Intersects(subquery.c.geom)
+            exists().where(CorZhRb.id_zh == TZH.id_zh).where(CorZhRb.id_rb.in_(codes))
         )
 
     return query
@@ -324,8 +598,8 @@ def filter_evaluations(query, json: dict):
     return query
 
 
-def filter_hierarchy(query, json: dict, basin: str):
-    global_notes = get_global_notes(basin)
+def filter_hierarchy(query, json: dict, id_rb: int):
+    global_notes = get_global_notes(id_rb)
 
     and_ = json.get("and", False)
     hierarchy = json.get("hierarchy")
@@ -354,20 +628,10 @@ def filter_hierarchy(query, json: dict, basin: str):
     return query
 
 
-def get_global_notes(basin: str):
-    if basin is None:
+def get_global_notes(id_rb: int):
+    if id_rb is None:
         raise AttributeError("Basin must not be None")
-    query = GenericQuery(
-        DB=DB,
-        tableName="rb_notes_summary",
-        schemaName="pr_zh",
-        filters={"bassin_versant": basin, "orderby": "bassin_versant"},
-        limit=1,
-    )
-
-    results = query.return_query()
-
-    return [note for note in results.get("items", [])][0]
+    return get_notes_summary(id_rb)
 
 
 def generate_global_attributes_subquery(attributes: list, global_notes: dict):
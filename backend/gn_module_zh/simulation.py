@@ -0,0 +1,196 @@
+# What-if simulation of the hierarchy: scores all the zh of a river basin
+# with a candidate rule set, in memory, and compares the notes and ranks
+# with the current rules. Nothing is written in the database.
+from dataclasses import replace
+from statistics import mean, median
+
+from geonature.utils.env import DB
+
+from .api_error import ZHApiError
+from .constants import HIERARCHY_LAYOUT
+from .model.hierarchy import FrozenDict
+from .model.zh_schema import TZH, CorZhRb
+from .scoring import _chunks, get_rule_model, load_zh_data
+from .scoring_kernel import get_layout_rules, get_totals, score_item
+from .search import filter_scope
+
+# notes whose distribution is returned
+DISTRIBUTION_NOTES = ("final_note", "global_note", "volet_1", "volet_2")
+
+# width of the classes of the final note histogram (final note out of 100)
+HISTOGRAM_STEP = 10
+
+
+def _wrong_rule_set(details):
+    return ZHApiError(message="wrong_rule_set", details=details, status_code=400)
+
+
+def _get_candidate_items(abb, items):
+    if not isinstance(items, list):
+        raise _wrong_rule_set(f"items of the {abb} rule must be a list")
+    try:
+        return tuple(
+            (int(item["attribute_id"]), item["note"], int(item.get("note_type_id") or 1))
+            for item in items
+        )
+    except (KeyError, TypeError, ValueError):
+        raise _wrong_rule_set(
+            f"items of the {abb} rule must have an attribute_id, a note and a note_type_id"
+        )
+
+
+def get_candidate_model(model, rule_set: dict):
+    """
+    Returns the rules of a river basin modified by a candidate rule set:
+
+        {"rules": {"<t_rules abbreviation>": {
+            "active": true|false,
+            "items": [{"attribute_id": int, "note": int, "note_type_id": int}, ...]
+        }}}
+
+    The rules not given keep their current parameters, the items given
+    replace the t_items of the rule. The maximum notes of the river basin are
+    computed from the candidate rules as in pr_zh.rb_notes_summary.
+    """
+    candidates = rule_set.get("rules") if isinstance(rule_set, dict) else None
+    if not isinstance(candidates, dict):
+        raise _wrong_rule_set("the rule set must have a rules object")
+    rules = dict(model.rules)
+    for abb, candidate in candidates.items():
+        if abb not in rules:
+            raise _wrong_rule_set(f"unknown rule {abb}")
+        if not isinstance(candidate, dict):
+            raise _wrong_rule_set(f"the {abb} rule must be an object")
+        rule = rules[abb]
+        changes = {}
+        if "items" in candidate:
+            changes["items"] = _get_candidate_items(abb, candidate["items"])
+        active = candidate.get("active", rule.active)
+        if not active:
+            changes["cor_rule_id"] = None
+        elif not rule.active:
+            # the rule is not in cor_rb_rules: fake id, the notes are not written
+            changes["cor_rule_id"] = -rule.rule_id
+        rules[abb] = replace(rule, **changes)
+
+    denominators = dict(model.denominators)
+    for _, volet_col, categories in HIERARCHY_LAYOUT:
+        denominators[volet_col] = 0
+        for _, _, cat_col, abbs in categories:
+            notes = [
+                rules[abb].denominator
+                for abb in abbs
+                if rules[abb].active and rules[abb].denominator is not None
+            ]
+            denominators[cat_col] = sum(notes) if notes else None
+            denominators[volet_col] += denominators[cat_col] or 0
+    denominators["global_note"] = sum(
+        denominators[volet_col] for _, volet_col, _ in HIERARCHY_LAYOUT
+    )
+    return replace(model, rules=FrozenDict(rules), denominators=FrozenDict(denominators))
+
+
+def _score_totals(zh, model):
+    notes = {}
+    for rule in get_layout_rules(model):
+        scored = score_item(rule, zh, model.referential)[1]
+        notes[rule.abb] = scored[0] if scored is not None else None
+    return get_totals(model, notes)
+
+
+def _get_distribution(totals: dict) -> dict:
+    distribution = {}
+    for name in DISTRIBUTION_NOTES:
+        values = [total[name] for total in totals.values() if total[name] is not None]
+        distribution[name] = {
+            "min": min(values, default=None),
+            "max": max(values, default=None),
+            "mean": round(mean(values), 2) if values else None,
+            "median": median(values) if values else None,
+        }
+    histogram = {}
+    for start in range(0, 100, HISTOGRAM_STEP):
+        histogram[f"{start}-{start + HISTOGRAM_STEP}"] = 0
+    for total in totals.values():
+        if total["final_note"] is not None:
+            start = min(int(total["final_note"] // HISTOGRAM_STEP), 100 // HISTOGRAM_STEP - 1)
+            histogram[f"{start * HISTOGRAM_STEP}-{(start + 1) * HISTOGRAM_STEP}"] += 1
+    distribution["final_note_histogram"] = histogram
+    return distribution
+
+
+def _get_ranks(totals: dict) -> dict:
+    # highest final note first, the zh without final note last
+    ranked = sorted(
+        totals,
+        key=lambda id_zh: (
+            totals[id_zh]["final_note"] is None,
+            -(totals[id_zh]["final_note"] or 0),
+            id_zh,
+        ),
+    )
+    return {id_zh: rank for rank, id_zh in enumerate(ranked, start=1)}
+
+
+def simulate_rules(id_rb: int, rule_set: dict, user=None, scope=3) -> dict:
+    """
+    Scores all the zh of a river basin (main river basin) the user can read
+    with the current rules and with a candidate rule set, without writing
+    anything
+
+    Returns the maximum notes, the distributions of the notes and the ranks
+    (by final note) of the zh with both rule sets
+    """
+    current = get_rule_model(id_rb)
+    candidate = get_candidate_model(current, rule_set)
+
+    query = DB.session.query(TZH.id_zh).join(CorZhRb, CorZhRb.id_zh == TZH.id_zh)
+    query = query.filter(CorZhRb.id_rb == id_rb, CorZhRb.is_main)
+    if user is not None:
+        query = filter_scope(query, user, scope)
+    id_zh_list = sorted(id_zh for (id_zh,) in query.all())
+
+    totals = {"current": {}, "candidate": {}}
+    errors = {"current": {}, "candidate": {}}
+    for chunk in _chunks(id_zh_list):
+        for id_zh, zh in load_zh_data(chunk).items():
+            for name, model in (("current", current), ("candidate", candidate)):
+                try:
+                    totals[name][id_zh] = _score_totals(zh, model)
+                except ZHApiError as e:
+                    errors[name][id_zh] = {"message": e.message, "details": e.details}
+
+    ranks = {name: _get_ranks(totals[name]) for name in totals}
+    rank_changes = []
+    for id_zh in id_zh_list:
+        current_rank = ranks["current"].get(id_zh)
+        candidate_rank = ranks["candidate"].get(id_zh)
+        rank_changes.append(
+            {
+                "id_zh": id_zh,
+                "current_rank": current_rank,
+                "candidate_rank": candidate_rank,
+                "change": current_rank - candidate_rank
+                if current_rank is not None and candidate_rank is not None
+                else None,
+                "current_final_note": totals["current"].get(id_zh, {}).get("final_note"),
+                "candidate_final_note": totals["candidate"].get(id_zh, {}).get("final_note"),
+            }
+        )
+    rank_changes.sort(
+        key=lambda rank: (rank["candidate_rank"] is None, rank["candidate_rank"], rank["id_zh"])
+    )
+
+    return {
+        "id_rb": id_rb,
+        "river_basin_name": current.name,
+        "nb_zh": len(id_zh_list),
+        "nb_rank_changes": sum(1 for rank in rank_changes if rank["change"]),
+        "denominators": {
+            "current": dict(current.denominators),
+            "candidate": dict(candidate.denominators),
+        },
+        "distributions": {name: _get_distribution(totals[name]) for name in totals},
+        "errors": errors,
+        "ranks": rank_changes,
+    }
@@ -0,0 +1 @@
+from geonature.tests.fixtures import *  # noqa: F401,F403
@@ -0,0 +1,125 @@
+import uuid
+from contextlib import contextmanager
+from datetime import datetime
+
+import pytest
+from flask import url_for
+from geonature.tests.utils import set_logged_user_cookie
+from geonature.utils.env import DB
+from sqlalchemy import event, func
+
+from gn_module_zh import blueprint as zh_blueprint
+from gn_module_zh.cache import VersionedCache
+from gn_module_zh.model.zh_schema import (
+    TZH,
+    BibOrganismes,
+    CorLimList,
+    CorProtectionLevelType,
+    CorZhProtection,
+    Nomenclatures,
+    TManagementPlans,
+    TManagementStructures,
+)
+
+
+@contextmanager
+def count_queries():
+    """
+    Collects the statements sent to the database in the block
+    """
+    statements = []
+
+    def before_cursor_execute(conn, cursor, statement, parameters, context, executemany):
+        statements.append(statement)
+
+    event.listen(DB.engine, "before_cursor_execute", before_cursor_execute)
+    try:
+        yield statements
+    finally:
+        event.remove(DB.engine, "before_cursor_execute", before_cursor_execute)
+
+
+def create_zh(code, author, nb_structures, nb_plans):
+    """
+    Creates a zh with nb_structures management structures of nb_plans plans
+    each, and as many protections
+    """
+    id_lim_list = uuid.uuid4()
+    id_lim = Nomenclatures.get_nomenclature_info("CRIT_DELIM")[0].id_nomenclature
+    id_nature = Nomenclatures.get_nomenclature_info("PLAN_GESTION")[0].id_nomenclature
+    organisms = DB.session.query(BibOrganismes).limit(nb_structures).all()
+    protections = DB.session.query(CorProtectionLevelType).limit(nb_structures).all()
+    with DB.session.begin_nested():
+        DB.session.add(CorLimList(id_lim_list=id_lim_list, id_lim=id_lim))
+        zh = TZH(
+            code=code,
+            main_name=f"zh {code}",
+            create_author=author.id_role,
+            update_author=author.id_role,
+            create_date=datetime.now(),
+            update_date=datetime.now(),
+            geom=func.ST_GeomFromText(
+                "POLYGON((5.8 44.9, 5.81 44.9, 5.81 44.91, 5.8 44.91, 5.8 44.9))", 4326
+            ),
+            id_lim_list=id_lim_list,
+            id_sdage=Nomenclatures.get_nomenclature_info("SDAGE")[0].id_nomenclature,
+        )
+        DB.session.add(zh)
+        DB.session.flush()
+        for organism, protection in zip(organisms, protections):
+            structure = TManagementStructures(id_zh=zh.id_zh, id_org=organism.id_org)
+            DB.session.add(structure)
+            DB.session.flush()
+            for _ in range(nb_plans):
+                DB.session.add(
+                    TManagementPlans(
+                        id_structure=structure.id_structure,
+                        id_nature=id_nature,
+                        plan_date=datetime.now(),
+                        duration=5,
+                    )
+                )
+            DB.session.add(CorZhProtection(id_zh=zh.id_zh, id_protection=protection.id_protection))
+    return zh
+
+
+@pytest.fixture
+def zh_few_rows(users):
+    return create_zh("TESTQRY00001", users["admin_user"], nb_structures=1, nb_plans=1)
+
+
+@pytest.fixture
+def zh_many_rows(users):
+    return create_zh("TESTQRY00002", users["admin_user"], nb_structures=3, nb_plans=4)
+
+
+@pytest.fixture
+def no_response_cache(monkeypatch):
+    # every request computes the payload of the zh
+    monkeypatch.setattr(
+        zh_blueprint, "get_response_cache", lambda config: VersionedCache(maxsize=0)
+    )
+
+
+@pytest.mark.usefixtures("client_class", "temporary_transaction", "no_response_cache")
+class TestZhQueries:
+    def test_get_zh_by_id_queries(self, users, zh_few_rows, zh_many_rows):
+        """
+        The number of queries of GET /<id_zh> does not depend on the number
+        of rows of the child tables of the zh (both zh have rows in each
+        table: the tables linked to an empty table are not queried)
+        """
+        set_logged_user_cookie(self.client, users["admin_user"])
+        # loads the caches of the process (rules, labels...)
+        response = self.client.get(url_for("pr_zh.get_zh_by_id", id_zh=zh_few_rows.id_zh))
+        assert response.status_code == 200
+
+        counts = []
+        for zh in (zh_few_rows, zh_many_rows):
+            with count_queries() as statements:
+                response = self.client.get(url_for("pr_zh.get_zh_by_id", id_zh=zh.id_zh))
+            assert response.status_code == 200
+            counts.append(len(statements))
+
+        assert len(response.json["properties"]["managements"]) == 3
+        assert counts[0] == counts[1]
@@ -0,0 +1,44 @@
+-- Benchmark of the name or code search (search.filter_nameorcode)
+--
+-- Builds a synthetic 100 000 rows copy of the searched columns of pr_zh.t_zh
+-- with the same trigram index as the migration fa91b5442e2c and shows the plan
+-- of the search query, which must use the index (Bitmap Index Scan on
+-- i_bench_fullname_trgm) instead of a sequential scan.
+--
+-- Requires the migrations of the module (pr_zh.immutable_unaccent).
+-- Usage : psql -d geonature2db -f doc/benchmarks/nameorcode_search.sql
+
+BEGIN;
+
+CREATE TEMPORARY TABLE bench_t_zh (
+    id_zh integer PRIMARY KEY,
+    main_name varchar NOT NULL,
+    code varchar NOT NULL
+) ON COMMIT DROP;
+
+INSERT INTO bench_t_zh (id_zh, main_name, code)
+SELECT
+    i,
+    (ARRAY['Marais', 'Tourbière', 'Étang', 'Prairie humide', 'Ripisylve'])[1 + i % 5]
+        || ' de ' || md5(i::text),
+    lpad((i % 95 + 1)::text, 2, '0') || 'ZH' || lpad(i::text, 6, '0')
+FROM generate_series(1, 100000) AS i;
+
+CREATE INDEX i_bench_fullname_trgm ON bench_t_zh
+    USING gin (lower(pr_zh.immutable_unaccent(main_name || ' ' || code)) gin_trgm_ops);
+
+ANALYZE bench_t_zh;
+
+-- typeahead search on a name
+EXPLAIN (ANALYZE, BUFFERS)
+SELECT id_zh
+FROM bench_t_zh
+WHERE lower(pr_zh.immutable_unaccent(main_name || ' ' || code)) ILIKE '%tourbiere de 4f%';
+
+-- typeahead search on a code
+EXPLAIN (ANALYZE, BUFFERS)
+SELECT id_zh
+FROM bench_t_zh
+WHERE lower(pr_zh.immutable_unaccent(main_name || ' ' || code)) ILIKE '%zh00123%';
+
+ROLLBACK;
@@ -108,6 +108,11 @@ export class ErrorTranslatorService {
         'Impossible de créer la géométrie, le tracé ne pas se situer sur un département de france métropolitaine',
       id: 18,
     },
+    {
+      api: 'pdf_export_failed',
+      front: "La génération du pdf a échoué, veuillez réessayer ou contacter l'administrateur",
+      id: 19,
+    },
   ];
 
   getError(errorMsg: string): error {
@@ -1,11 +1,14 @@
 import { Injectable } from '@angular/core';
 import { HttpClient } from '@angular/common/http';
-import { BehaviorSubject } from 'rxjs';
-import { map } from 'rxjs/operators';
+import { BehaviorSubject, of, throwError, timer } from 'rxjs';
+import { filter, map, switchMap, take } from 'rxjs/operators';
 import { AppConfig } from '@geonature_config/app.config';
 import { DetailsModel } from '../zh-details/models/zh-details.model';
 import { HierarchyModel } from '../zh-details/models/hierarchy.model';
 
+// milliseconds between two reads of the status of a pdf export
+const PDF_EXPORT_POLL = 2000;
+
 @Injectable({
   providedIn: 'root',
 })
@@ -116,10 +119,47 @@ export class ZhDataService {
     );
   }
 
+  postPdfExport(zhId: number) {
+    return this._api.post<any>(
+      `${AppConfig.API_ENDPOINT}/zones_humides/export_pdf/${zhId}/jobs`,
+      {}
+    );
+  }
+
+  getPdfExport(exportId: number) {
+    return this._api.get<any>(
+      `${AppConfig.API_ENDPOINT}/zones_humides/export_pdf/jobs/${exportId}`
+    );
+  }
+
+  downloadPdfExport(exportId: number) {
+    return this._api.get(
+      `${AppConfig.API_ENDPOINT}/zones_humides/export_pdf/jobs/${exportId}/download`,
+      {
+        responseType: 'blob',
+      }
+    );
+  }
+
   getPdf(zhId: number) {
-    return this._api.get(`${AppConfig.API_ENDPOINT}/zones_humides/export_pdf/${zhId}`, {
-      responseType: 'blob',
-    });
+    // the pdf is rendered by the pdf_export_worker: the export is submitted,
+    // its status polled until it is done, then the pdf is downloaded
+    return this.postPdfExport(zhId).pipe(
+      switchMap((pdfExport) =>
+        pdfExport.status === 'done' || pdfExport.status === 'failed'
+          ? of(pdfExport)
+          : timer(PDF_EXPORT_POLL, PDF_EXPORT_POLL).pipe(
+              switchMap(() => this.getPdfExport(pdfExport.id_export)),
+              filter((status) => status.status === 'done' || status.status === 'failed'),
+              take(1)
+            )
+      ),
+      switchMap((pdfExport) =>
+        pdfExport.status === 'failed'
+          ? throwError({ error: { message: 'pdf_export_failed' } })
+          : this.downloadPdfExport(pdfExport.id_export)
+      )
+    );
   }
 
   getDepartments() {